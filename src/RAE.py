@@ -1,200 +1,738 @@
 import traceback
 from interpreter import *
+import grounding
+import codegen
+import state_tracking
+import commands
+from agenda import Agenda
+from event_index import EventIndex
+import method_selection
+import state_server
+import task_sources
+import multiprocessing
+import zlib
+import time
+from event_log import log, DEBUG, INFO, WARNING, ERROR
 # from importlib import import_module
 # import os,sys,inspect
-import random
 
 METHOD_RANDOM_ORDER = False
 
-
-def Rae(method_lib, command_lib, state, task_table, task, debug_flag=False): #We'll need to remove 'task' when we're getting an input stream
+#The method_selection policy that orders the methods of a task for RAE to try, and that is told how they fared. If it's
+#None, methods are tried in the order they were defined in, or in random order if METHOD_RANDOM_ORDER is set
+METHOD_SELECTION_POLICY = None
+
+#How long RAE sleeps, in seconds, when every stack in the agenda is waiting on a command
+COMMAND_POLL_INTERVAL = 0.01
+
+#A commands.CommandExecutor to run commands in a pool of threads, with timeouts; None to call them on RAE's own thread
+COMMAND_EXECUTOR = None
+
+#How many tasks RAE takes from its task source per pass through its loop, how many stacks it lets into the agenda at
+#most (tasks beyond that are left waiting in the source, which holds up whoever is feeding it once it fills up), and how
+#long it waits on the source, in seconds, when it has nothing else to do
+TASK_INTAKE_PER_TICK = 100
+MAX_AGENDA_SIZE = 1000
+SOURCE_WAIT_INTERVAL = 0.1
+
+#How many steps Progress may take on a stack each time the agenda hands it out. The stack is progressed until it issues
+#a command or a method fails, or until the quota runs out; the agenda charges the stack for every step it took, so that
+#the fair shares stay as they were
+PROGRESS_BURST = 1
+
+#What Progress reports having done with a stack: taken a step that stayed within RAE (started or finished a method, or
+#descended into a subtask), issued a command, hit a failure (and retried), or found the stack waiting on its command
+STEP = 'step'
+COMMAND = 'command'
+FAILED = 'failed'
+WAITING = 'waiting'
+
+#A SeRPE.Lookahead that ranks the candidate methods of a task by simulating them with the action models before RAE
+#commits to one; None to take them in the order the selection policy gives
+LOOKAHEAD = None
+
+#Whether a stack that needs a subtask that another stack is already refining, with the same arguments, waits for the
+#outcome of the other stack's refinement instead of refining the subtask itself (see SharedSubtask)
+SHARE_SUBTASKS = False
+
+#The subtasks being refined, when SHARE_SUBTASKS is set: maps each (task, args) onto its SharedSubtask
+shared_subtasks = {}
+
+#A match_network.MatchNetwork of the methods in the method library, which keeps the bindings that satisfy their
+#preconditions' constraints up to date as the state changes, so that grounding only has to look them up; None to join
+#the constraints against the state every time a task is grounded
+MATCH_NETWORK = None
+
+#Whether methods are run as the generator functions codegen.py compiles their bodies into, rather than by walking their
+#ASTs with the Interpreter. The stacks of methods run as generators can't be checkpointed
+GENERATED_METHODS = False
+
+
+class Stack(list):
+    '''A refinement stack in the agenda: a list of method frames (see Progress), along with the command the stack is waiting
+       on, if it's waiting on one (see commands.py). The agenda keeps its scheduling attributes on it as well.
+       key is the stack's identity, which stays the same while the stack is refined: for a stack that Rae admits, it's
+       (task_event, instantiationKey(method)) for the task and the method first chosen for it.'''
+    def __init__(self, frames=(), key=None):
+        list.__init__(self, frames)
+        self.pending = None
+        self.key = key
+
+
+class SharedSubtask:
+    '''A subtask that one stack (the owner) is refining, in the frame at the given depth of the stack, and whose outcome
+       other stacks that need the same subtask wait on. A stack that waits on it holds it as its pending command, and
+       carries on past the subtask once it has finished, or retries its method if the subtask failed.'''
+    def __init__(self, task_event, stack, depth):
+        self.name = task_event[0]
+        self.task_event = task_event
+        self.stack = stack
+        self.depth = depth
+        self.finished = False
+        self.succeeded = False
+        self.subscribers = 0
+
+    def poll(self):
+        return self.finished
+
+
+class StateWait:
+    '''What a stack waits on when its method is waiting for the state to change (see the WAIT decision node of the
+       interpreter): the stack sleeps until one of the state variables in names has been written to. That can only be
+       told if the state variables are a state_tracking.TrackedStateVars; otherwise, the stack is woken every time.'''
+    name = 'wait'
+
+    def __init__(self, state_vars, names):
+        self.state_vars = state_vars
+        self.names = names
+        self.tracked = isinstance(state_vars, state_tracking.TrackedStateVars)
+        self.versions = [state_vars.tableVersion(name) for name in names] if self.tracked else None
+
+    def poll(self):
+        if not self.tracked:
+            return True
+        for (name, version) in zip(self.names, self.versions):
+            if self.state_vars.tableVersion(name) != version:
+                return True
+        return False
+
+    def sleep(self, wake):
+        '''Has wake() called once one of the state variables is written to, so that the agenda needn't poll the stack
+           until then (see agenda.py). Returns False if that can't be told, or the wait is already over.'''
+        if not self.tracked or self.poll():
+            return False
+        self.state_vars.subscribe(self, self.names, wake)
+        return True
+
+
+class Candidates:
+    '''The candidates for the task of a stack frame that are left to be tried: an iterator over them (as iterCandidates
+       returns), along with the version of the state variables it was made against. Once the state variables have been
+       written to, the candidates it has yet to ground were joined against indexes and tables that are out of date, and
+       the ones it has gone past may have become applicable, so Retry grounds the task again instead of going on with it.
+       Only the state variables read in grounding the candidates count, so that a task whose methods keep failing is
+       only grounded again once something its methods depend on has changed. A frame restored from a checkpoint has no
+       iterator, and is grounded again as well.
+       The candidates of an event are grounded from the event methods it matches, which method_map holds; it is None for
+       a task, whose candidates come from the task_method_map.'''
+    def __init__(self, iterator, state, method_map=None):
+        self.state_vars = state["state_vars"]
+        self.version = getattr(self.state_vars, "version", None)
+        self.reads = set()
+        self.method_map = method_map
+        self.iterator = iterator
+        if iterator is not None and self.version is not None:
+            self.iterator = self.recording(iterator)
+
+    def recording(self, iterator):
+        #Notes the state variables read in grounding each candidate, including those the lookahead grounds up front
+        while True:
+            self.state_vars.startReads()
+            try:
+                candidate = next(iterator, None)
+            finally:
+                self.reads |= self.state_vars.stopReads()
+            if candidate is None:
+                return
+            yield candidate
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.iterator is None:
+            raise StopIteration
+        return next(self.iterator)
+
+    def current(self, state):
+        '''Returns True if none of the state variables read in grounding the candidates has been written to since the
+           iterator was made, which can only be told if they are a state_tracking.TrackedStateVars.'''
+        state_vars = state["state_vars"]
+        if self.iterator is None or self.version is None or state_vars is not self.state_vars:
+            return False
+        if state_tracking.ALL_TABLES in self.reads:
+            return state_vars.version == self.version
+        for name in self.reads:
+            if state_vars.tableVersion(name) > self.version:
+                return False
+        return True
+
+
+def Rae(method_lib, command_lib, state, task_table, task=None, debug_flag=False, task_method_map=None, cache=True, source=None,
+        agenda=None, event_method_map=None, replica=None, checkpoint=None):
     '''This is the main method for RAE, which will loop infinitely as it expects to receive tasks/events and refine a set
        of methods into a plan to complete these tasks/events with the Progress and Retry functions.
-       task_event is a tuple of the form: (task_name, (arg1, arg2, ...))'''
-
-    print "\n STARTING RAE\n"
-
-    agenda = [] #making agenda a list instead of a set so we can have mutable stacks in the agenda (and don't have to return them from Progress/Retry)
-
-    #Keep rae running indefinitely or add option for shutting down?
-    # From Sunandita: Can do this based on the output of getTaskEvents(). RAE stops when its empty?
-	#Can't it be given inputs at arbitrary times?
-    te_inputs = [task]
-    while len(agenda) > 0 or len(te_inputs) > 0:
-        #te_inputs = getTasksEvents()
+       task_event is a tuple of the form: (task_name, (arg1, arg2, ...))
+       task_method_map maps each task name to the names of the methods that address it (see meth_parser); it is built
+       from method_lib if not supplied.
+       Unless cache is False, the candidates of each task are cached until the state they were computed from changes;
+       to tell when it does, state['state_vars'] is replaced by a TrackedStateVars (see state_tracking).
+       Tasks can be given one at a time as task, or streamed in from source, a task_sources.TaskSource; RAE keeps running
+       until the agenda is empty and the source (if any) is exhausted, i.e. indefinitely if the source is never closed.
+       A task_event may also carry a dict of scheduling options as a third element, as in (task_name, (args), {'priority':
+       1, 'deadline': time.time() + 5, 'weight': 2.0}); agenda is the agenda.Agenda that schedules the stacks, if the
+       caller wants to keep an eye on its counters.
+       Events come in the same way as tasks, and are dispatched to the methods they trigger through an
+       event_index.EventIndex of the event methods in method_lib, which are listed in event_method_map (see meth_parser).
+       If RAE is one of several workers sharing the state (see shardedRae), replica is its state_server.StateReplica: the
+       state variables are pulled from the state server before every pass through the loop, and whatever a stack writes
+       to them is pushed right after the stack is progressed. If the push conflicts with another worker's, the stack's
+       method is retried.
+       checkpoint is a checkpoint.Checkpointer that the agenda and the state variables are saved with as RAE goes along.
+       If it holds a checkpoint already, RAE resumes from it: the state variables and the stacks in the agenda are
+       restored, and task, which was taken in before the checkpoint was, isn't taken in again. The frames of the stacks
+       go on where they left off, except that a command that was under way is taken to have failed. A checkpoint can't
+       be kept while GENERATED_METHODS is set.
+       If MATCH_NETWORK is set, it's attached to the state (once the state variables have been restored or pulled, if
+       they are), and the methods it holds are grounded by looking their bindings up in it.
+       What RAE does is reported to event_log.log; setting debug_flag lowers its level to DEBUG (if it's above it) for as
+       long as RAE runs.'''
+
+    if checkpoint is not None and GENERATED_METHODS:
+        raise ValueError("methods run as generators (GENERATED_METHODS) can't be checkpointed")
+
+    level = log.level
+    if debug_flag and not log.debug:
+        log.set_level(DEBUG)
+    try:
+        raeLoop(method_lib, command_lib, state, task_table, task, debug_flag, task_method_map, cache, source, agenda,
+                event_method_map, replica, checkpoint)
+    finally:
+        log.set_level(level)
+
+def raeLoop(method_lib, command_lib, state, task_table, task, debug_flag, task_method_map, cache, source, agenda,
+            event_method_map, replica, checkpoint):
+    '''Runs RAE, as Rae describes, once Rae has checked its arguments and set the level of the log.'''
+    if log.info:
+        log.emit(INFO, 'rae_started', task=task)
+
+    if task_method_map is None:
+        task_method_map = buildTaskMethodMap(method_lib)
+    events = EventIndex(method_lib, event_method_map)
+    #The pure expressions of the method bodies are compiled once, up front (see interpreter.compile_method_body), and
+    #so are the bodies themselves if they're run as generators
+    for method in method_lib.itervalues():
+        compile_method_body(method, task_table, command_lib)
+        if GENERATED_METHODS:
+            codegen.generated(method, task_table, command_lib)
+    #Subtasks left behind by an earlier run will never finish
+    shared_subtasks.clear()
+
+    restored = checkpoint.load() if checkpoint is not None else None
+    if restored is not None:
+        state["state_vars"] = restored[1]
+
+    if replica is not None:
+        replica.attach(state)
+
+    if cache is True:
+        cache = state_tracking.CandidateCache()
+        if not isinstance(state["state_vars"], state_tracking.TrackedStateVars):
+            state["state_vars"] = state_tracking.TrackedStateVars(state["state_vars"])
+    elif cache is False:
+        cache = None
+
+    if MATCH_NETWORK is not None:
+        MATCH_NETWORK.attach(state)
+
+    #The agenda hands out the stacks to progress in order of priority, deadline and fair share (see agenda.py)
+    if agenda is None:
+        agenda = Agenda()
+
+    te_inputs = [task] if task is not None else []
+    if restored is not None:
+        (stacks, _, agenda.virtual_time) = restored
+        for entry in stacks:
+            stack = decodeStack(entry['data'], method_lib, command_lib, task_table, state, events)
+            stack.checkpoint_id = entry['id']
+            agenda.add(stack, entry['priority'], entry['deadline'], entry['weight'], entry['virtual_time'])
+        #A shared subtask whose stack wasn't restored will never finish, and the stacks waiting on it retry instead
+        for (task_event, shared) in shared_subtasks.items():
+            if shared.stack is None:
+                del shared_subtasks[task_event]
+                shared.finished = True
+        checkpoint.adopt(state["state_vars"])
+        te_inputs = []
+        if log.info:
+            log.emit(INFO, 'checkpoint_restored', stacks=len(stacks))
+
+    #RAE keeps running for as long as its source stays open
+    passes = 0
+    while len(agenda) > 0 or len(te_inputs) > 0 or (source and not source.exhausted()):
+        #Take in the tasks that have arrived, as far as the agenda has room for them
+        if source and len(agenda) < MAX_AGENDA_SIZE:
+            te_inputs.extend(getTasksEvents(source, min(TASK_INTAKE_PER_TICK, MAX_AGENDA_SIZE - len(agenda))))
+        if len(agenda) == 0 and len(te_inputs) == 0:
+            source.wait(SOURCE_WAIT_INTERVAL)
+            continue
+
+        if replica is not None:
+            replica.pull(state)
 
         #Here, we'll get task and event inputs and initialize them in the agenda
-        print "\nRunning inputs loop..."
         while len(te_inputs) > 0:
-            task_event = te_inputs.pop(0)
-            candidates = getCandidates(method_lib, task_event, state, debug_flag)
-
-            if not candidates:
-                print "Failure: No methods found that address " + task_event[0] + " with " + str(task_event[1])
+            (task_event, options) = splitTaskEvent(te_inputs.pop(0))
+            method_map = None
+            if task_event[0] in events:
+                #Only the methods whose patterns the event matches are grounded
+                method_map = {task_event[0]: events.match(task_event[0], task_event[1])}
+                if log.debug:
+                    log.emit(DEBUG, 'event_dispatched', name=task_event[0], args=task_event[1],
+                             methods=method_map[task_event[0]])
+            candidates = Candidates(iterCandidates(method_lib, task_event, state, debug_flag,
+                                                   method_map or task_method_map, cache), state, method_map)
+            candidates = lookAhead(method_lib, command_lib, task_table, task_event, state, candidates, task_method_map)
+            #From Sunandita: Can try out different ways to choose the method in future instead of just poping the first one
+            method = next(candidates, None)
+
+            if not method:
+                if log.warning:
+                    log.emit(WARNING, 'no_methods', task=task_event[0], args=task_event[1])
 
             else:
-                print "Got candidates: " + str(candidates)
-                #From Sunandita: Can try out different ways to choose the method in future instead of just poping the first one
-                method = candidates.pop(0)
-                tried = list()
-                if [(task_event, method, None, tried)] not in agenda:
-                    agenda.append([(task_event, method, None, tried)]) #Third element is 'i' normally, but we'll use an Interpreter generator object instead
-
-        #Now we'll progress each stack in the agenda once and only add it back to the agenda if Progress succeeded
-        #From Sunandita: We add a stack back only when stack is not empty and Progress has succeeded. Yes?
-		#Return None if Progress does not succeed
-        temp_agenda = []
-
-        #Print stacks for debugging
-        print "\nCurrent stacks in the agenda:\n"
-        stack_num = 0
-        for stack in agenda:
-            instantiation = []
-            print "Stack " + str(stack_num) + ":\n["
-            for i in range(len(stack)):
-                for key, value in stack[i][1][1].iteritems():
-                    instantiation.append(str(key) + " = " + str(value['val']))
-                print "(" + str(stack[i][0]) + ", (" + str(stack[i][1][0]) + ", {" + str(instantiation) + "}), Interpreter, " + str(stack[i][3]) + ")"
-            print "]\n"
-
-        #Progress stacks and only add back to agenda ones that haven't finished
-        print "Running Progress loop..."
-        for stack in agenda:
-            Progress(method_lib, command_lib, task_table, state, stack, debug_flag)
-
-            if stack:
-                temp_agenda.append(stack)
-
-        agenda = temp_agenda
-
-    print "\nRAE finished"
-
-def getTasksEvents():
-    return [] #Need to get input stream here
-
-
-
+                if log.debug:
+                    log.emit(DEBUG, 'task_admitted', task=task_event[0], args=task_event[1], method=method[0])
+                #Don't add a stack that's already in the agenda and has yet to be progressed. Only the stack admitted last
+                #for a task and method can be such a stack, so the agenda's index of stack keys is all we need to check
+                key = (task_event, instantiationKey(method))
+                if not isUnstarted(agenda.find(key)):
+                    #Third element is 'i' normally, but we'll use an Interpreter generator object instead
+                    agenda.add(Stack([(task_event, method, None, set(), candidates)], key), options.get('priority', 0),
+                               options.get('deadline'), options.get('weight', 1.0))
+
+        #Log the stacks for debugging, unless all of them are just waiting on their commands
+        if log.debug and not agenda.all_blocked():
+            log.emit(DEBUG, 'agenda', stacks=describeAgenda(agenda), counters=agenda.stats())
+
+        #Progress the stacks the agenda hands out; it only keeps the ones that haven't finished. A stack that is waiting
+        #on a command is parked: Progress only checks on the command, and the other stacks go on being progressed
+        passes += 1
+        for stack in agenda.tick():
+            steps = progressBurst(method_lib, command_lib, task_table, state, stack, debug_flag, task_method_map, cache)
+            if steps > 1:
+                agenda.charge(stack, steps - 1)
+            #The stack's writes, its commands' included (see commands.py), are all made while it's progressed, and so are
+            #committed as its own
+            if replica is not None and not replica.push(state):
+                if log.warning:
+                    log.emit(WARNING, 'state_conflict', stack=stack.key)
+                if stack:
+                    Retry(stack, debug_flag, method_lib, state, task_method_map, cache)
+
+        if checkpoint is not None and checkpoint.due():
+            saveCheckpoint(checkpoint, agenda, state)
+
+        #Don't spin while every stack is waiting on a command
+        if agenda.all_blocked():
+            time.sleep(COMMAND_POLL_INTERVAL)
+
+    if checkpoint is not None:
+        saveCheckpoint(checkpoint, agenda, state)
+
+    if cache and log.info:
+        log.emit(INFO, 'candidate_cache', hits=cache.hits, misses=cache.misses)
+    if MATCH_NETWORK is not None and log.info:
+        log.emit(INFO, 'match_network', bindings=MATCH_NETWORK.size(), updates=MATCH_NETWORK.updates,
+                 lookups=MATCH_NETWORK.lookups)
+    selectionPolicy().save()
+    if log.info:
+        log.emit(INFO, 'rae_finished', passes=passes, agenda=agenda.stats())
+
+def shardedRae(method_lib, command_lib, state, task_table, tasks, workers=2, task_method_map=None, event_method_map=None,
+               shard_key=None, address=None):
+    '''Runs RAE on the task_events in tasks, spread over as many worker processes, which share the state variables through
+       a state server (see state_server.py) listening on address. tasks is either a list of task_events or a task source
+       (see task_sources.py), whose tasks are handed on to the workers as they arrive until it's exhausted. The tasks are
+       sharded by shard_key(task_event) (by default, the task_event itself), so that the tasks with the same key are all
+       refined by the same worker. Once the workers are done, state['state_vars'] is set to the final state variables.
+       The workers are forked from this process, and so start out with the method and command libraries as they are.'''
+    if shard_key is None:
+        shard_key = lambda task_event: task_event[:2]
+    if not isinstance(tasks, task_sources.TaskSource):
+        source = task_sources.QueueSource(0)
+        for task_event in tasks:
+            source.put(task_event)
+        source.close()
+        tasks = source
+    (manager, store) = state_server.serve(state['state_vars'], address)
+    try:
+        queues = [multiprocessing.Queue(MAX_AGENDA_SIZE) for _ in range(workers)]
+        processes = [multiprocessing.Process(target=raeWorker, args=(n, store, queues[n], method_lib, command_lib, state,
+                                                                     task_table, task_method_map, event_method_map))
+                     for n in range(workers)]
+        for process in processes:
+            process.start()
+        #A worker is held up while its queue is full, so that tasks aren't taken off the source faster than they're refined
+        while not tasks.exhausted():
+            task_events = tasks.poll(TASK_INTAKE_PER_TICK)
+            if not task_events:
+                tasks.wait(SOURCE_WAIT_INTERVAL)
+            for task_event in task_events:
+                queues[zlib.crc32(repr(shard_key(task_event))) % workers].put(task_event)
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join()
+        (_, state['state_vars']) = store.snapshot()
+        if log.info:
+            log.emit(INFO, 'state_server_finished', workers=len(processes), **store.stats())
+    finally:
+        manager.shutdown()
+
+def raeWorker(n, store, queue, method_lib, command_lib, state, task_table, task_method_map=None, event_method_map=None):
+    '''Runs RAE as worker n of shardedRae, on the tasks it's handed on queue.'''
+    Rae(method_lib, command_lib, dict(state), task_table, task_method_map=task_method_map,
+        source=task_sources.ProcessQueueSource(queue), event_method_map=event_method_map,
+        replica=state_server.StateReplica(store, n))
+
+def progressBurst(method_lib, command_lib, task_table, state, stack, debug_flag=False, task_method_map=None, cache=None,
+                  quota=None):
+    '''Progresses the stack up to quota (PROGRESS_BURST by default) times, stopping early once it issues a command, a
+       method fails or the stack is done. Returns the number of steps taken.'''
+    if quota is None:
+        quota = PROGRESS_BURST
+    steps = 0
+    while stack and steps < max(quota, 1):
+        status = Progress(method_lib, command_lib, task_table, state, stack, debug_flag, task_method_map, cache)
+        steps += 1
+        if status != STEP:
+            break
+    return steps
+
+def saveCheckpoint(checkpoint, agenda, state):
+    written = checkpoint.save(agenda, state["state_vars"], encodeStack)
+    if log.debug:
+        log.emit(DEBUG, 'checkpoint_saved', stacks=len(agenda), written=written)
+
+def encodeStack(stack):
+    '''Turns a stack into plain data that can be pickled, with the interpreters of its frames replaced by their
+       continuations (see Interpreter.continuation()). The Candidates of the frames are left out, but whether a frame is
+       for an event is kept.'''
+    frames = []
+    owned = []
+    for (depth, (task_event, method, interp, tried, candidates)) in enumerate(stack, 1):
+        event = getattr(candidates, 'method_map', None) is not None
+        frames.append((task_event, method, interp.continuation() if interp else None, set(tried), event))
+        #The frames refining shared subtasks for other stacks as well
+        owner = shared_subtasks.get(task_event)
+        if owner is not None and owner.stack is stack and owner.depth == depth:
+            owned.append(depth)
+    (pending, shared) = (None, None)
+    if isinstance(stack.pending, SharedSubtask):
+        shared = (stack.pending.task_event, stack.pending.finished, stack.pending.succeeded)
+    #A stack waiting on the state needn't be woken on resuming; its interpreter evaluates the loop guard again anyway
+    elif stack.pending and not isinstance(stack.pending, StateWait):
+        pending = stack.pending.name
+    return dict(key=stack.key, frames=frames, pending=pending, shared=shared, owned=owned)
+
+def decodeStack(data, method_lib, command_lib, task_table, state, events=None):
+    '''Rebuilds a stack from what encodeStack turned it into. The frames get their candidates back on their next Retry,
+       which grounds their tasks again and skips the methods they have tried. The frames for events are grounded from the
+       methods in events (an event_index.EventIndex) that they match. The shared subtasks the stack refines, and the one it
+       waits on, are entered in shared_subtasks, so that the stacks restored with it find each other there.'''
+    stack = Stack(key=data['key'])
+    for (task_event, method, continuation, tried, event) in data['frames']:
+        interp = None
+        if continuation is not None:
+            #interpreter.resume, brought in with the rest of the interpreter module
+            interp = resume(continuation, method_lib[continuation['method']], state["state_vars"], task_table,
+                            command_lib)
+        method_map = None
+        if event:
+            method_map = {task_event[0]: events.match(task_event[0], task_event[1])}
+        stack.append((task_event, method, interp, tried, Candidates(None, state, method_map)))
+    for depth in data.get('owned', ()):
+        task_event = stack[depth - 1][0]
+        shared = shared_subtasks.setdefault(task_event, SharedSubtask(task_event, None, None))
+        (shared.stack, shared.depth) = (stack, depth)
+    if data.get('shared') is not None:
+        (task_event, finished, succeeded) = data['shared']
+        if finished:
+            shared = SharedSubtask(task_event, None, None)
+            (shared.finished, shared.succeeded) = (True, succeeded)
+        else:
+            #The stack refining it may not have been restored yet; it takes the subtask over once it is
+            shared = shared_subtasks.setdefault(task_event, SharedSubtask(task_event, None, None))
+        shared.subscribers += 1
+        stack.pending = shared
+    elif data['pending'] is not None:
+        stack.pending = commands.interrupted(data['pending'])
+    return stack
+
+def isUnstarted(stack):
+    '''Returns True if the stack is one that Rae admitted and that hasn't been progressed or retried since.'''
+    return stack is not None and len(stack) == 1 and stack[0][2] is None and not stack[0][3] and \
+        stack.key[1] == instantiationKey(stack[0][1])
+
+def splitTaskEvent(task_event):
+    '''Splits a task_event that may carry scheduling options into the plain (task_name, (args)) and the options dict.'''
+    if len(task_event) > 2:
+        return ((task_event[0], task_event[1]), dict(task_event[2]))
+    return (task_event, {})
+
+def describeAgenda(agenda):
+    '''Returns the stacks in the agenda as lists of the (task_event, method name, instantiation, number of methods tried)
+       of their frames, for the event log.'''
+    stacks = []
+    for stack in agenda:
+        frames = []
+        for frame in stack:
+            instantiation = dict((key, value['val']) for key, value in frame[1][1].iteritems())
+            frames.append((frame[0], frame[1][0], instantiation, len(frame[3])))
+        stacks.append(frames)
+    return stacks
+
+def selectionPolicy():
+    '''Returns the method selection policy in effect (see METHOD_SELECTION_POLICY).'''
+    if METHOD_SELECTION_POLICY is not None:
+        return METHOD_SELECTION_POLICY
+    elif METHOD_RANDOM_ORDER:
+        return method_selection.RandomPolicy()
+    return method_selection.SelectionPolicy()
+
+def recordOutcome(frame, success):
+    '''Tells the method selection policy how the method in the frame fared, if the frame was ever progressed.'''
+    interp = frame[2]
+    if interp is not None and hasattr(interp, "started_at"):
+        selectionPolicy().record(frame[0][0], frame[1][0], success, time.time() - interp.started_at)
+
+def lookAhead(method_lib, command_lib, task_table, task_event, state, candidates, task_method_map=None):
+    '''Returns the candidates for task_event ranked by LOOKAHEAD, if it's set, and as they are otherwise. The candidates
+       that are ranked are taken from the generator up front; the rest are still grounded lazily. Candidates are ranked
+       in place, and keep noting what their grounding reads.'''
+    if LOOKAHEAD is None:
+        return candidates
+    if isinstance(candidates, Candidates):
+        candidates.iterator = LOOKAHEAD.rank(method_lib, task_event, state, candidates.iterator, task_table,
+                                             task_method_map, command_lib)
+        return candidates
+    return LOOKAHEAD.rank(method_lib, task_event, state, candidates, task_table, task_method_map, command_lib)
+
+def getTasksEvents(source=None, max_items=TASK_INTAKE_PER_TICK):
+    '''Returns the task_events that have arrived at the source since the last call, max_items of them at most.'''
+    if source is None:
+        return []
+    return source.poll(max_items)
+
+
+
+
+def buildTaskMethodMap(method_lib):
+    '''Indexes method_lib by task: returns a dict mapping each task name to the list of names of the methods that address it.
+       This is the same map meth_parser builds at load time, for method libraries that come without one; like it, it leaves
+       out the methods that are triggered by events.'''
+    task_method_map = {}
+    for method_name in method_lib:
+        if method_lib[method_name]["task"].get("event"):
+            continue
+        task_method_map.setdefault(method_lib[method_name]["task"]["id"], []).append(method_name)
+    return task_method_map
+
+
+def getCandidates(method_lib, task_event, state, debug_flag=False, task_method_map=None, cache=None):
+    '''returns a list of methods, which are tuples of the form -- (method name,  {arg1:{'v_type':v_type1, 'val':value1}, arg2:{'v_type':v_type2, 'val':value2}, ...})
+       If task_method_map is given, only the methods it lists for the task are tried instead of the whole method_lib.'''
+    return list(iterCandidates(method_lib, task_event, state, debug_flag, task_method_map, cache))
+
+
+def iterCandidates(method_lib, task_event, state, debug_flag=False, task_method_map=None, cache=None):
+    '''A generator version of getCandidates, which yields the applicable method instantiations one at a time, in the same
+       order, and only grounds as far as it needs to in order to produce the next one. RAE keeps the generator in the stack
+       frame of the task (see Candidates), so that Retry can resume it where the previous choice was made instead of
+       starting over, as long as the state hasn't changed in between.
+       If a state_tracking.CandidateCache is given and state['state_vars'] is a TrackedStateVars, the candidates are taken
+       from the cache for as long as none of the state variables read in computing them has changed.'''
+    state_vars = state.get("state_vars")
+    #The order of the candidates depends on the selection policy, so candidates cached under another ordering won't do,
+    #and those of a policy that orders them differently every time won't do at all. They also depend on the methods the
+    #map lists, which for an event are the ones it triggers, and for a task of the same name the ones that address it
+    policy = selectionPolicy()
+    methods = tuple(task_method_map.get(task_event[0], ())) if task_method_map is not None else None
+    key = (task_event[0], task_event[1], policy.generation, methods)
+    try:
+        hash(key)
+    except TypeError: #can't cache on unhashable task arguments
+        cache = None
+    if not policy.cacheable:
+        cache = None
+    if cache is None or not isinstance(state_vars, state_tracking.TrackedStateVars):
+        for candidate in groundCandidates(method_lib, task_event, state, debug_flag, task_method_map):
+            yield candidate
+        return
 
-def getCandidates(method_lib, task_event, state, debug_flag=False):
-    '''returns a list of methods, which are tuples of the form -- (method name,  {arg1:{'v_type':v_type1, 'val':value1}, arg2:{'v_type':v_type2, 'val':value2}, ...})'''
-    print "Starting getCandidates for " + task_event[0] + ":"
+    cached = cache.lookup(key, state_vars)
+    if cached is not None:
+        if log.debug:
+            log.emit(DEBUG, 'candidate_cache_hit', task=task_event[0], args=task_event[1])
+        #The candidates depend on the state variables read in computing them, as if they had been read again
+        state_vars.noteReads(cache.tablesRead(key))
+        for n in range(len(cached)):
+            #If the state has changed since the last candidate was handed out, the rest of the list may no longer apply;
+            #ground the task again instead, skipping the candidates already handed out
+            if n > 0 and cache.current(key, state_vars) is not cached:
+                for candidate in groundCandidates(method_lib, task_event, state, debug_flag, task_method_map):
+                    if candidate not in cached[:n]:
+                        yield candidate
+                return
+            yield cached[n]
+        return
 
+    #Record the state variables read while grounding, and only cache the result if it was computed all the way through
+    #without the state changing in between
+    start_version = state_vars.version
     candidates = []
+    reads = set()
+    grounded = groundCandidates(method_lib, task_event, state, debug_flag, task_method_map)
+    while True:
+        state_vars.startReads()
+        try:
+            candidate = next(grounded, None)
+        finally:
+            reads |= state_vars.stopReads()
+        if candidate is None:
+            break
+        candidates.append(candidate)
+        yield candidate
+    if state_vars.version == start_version:
+        cache.store(key, state_vars, candidates, reads)
+
+
+def groundCandidates(method_lib, task_event, state, debug_flag=False, task_method_map=None):
+    '''Does the work of iterCandidates, without the cache.'''
+    if log.debug:
+        log.emit(DEBUG, 'grounding_started', task=task_event[0], args=task_event[1])
 
     task_name = task_event[0]
     task_instantiation_tup = task_event[1]
 
+    #Hash indexes over the state tables, shared by all the methods grounded below
+    indexes = {}
+    network = MATCH_NETWORK
+    if network is not None and (network.method_lib is not method_lib or not network.tracks(state)):
+        network = None
+
     #Extract the relevant methods from the method_lib whose preconditions evaluate to True given the state
-    method_names = []
-    for method_name in method_lib:
-        if method_lib[method_name]["task"]["id"] == task_name:
-            method_names.append(method_name)
-    if METHOD_RANDOM_ORDER:
-        random.shuffle(method_names)
+    if task_method_map is None:
+        task_method_map = buildTaskMethodMap(method_lib)
+    method_names = selectionPolicy().order(task_name, task_method_map.get(task_name, []))
 
     for method_name in method_names:
-        print "Trying method: " + method_name
-        print "Trying to instantiate method: " + method_name + " for task: " + task_name
+        if log.debug:
+            log.emit(DEBUG, 'method_tried', method=method_name, task=task_name)
         #Need to try all permutations of variables to instantiate what was not given by the task.
         #Will be considered good method instantiation if precond_func evaluates to true
         method_arguments_list = method_lib[method_name]["parameters"]
         task_arguments_list = method_lib[method_name]["task"]["parameters"]
         if len(task_arguments_list) != len(task_instantiation_tup):
-            print "ERROR: Task: " + task_name + " only given " + str(len(task_instantiation_tup)) + \
-            " arguments, but expects " + str(len(task_arguments_list)) + " arguments in Method: " + method_name
-            return []
+            if log.error:
+                log.emit(ERROR, 'task_arity_mismatch', task=task_name, given=len(task_instantiation_tup),
+                         expected=len(task_arguments_list), method=method_name)
+            return
+
+        #The match network has the bindings that satisfy the constraints at hand; otherwise, they're joined here
+        if network is not None and method_name in network:
+            method_bindings = network.lookup(method_name, task_instantiation_tup)
+        else:
+            method_bindings = groundMethod(method_lib, method_name, task_instantiation_tup, state, indexes, debug_flag)
+        for binding in method_bindings:
+            poss_environment = {}
+            for argument, poss_value in binding.iteritems():
+                #Add it to environment dictionary that will be kept if preconditions evaluates to true
+                poss_environment[argument] = typed(poss_value)
+
+            #Log every tried instantiation if set to debug
+            if debug_flag and log.debug:
+                log.emit(DEBUG, 'instantiation_tried', method=method_name, binding=binding)
+
+            #Evaluate preconditions and yield this instantiation if true. The compiled preconditions take the binding as
+            #an argument, so the method library is never written to and groundings can safely run side by side
+            applicable = False
+            try:
+                precond_func = method_lib[method_name]["preconditions"]["compiled"]
+                if precond_func(state, binding):
+                    applicable = True
+                    if log.debug:
+                        log.emit(DEBUG, 'instantiation_applicable', method=method_name, binding=binding)
+            except Exception as e: #precondition function ran into undefined dictionary entries or something
+                if debug_flag and log.debug:
+                    log.emit(DEBUG, 'precondition_error', method=method_name, binding=binding, error=e)
+
+            if applicable:
+                yield (method_name, poss_environment)
 
-        #Create a bunch of lists of what each argument could be
-        #WE WILL NEED TO CHANGE THIS PART ONCE WE HAVE OBJECT TYPING IN METHODS
-        poss_instantiation_queues = {}
-        for argument in method_arguments_list:
-            poss_instantiation_queues[argument] = []
 
-            if argument not in task_arguments_list:
+def groundMethod(method_lib, method_name, task_instantiation_tup, state, indexes, debug_flag=False):
+    '''Yields the bindings of the parameters of the method for its task with the arguments in task_instantiation_tup that
+       satisfy the relational constraints of its preconditions, as joined against the state by the grounding engine.'''
+    method_arguments_list = method_lib[method_name]["parameters"]
+    task_arguments_list = method_lib[method_name]["task"]["parameters"]
+
+    #Create a bunch of lists of what each argument could be. A typed parameter can only be one of the objects of its
+    #type, while an untyped one could be any object in the domain
+    parameter_types = method_lib[method_name].get("parameter_types", {})
+    poss_instantiation_queues = {}
+    for argument in method_arguments_list:
+        poss_instantiation_queues[argument] = []
+
+        if argument not in task_arguments_list:
+            if argument in parameter_types:
+                poss_instantiation_queues[argument].extend(state["objects"].get(parameter_types[argument], []))
+            else:
                 for object_type, object_set in state["objects"].iteritems():
                     for object in object_set:
                         poss_instantiation_queues[argument].append(object)
-            else: #argument already instantiated, so can get the one in the task instantiation tuple in the same position
-                if debug_flag:
-                    print "Task Arguments: " + str(task_arguments_list)
-                    print "Task Instantiation: " + str(task_instantiation_tup)
+        else: #argument already instantiated, so can get the one in the task instantiation tuple in the same position
+            if debug_flag and log.debug:
+                log.emit(DEBUG, 'task_arguments', parameters=task_arguments_list, args=task_instantiation_tup)
 
-                ndx = task_arguments_list.index(argument)
+            ndx = task_arguments_list.index(argument)
+            if argument not in parameter_types or \
+                    task_instantiation_tup[ndx] in state["objects"].get(parameter_types[argument], []):
                 poss_instantiation_queues[argument].append(task_instantiation_tup[ndx])
 
-        #Create all permutations by keeping track of an index list that corresponds to the ordering of the arguments
-        #in method_arguments_list.
-        ndx_list = []
-        for key in poss_instantiation_queues:
-            ndx_list.append(0)
-
-        #Then try to run the preconditions for each permutation in poss_instantiation_queues
-        while ndx_list[0] < len(poss_instantiation_queues[method_arguments_list[0]]):
-            ndx_loc = 0
-            meth_environment_dict = method_lib[method_name]["preconditions"]
-            poss_environment = {}
-            for argument in method_arguments_list:
-                poss_value = poss_instantiation_queues[argument][ndx_list[ndx_loc]]
-                ndx_loc += 1
-
-                #Add argument:poss_value to meth_environment_dict
-                #We need to undo this later to not update our method library!
-                meth_environment_dict[argument] = poss_value
-
-                #And also add it to environment dictionary that will be kept if preconditions evaluates to true
-                v_type = 'val_none'
-                if isinstance(poss_value, str):
-                    v_type = 'val_str'
-                elif isinstance(poss_value, (int, float, long)):
-                    v_type = 'val_num'
-                elif isinstance(poss_value, bool):
-                    v_type = 'val_bool'
-                poss_environment[argument] = {'v_type':v_type, 'val':poss_value}
-
-            #Print every tried instantiation if set to debug
-            if debug_flag:
-                printstr = "Trying instantiation: {"
-                for key, value in poss_environment.iteritems():
-                    printstr += key + " : " + str(value['val']) + ", "
-                print printstr + "}"
-
-            #Evaluate preconditions and store this instantiation in candidates if true
-            try:
-                precond_func = method_lib[method_name]["preconditions"]["preconditions"]
-                if precond_func(state):
-                    candidates.append((method_name, poss_environment))
-
-                    printstr = "Success with trying instantiation: {"
-                    for key, value in poss_environment.iteritems():
-                        printstr += key + " : " + str(value['val']) + ", "
-                    print printstr + "}"
-            except Exception as e: #precondition function ran into undefined dictionary entries or something
-                if debug_flag:
-                    print 'Precondition Error: {}'.format(e)
-                pass
-
-            #We need to undo the changes to teh meth_environment_dict so we can use different instantiations later
-            for argument in method_arguments_list:
-                del meth_environment_dict[argument]
-
-            #We're going to increment the index at the end of ndx_list by one and propogate this change toward the start
-            #of the list so we go through every possible permutation
-            rvrs_ndx = len(ndx_list) - 1
-            ndx_list[rvrs_ndx] += 1
-            while rvrs_ndx > 0 and ndx_list[rvrs_ndx] >= len(poss_instantiation_queues[method_arguments_list[rvrs_ndx]]):
-                ndx_list[rvrs_ndx] = 0
-                rvrs_ndx -= 1
-                ndx_list[rvrs_ndx] += 1
+    #A parameter with nothing to instantiate it with (e.g. a task argument of the wrong type) rules the method out
+    if not all(poss_instantiation_queues.values()):
+        if debug_flag and log.debug:
+            log.emit(DEBUG, 'no_type_compatible_instantiation', method=method_name)
+        return
 
-    return candidates
+    #Rather than trying every permutation of the possible values, let the grounding engine join the relational
+    #constraints of the preconditions against the state tables, and only run the preconditions on what survives
+    for binding in grounding.ground(method_lib[method_name].get("pre_constraints", []), method_arguments_list,
+                                    poss_instantiation_queues, state, indexes):
+        yield binding
 
 
-def Progress(method_lib, command_lib, task_table, state, stack, debug_flag=False):
+def Progress(method_lib, command_lib, task_table, state, stack, debug_flag=False, task_method_map=None, cache=None):
     '''This method will refine the current stack.
-       Stack is a bunch of method frames of the form: (task_event, method, Interpreter, tried)
-       and method contains it's name and the current instantiation of its arguments: (method name,  {arg1:{'v_type':v_type1, 'val':value1}, arg2:{'v_type':v_type2, 'val':value2}, ...})'''
+       Stack is a bunch of method frames of the form: (task_event, method, Interpreter, tried, candidates)
+       where tried is the set of the instantiationKeys of the methods already tried for task_event,
+       candidates is the Candidates left for task_event,
+       and method contains it's name and the current instantiation of its arguments: (method name,  {arg1:{'v_type':v_type1, 'val':value1}, arg2:{'v_type':v_type2, 'val':value2}, ...})
+       Returns what it did with the stack: STEP, COMMAND, FAILED or WAITING.'''
 
-    print "Progressing stack:"
+    if log.debug:
+        log.emit(DEBUG, 'progress', depth=len(stack))
 
     top_tup = stack[len(stack) - 1]
 
@@ -202,6 +740,32 @@ def Progress(method_lib, command_lib, task_table, state, stack, debug_flag=False
     method = top_tup[1]
     interp = top_tup[2]
     tried = top_tup[3]
+    candidates = top_tup[4]
+
+    #A parked stack only moves on once the command it's waiting on has finished
+    pending = getattr(stack, "pending", None)
+    if isinstance(pending, StateWait):
+        if not pending.poll():
+            return WAITING
+        stack.pending = None
+        return STEP
+    if isinstance(pending, SharedSubtask):
+        if not pending.finished:
+            return WAITING
+        stack.pending = None
+        if pending.succeeded:
+            return STEP
+        Retry(stack, debug_flag, method_lib, state, task_method_map, cache)
+        return FAILED
+    if pending:
+        if pending.poll():
+            stack.pending = None
+            if pending.status == commands.TIMEOUT and log.warning:
+                log.emit(WARNING, 'command_timed_out', command=pending.name, timeout=pending.timeout)
+            elif pending.error is not None and log.error:
+                log.emit(ERROR, 'command_error', command=pending.name, error=pending.error)
+            return commandFinished(stack, pending.result, debug_flag, method_lib, state, task_method_map, cache)
+        return WAITING
 
     #Instead of using the line pointer 'i,' we'll keep track of the Interpreter object that
     #will lazily yield the branch nodes
@@ -209,8 +773,17 @@ def Progress(method_lib, command_lib, task_table, state, stack, debug_flag=False
     #TODO: otherwise, the Interpreter won't be able to distinguish task invocations from
     #TODO: state variable reads and similar looking syntactic constructs
     if not interp:
-        print "Instantiating Interpreter instance"
-        interp = Interpreter(method_lib[method[0]], method[1], state, task_table, command_lib, 'RAE')
+        if log.debug:
+            log.emit(DEBUG, 'interpreter_started', method=method[0])
+        #The interpreter gets its own copy of the instantiation, which its assignments would otherwise change under the
+        #candidates that are cached or kept in tried
+        if GENERATED_METHODS:
+            interp = codegen.interpreter_for(method_lib[method[0]], dict(method[1]), state["state_vars"], task_table,
+                                             command_lib, 'RAE')
+        else:
+            interp = Interpreter(method_lib[method[0]], dict(method[1]), state["state_vars"], task_table, command_lib,
+                                 'RAE')
+        interp.started_at = time.time() #for the method selection policy's statistics
 
     # next_node = interp.next()
 
@@ -226,94 +799,181 @@ def Progress(method_lib, command_lib, task_table, state, stack, debug_flag=False
         for each in interp_args:
             args = args + (each['val'],)
 
-        print("\ngot a node = " + next_node.__repr__() + "\n\n")
+        if log.debug:
+            log.emit(DEBUG, 'decision_node', node=next_node)
 
         if node_type == "ACTION": #is command
-            print "Performing command: " + str(id)
+            if log.debug:
+                log.emit(DEBUG, 'command_started', command=id, args=args)
             command = command_lib[id]
-            args = (state,) + args
-            res = command(*args)
+            if COMMAND_EXECUTOR is not None:
+                #The command works on a copy of the state, its changes to which are made here once it's done
+                res = COMMAND_EXECUTOR.start(id, command, args, state)
+            else:
+                res = commands.start(id, command, (state,) + args)
 
-            if res:
-                print "Command succeded"
-                interp.action_result = res
-                stack[len(stack) - 1] = (task_event, method, interp, tried)
-                return
-            else: #command failed
-                print "Command failed"
-                Retry(stack, debug_flag, method_lib, state)
-                return
+            #The interpreter has to be kept in the frame, since it'll be resumed once the command is done
+            stack[len(stack) - 1] = (task_event, method, interp, tried, candidates)
+            if isinstance(res, commands.PendingCommand):
+                if log.debug:
+                    log.emit(DEBUG, 'command_pending', command=id)
+                stack.pending = res
+                return COMMAND
+            return commandFinished(stack, res, debug_flag, method_lib, state, task_method_map, cache)
 
         elif node_type == "TASK": #is task
-            print "Got task: " + str(id)
-            candidates = getCandidates(method_lib, (id, args), state, debug_flag)
-            if not candidates:
-                Retry(stack, debug_flag, method_lib, state)
-            else:
-                method_primed = candidates.pop(0)
-                tried_primed = set()
-                stack.append(('task_event_primed', method_primed, None, tried_primed))
-            return
+            if log.debug:
+                log.emit(DEBUG, 'subtask', task=id, args=args)
+            #The interpreter has to be kept in the frame, since it'll be resumed once the subtask is done
+            stack[len(stack) - 1] = (task_event, method, interp, tried, candidates)
+            if SHARE_SUBTASKS:
+                shared = shared_subtasks.get((id, args))
+                if shared is not None and not waitsOn(shared, stack):
+                    if log.debug:
+                        log.emit(DEBUG, 'subtask_shared', task=id, args=args)
+                    shared.subscribers += 1
+                    stack.pending = shared
+                    return WAITING
+            candidates_primed = Candidates(iterCandidates(method_lib, (id, args), state, debug_flag, task_method_map,
+                                                          cache), state)
+            candidates_primed = lookAhead(method_lib, command_lib, task_table, (id, args), state, candidates_primed,
+                                          task_method_map)
+            method_primed = next(candidates_primed, None)
+            if not method_primed:
+                Retry(stack, debug_flag, method_lib, state, task_method_map, cache)
+                return FAILED
+            stack.append(((id, args), method_primed, None, set(), candidates_primed))
+            if SHARE_SUBTASKS and (id, args) not in shared_subtasks:
+                shared_subtasks[(id, args)] = SharedSubtask((id, args), stack, len(stack))
+            return STEP
+
+        elif node_type == "WAIT": #Method is waiting for the state variables it names to change
+            if log.debug:
+                log.emit(DEBUG, 'state_wait', state_vars=id)
+            stack[len(stack) - 1] = (task_event, method, interp, tried, candidates)
+            stack.pending = StateWait(state["state_vars"], id)
+            return WAITING
 
         elif node_type == "FAIL": #Method returned failure
-            print "Method failed"
-            Retry(stack, debug_flag, method_lib, state)
-            return
+            if log.debug:
+                log.emit(DEBUG, 'method_failed', method=method[0])
+            Retry(stack, debug_flag, method_lib, state, task_method_map, cache)
+            return FAILED
 
     except StopIteration: #Should have reached the end of the method if error raised
-        print "Finished method: " + str(method[0])
+        if log.debug:
+            log.emit(DEBUG, 'method_finished', method=method[0])
+        recordOutcome(top_tup, True)
         stack.pop()
-        return
+        finishSubtask(stack, task_event, True)
+        return STEP
 
 
     #Should not get here
-    print "ERROR: Unexpected node type: " + node_type
-    return
-
-
-
-
-def Retry(stack, debug_flag, method_lib, state):
-    '''This method will retry other methods that applied to the task. It acts the backtracker'''
-
-    print "Retrying stack: " + str(stack)
-
-    top_tup = stack.pop()
-
-    task_event = top_tup[0]
-    method = top_tup[1]
-    interp = top_tup[2]
-    tried = top_tup[3]
-
-    # sometimes tried is a set
-    tried = list(tried)
-    tried.append(method)
-
-    candidates = getCandidates(method_lib, task_event, state, debug_flag)
-
-    #Can again choose better way to decide candidate here
-    choice = None
-    while candidates and not choice:
-        choice = candidates.pop(0)
-        if choice in tried:
-            choice = None
-
-    #Put this new method on the stack to be tried
-    if choice:
-        stack.append((task_event, choice, None, tried))
-
-    #Retry underlying task if this one completely failed. If no stack left, let it disappear from agenda
-    else:
-        if stack:
-            Retry(stack, debug_flag, method_lib, state)
-        else:
-            print "Failed to accomplish {}".format(task_event)
+    if log.error:
+        log.emit(ERROR, 'unexpected_node_type', node_type=node_type)
+    return FAILED
+
+
+
+
+def commandFinished(stack, res, debug_flag, method_lib, state, task_method_map=None, cache=None):
+    '''Hands the result of the command the top frame of the stack issued to the frame's interpreter, or retries the frame
+       if the command failed. Returns COMMAND, or FAILED if it failed.'''
+    if res:
+        if log.debug:
+            log.emit(DEBUG, 'command_succeeded', result=res)
+        stack[len(stack) - 1][2].action_result = res
+        return COMMAND
+    else: #command failed
+        if log.info:
+            log.emit(INFO, 'command_failed', result=res)
+        Retry(stack, debug_flag, method_lib, state, task_method_map, cache)
+        return FAILED
+
+
+def Retry(stack, debug_flag, method_lib, state, task_method_map=None, cache=None):
+    '''This method will retry other methods that applied to the task. It acts the backtracker
+       The next method is taken from the frame's Candidates, which pick up where the last choice was made, unless the
+       state has changed since they were grounded, in which case the task is grounded again.
+       If a task has no methods left, the frame below it is retried in turn, and so on down the stack; the stack is
+       unwound in a loop, so that there is no limit on how deep it can be.'''
+
+    while stack:
+        if log.debug:
+            log.emit(DEBUG, 'retry', task_event=stack[len(stack) - 1][0], method=stack[len(stack) - 1][1][0], depth=len(stack))
+
+        top_tup = stack.pop()
+        recordOutcome(top_tup, False)
+
+        task_event = top_tup[0]
+        method = top_tup[1]
+        interp = top_tup[2]
+        tried = top_tup[3] if isinstance(top_tup[3], set) else set(top_tup[3])
+        candidates = top_tup[4]
+
+        #tried holds the instantiation keys of the methods tried so far, so checking a candidate against it takes a lookup
+        tried.add(instantiationKey(method))
+
+        #Candidates grounded against a state that has changed since are grounded again; the ones tried are skipped below.
+        #An event is grounded from the event methods it matched, not from the task_method_map
+        if not isinstance(candidates, Candidates) or not candidates.current(state):
+            method_map = candidates.method_map if isinstance(candidates, Candidates) else None
+            candidates = Candidates(iterCandidates(method_lib, task_event, state, debug_flag,
+                                                   method_map or task_method_map, cache), state, method_map)
+
+        #Can again choose better way to decide candidate here
+        choice = None
+        for candidate in candidates:
+            if instantiationKey(candidate) not in tried:
+                choice = candidate
+                break
+
+        #Put this new method on the stack to be tried
+        if choice:
+            stack.append((task_event, choice, None, tried, candidates))
+            return
 
-    return
+        #Otherwise retry the underlying task, if there is one. If no stack is left, let it disappear from agenda
+        finishSubtask(stack, task_event, False)
+        if not stack and log.warning:
+            log.emit(WARNING, 'task_failed', task=task_event[0], args=task_event[1])
+
+
+def finishSubtask(stack, task_event, succeeded):
+    '''Lets the stacks waiting on task_event know how it turned out, if the frame just popped off the stack was the one
+       refining it for them.'''
+    shared = shared_subtasks.get(task_event)
+    if shared is not None and shared.stack is stack and shared.depth == len(stack) + 1:
+        del shared_subtasks[task_event]
+        shared.finished = True
+        shared.succeeded = succeeded
+        if shared.subscribers and log.debug:
+            log.emit(DEBUG, 'shared_subtask_finished', task=task_event[0], args=task_event[1], succeeded=succeeded,
+                     subscribers=shared.subscribers)
+
+def waitsOn(shared, stack):
+    '''Returns True if the owner of the shared subtask is the stack itself, or is waiting (through other shared subtasks)
+       on the stack, in which case the stack can't wait on it in turn.'''
+    seen = set()
+    while shared is not None and id(shared) not in seen:
+        if shared.stack is stack:
+            return True
+        seen.add(id(shared))
+        pending = shared.stack.pending
+        shared = pending if isinstance(pending, SharedSubtask) else None
+    return False
+
+def instantiationKey(method):
+    '''Returns a hashable key identifying a method instantiation (method name,  {arg1:{'v_type':v_type1, 'val':value1}, ...}),
+       of the form (method name, ((arg1, value1), (arg2, value2), ...)), with the arguments in sorted order.'''
+    return (method[0], tuple(sorted((argument, value['val']) for argument, value in method[1].iteritems())))
 
 
 # Set debug_flag to True when calling RAE if you want to see all the tried instantiations
 # EXAMPLE USE:
-import planning_problem
-ppi = planning_problem.PlanningProblem('./../domains/harbor1/harbor1.zip')
-Rae(ppi.method_table, ppi.commands, ppi.domain, ppi.task_table, ('put-in-pile', ('c1','p2')))
+if __name__ == '__main__':
+    import planning_problem
+    ppi = planning_problem.PlanningProblem('./../domains/harbor1/harbor1.zip')
+    Rae(ppi.method_table, ppi.commands, ppi.domain, ppi.task_table, ('put-in-pile', ('c1','p2')),
+        task_method_map=ppi.task_method_map, event_method_map=ppi.event_method_map)
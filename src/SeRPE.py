@@ -1,63 +1,160 @@
-import copy
+import time
+import itertools
 from interpreter import *
 import planning_problem
 import RAE
+from event_log import log, DEBUG, WARNING
 
 # None return used as failure representation (?)
 
-def SeRPE(refine_methods, action_templates, state, task):
-  print "Beginning SeRPE call..."
-  candidates = RAE.getCandidates(refine_methods, task, state, True)
-  print "Candidates were:\n"
-  print candidates
+class DeadlineExceeded(Exception):
+  pass
+
+#The errors an action model or a method can run into on a snapshot of the state that it didn't expect to be in, as when
+#an entry it looks up isn't there; any other error is a bug, and isn't held back from whoever runs the lookahead
+SIMULATION_ERRORS = (LookupError, TypeError, ValueError, ArithmeticError, SemanticError)
+
+def SeRPE(refine_methods, action_templates, state, task, task_method_map=None, task_table=None, deadline=None,
+          action_table=None):
+  '''Plans for task by refining it with refine_methods and simulating its commands with the action models in
+     action_templates, trying the candidate methods depth first. Returns the plan, or None if there is none; the effects
+     of the plan are left in state.
+     task_table is needed to tell task invocations apart from state variable reads (it's gathered from refine_methods if
+     not given), and action_table to tell commands apart (it defaults to action_templates; commands in action_table
+     that have no action model are taken to succeed without effect).
+     If deadline (a time.time() value) passes before planning is done, DeadlineExceeded is raised.'''
+  if log.debug:
+    log.emit(DEBUG, 'serpe_started', task=task)
+  checkDeadline(deadline)
+  candidates = RAE.getCandidates(refine_methods, task, state, False, task_method_map)
+  if log.debug:
+    log.emit(DEBUG, 'serpe_candidates', task=task, candidates=candidates)
   if len(candidates) == 0:
     return None
-  # nondeterministic choice currently as DFS
+  # nondeterministic choice currently as DFS; each candidate is tried on a snapshot of the state, which only replaces the
+  # state once the candidate has succeeded
   for m in candidates:
-    state_copy = copy.deepcopy(state)
-    result = progressToFinish(refine_methods, action_templates, state, task, m)
+    trial_state = snapshotState(state)
+    result = progressToFinish(refine_methods, action_templates, trial_state, task, m, task_method_map, task_table,
+                              deadline, action_table)
     if result != None:
+      state['state_vars'].update(trial_state['state_vars'])
       return result
-    state = state_copy
-    print "backtracking!\n"
+    if log.debug:
+      log.emit(DEBUG, 'serpe_backtracking', task=task, method=m[0])
   return None
 
-def progressToFinish(refine_methods, action_templates, state, task, m):
-  print "Progressing to finish..."
+def progressToFinish(refine_methods, action_templates, state, task, m, task_method_map=None, task_table=None,
+                     deadline=None, action_table=None):
+  if task_table is None:
+    task_table = buildTaskTable(refine_methods)
+  if action_table is None:
+    action_table = action_templates
   plan = []
-  print "Instantiating interpreter"
-  interp = Interpreter(refine_methods[m[0]], m[1], state, pp.task_table, pp.commands)
+  interp = Interpreter(refine_methods[m[0]], dict(m[1]), state['state_vars'], task_table, action_table)
   for (node_type, node_id, node_args) in interp:
+    checkDeadline(deadline)
     args = tuple()
     for arg in node_args:
       args = args + (arg['val'],)
     if node_type == "ACTION":
-      print "Processing command " + str(node_id)
       if node_id not in action_templates:
           continue
       action = action_templates[node_id]
-      args = (state,) + args
-      print("\n\nabout to execute \"" + node_id + "\"\n")
-      print("state = " + state.__repr__() + "\n\n")
-      succeeded = action(*args)
+      succeeded = action(*((state,) + args))
+      if log.debug:
+        log.emit(DEBUG, 'serpe_action', action=node_id, args=args, succeeded=bool(succeeded))
       if succeeded:
-        print "Command \"" + node_id + "\" succeeded\n"
-        print("state = " + state.__repr__() + "\n\n")
         plan.append(action)
       else:
-        print "Command \"" + node_id + "\" failed\n"
-        print("state = " + state.__repr__() + "\n\n")
         return None
     elif node_type == "TASK":
-      print "Processing task" + str(node_id)
-      plan_prime = SeRPE(refine_methods, action_templates, state, (node_id, args))
+      plan_prime = SeRPE(refine_methods, action_templates, state, (node_id, args), task_method_map, task_table, deadline,
+                         action_table)
       if plan_prime != None:
         plan.append(plan_prime)
       else:
         return None
+    elif node_type == "FAIL":
+      return None
+    elif node_type == "WAIT": # nothing but an exogenous event would get the method going again
+      return None
   return plan
 
-pp = planning_problem.PlanningProblem("../domains/simple_domain2.zip")
-print pp
-result = SeRPE(pp.method_table, pp.action_models, pp.domain, ('backtrack', ('r1',)))
-print result
+def snapshotState(state):
+  '''Returns a copy of state that actions can be simulated on without touching state itself: the state variable tables
+     are copied, while the objects and rigid relations, which actions don't change, are shared.'''
+  snapshot = dict(state)
+  snapshot['state_vars'] = dict((name, dict(table)) for name, table in state['state_vars'].items())
+  return snapshot
+
+def buildTaskTable(refine_methods):
+  '''Gathers a task table (see meth_parser) from the tasks the methods in refine_methods address.'''
+  return dict((method['task']['id'], method['task']) for method in refine_methods.values()
+              if not method['task'].get('event'))
+
+def checkDeadline(deadline):
+  if deadline is not None and time.time() > deadline:
+    raise DeadlineExceeded()
+
+def planLength(plan):
+  '''Returns the number of actions in a plan returned by SeRPE.'''
+  return sum(planLength(step) if isinstance(step, list) else 1 for step in plan)
+
+
+class Lookahead:
+  '''Lets RAE choose among the candidate methods for a task by planning ahead with SeRPE: each candidate is simulated
+     on a snapshot of the state with the action models, and the candidates are ranked by the length of the plan they
+     lead to, with the ones that lead to no plan at all last. Simulation stops once budget seconds have gone by, and
+     the candidates that weren't simulated by then keep their places between the two.'''
+
+  def __init__(self, action_models, budget=0.05, max_candidates=10):
+    self.action_models = action_models
+    self.budget = budget
+    self.max_candidates = max_candidates
+
+  def rank(self, method_lib, task_event, state, candidates, task_table=None, task_method_map=None,
+           action_table=None):
+    '''Returns the candidates (an iterator, as returned by RAE.iterCandidates) in ranked order, as an iterator as well:
+       the first max_candidates of them are ranked, and the rest follow in their original order.'''
+    deadline = time.time() + self.budget
+    pool = []
+    for candidate in candidates:
+      pool.append(candidate)
+      if len(pool) >= self.max_candidates:
+        break
+    if len(pool) < 2:
+      return itertools.chain(pool, candidates)
+
+    SUCCESS, UNKNOWN, FAILURE = 0, 1, 2
+    scores = []
+    for (position, candidate) in enumerate(pool):
+      score = (UNKNOWN, 0, position)
+      if time.time() < deadline:
+        try:
+          plan = progressToFinish(method_lib, self.action_models, snapshotState(state), task_event, candidate,
+                                  task_method_map, task_table, deadline, action_table)
+          if plan is None:
+            score = (FAILURE, 0, position)
+          else:
+            score = (SUCCESS, planLength(plan), position)
+        except DeadlineExceeded:
+          pass
+        except SIMULATION_ERRORS as e:
+          if log.warning:
+            log.emit(WARNING, 'lookahead_failed', task=task_event, method=candidate[0], error=repr(e))
+      scores.append(score)
+    if log.debug:
+      log.emit(DEBUG, 'lookahead', task=task_event, scores=[(pool[s[2]][0], s[0], s[1]) for s in scores])
+
+    ranked = [pool[score[2]] for score in sorted(scores)]
+    return itertools.chain(ranked, candidates)
+
+
+# EXAMPLE USE:
+if __name__ == '__main__':
+  pp = planning_problem.PlanningProblem("../domains/simple_domain2.zip")
+  print pp
+  result = SeRPE(pp.method_table, pp.action_models, pp.domain, ('backtrack', ('r1',)), pp.task_method_map,
+                 pp.task_table, action_table=dict(pp.commands, **pp.action_models))
+  print result
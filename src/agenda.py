@@ -0,0 +1,209 @@
+"""
+Date: Sat, 17 Oct 2026
+Last updated: Sat, 17 Oct 2026
+
+Project: RAE/SeRPE implementation
+Component: Agenda Scheduler
+
+Description:
+RAE's agenda holds one refinement stack for each task it's working on, and RAE
+progresses those stacks a step at a time. It used to go around the agenda in a
+circle, one step per stack, so that an urgent task got no more attention than
+any of the hundreds of others ahead of it.
+
+The Agenda class keeps the stacks that can be progressed in a heap, and hands
+them out in order of
+    1) priority: a stack of higher priority always goes first;
+    2) deadline: among stacks of the same priority, the one whose deadline is
+       soonest goes first (a stack without a deadline comes after those with);
+    3) fair share: among the rest, the stack that has had the least of its
+       share of steps goes first. Each stack has a weight, and every step it
+       takes costs it 1/weight of virtual time, so that over time a stack of
+       weight 2 gets twice as many steps as a stack of weight 1.
+Stacks that are waiting on a command (see commands.py) are set aside and only
+polled, and are put back in the heap once their command has finished. A stack
+whose wait can tell when it's over (it has a sleep() method, as RAE's waits on
+the state do) isn't even polled: it sleeps until its wait wakes it, which may
+happen on any thread, and is polled once more on the next pass.
+
+RAE may progress a stack by more than one step at a time; it charges the stack
+for the extra steps (see charge()), which count against its share like the
+others.
+
+The agenda counts how many steps it has handed out and how long the stacks
+waited for them, and how many deadlines were missed; see stats().
+
+Every time a stack is handed out to be progressed, its 'revision' goes up, so
+that whoever is keeping a copy of the stack (see checkpoint.py) can tell
+whether it may have changed since. A stack waiting on a command that is only
+checked on, and is still waiting on the same one afterwards, keeps its
+revision.
+
+A stack may also have a hashable identity (its 'key' attribute), under which
+the agenda indexes it for as long as it's in the agenda, so that RAE can find
+the stack it admitted last for a given task without looking through the rest.
+"""
+
+import time
+import heapq
+import threading
+
+class Agenda:
+    def __init__(self, clock = time.time):
+        self.clock = clock
+        self.heap = []          # entries (sort key, sequence number, stack)
+        self.blocked = []       # stacks waiting on a command
+        self.sleeping = {}      # maps the ids of the stacks asleep onto the stacks
+        self.woken = []         # stacks woken since the last pass, which their waits append to
+        self.lock = threading.Lock()
+        self.index = {}         # maps stack keys onto the stack added last with each
+        self.sequence = 0       # breaks ties in the heap in order of arrival
+        self.virtual_time = 0.0 # the virtual time of the last stack scheduled
+        self.steps = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.missed_deadlines = 0
+
+    def add(self, stack, priority = 0, deadline = None, weight = 1.0, virtual_time = None):
+        """
+        Adds a stack to the agenda, with the given priority, deadline (a time
+        as given by the agenda's clock) and fair-share weight. A stack starts
+        out at the agenda's current virtual time, unless it's given another
+        (as when a stack is restored from a checkpoint).
+        """
+        stack.priority = priority
+        stack.deadline = deadline
+        stack.weight = float(weight) if weight > 0 else 1.0
+        stack.virtual_time = self.virtual_time if virtual_time is None else virtual_time
+        stack.deadline_missed = False
+        stack.revision = 0
+        if getattr(stack, 'key', None) is not None:
+            self.index[stack.key] = stack
+        self._ready(stack)
+
+    def find(self, key):
+        """
+        Returns the stack added last with the given key, if it's still in the
+        agenda, and None otherwise.
+        """
+        return self.index.get(key)
+
+    def tick(self):
+        """
+        Yields the stacks to be progressed for one pass of RAE's loop, and puts
+        each one back in the agenda once the caller has progressed it (unless
+        it has become empty): first every stack waiting on a command, for its
+        command to be checked on, and then as many stacks from the heap as
+        there were in it at the start of the pass, in order.
+        """
+        with self.lock:
+            (woken, self.woken) = (self.woken, [])
+        for stack in woken:
+            if self.sleeping.pop(id(stack), None) is stack:
+                self.blocked.append(stack)
+
+        blocked, self.blocked = self.blocked, []
+        for stack in blocked:
+            polled = self._waiting_on(stack)
+            yield stack
+            self._requeue(stack, polled)
+
+        for _ in range(len(self.heap)):
+            if not self.heap:
+                break
+            (_, _, stack) = heapq.heappop(self.heap)
+            now = self.clock()
+            wait = now - stack.ready_since
+            self.steps += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if stack.deadline is not None and now > stack.deadline and \
+                    not stack.deadline_missed:
+                stack.deadline_missed = True
+                self.missed_deadlines += 1
+            self.virtual_time = max(self.virtual_time, stack.virtual_time)
+            stack.virtual_time += 1.0 / stack.weight
+
+            yield stack
+            self._requeue(stack)
+
+    def charge(self, stack, steps):
+        """
+        Charges a stack the agenda has handed out for the extra steps it was
+        progressed by (beyond the one it was handed out for), so that stacks
+        that are progressed in bursts keep to their fair share.
+        """
+        stack.virtual_time += float(steps) / stack.weight
+        self.steps += steps
+
+    def all_blocked(self):
+        """
+        Returns True if there are stacks in the agenda, but all of them are
+        waiting on commands or asleep.
+        """
+        return bool(self.blocked or self.sleeping) and not self.heap
+
+    def stats(self):
+        """
+        Returns the agenda's counters: the number of stacks ready to be
+        progressed (depth), waiting on commands (blocked) and asleep
+        (sleeping), the number of
+        steps handed out, the total, mean and longest time stacks waited for
+        their steps, and the number of stacks that missed their deadlines.
+        """
+        return dict(
+            depth = len(self.heap),
+            blocked = len(self.blocked),
+            sleeping = len(self.sleeping),
+            steps = self.steps,
+            total_wait = self.total_wait,
+            mean_wait = self.total_wait / self.steps if self.steps else 0.0,
+            max_wait = self.max_wait,
+            missed_deadlines = self.missed_deadlines
+        )
+
+    def __len__(self):
+        return len(self.heap) + len(self.blocked) + len(self.sleeping)
+
+    def __iter__(self):
+        for (_, _, stack) in self.heap:
+            yield stack
+        for stack in self.blocked:
+            yield stack
+        for stack in self.sleeping.values():
+            yield stack
+
+    def _waiting_on(self, stack):
+        # what a blocked stack waits on, and the frame that waits on it
+        return (getattr(stack, 'pending', None), stack[-1] if stack else None)
+
+    def _requeue(self, stack, polled = None):
+        # a stack still waiting where it was when it was polled hasn't changed
+        waiting = self._waiting_on(stack)
+        if polled is None or waiting[0] is not polled[0] or waiting[1] is not polled[1]:
+            stack.revision += 1
+        if not stack:
+            key = getattr(stack, 'key', None)
+            if key is not None and self.index.get(key) is stack:
+                del self.index[key]
+            return
+        pending = getattr(stack, 'pending', None)
+        if pending:
+            sleep = getattr(pending, 'sleep', None)
+            if sleep is not None and sleep(lambda: self._wake(stack)):
+                self.sleeping[id(stack)] = stack
+            else:
+                self.blocked.append(stack)
+        else:
+            self._ready(stack)
+
+    def _wake(self, stack):
+        with self.lock:
+            self.woken.append(stack)
+
+    def _ready(self, stack):
+        stack.ready_since = self.clock()
+        deadline = stack.deadline if stack.deadline is not None else float('inf')
+        key = (-stack.priority, deadline, stack.virtual_time)
+        heapq.heappush(self.heap, (key, self.sequence, stack))
+        self.sequence += 1
@@ -0,0 +1,187 @@
+"""
+Date: Sat, 17 Oct 2026
+Last updated: Sat, 17 Oct 2026
+
+Project: RAE/SeRPE implementation
+Component: Agenda Checkpoints
+
+Description:
+Everything RAE has done towards its tasks lives in its agenda, in the stacks of
+method frames and the interpreters that are partway through them, and is lost
+if RAE stops. A Checkpointer saves the agenda and the state variables to a
+directory every so often, so that RAE can be restarted from where it was (see
+the 'checkpoint' argument of RAE.Rae) rather than from scratch.
+
+Saving is incremental: a stack is only written again if the agenda has handed
+it out since it was last saved (see the 'revision' of a stack in agenda.py),
+and a state variable table only if it has been written to since (which is known
+if the state variables are a state_tracking.TrackedStateVars; otherwise every
+table is written every time). Each stack and table goes to a file of its own,
+under a name that is never reused, and the checkpoint itself is a manifest
+that lists the files that make it up. The manifest is replaced in one step once
+all of them have been written, and only then are the files it no longer lists
+removed, so that a crash in the middle of a save leaves the previous
+checkpoint whole. Every file is synced to disk before it's renamed into place,
+and so is the directory before and after the manifest is replaced, so that
+this holds across a crash of the machine as well.
+
+What a stack is saved as is up to whoever saves it: save() is handed a
+function that turns a stack into something that can be pickled, and load()
+hands back what it was turned into.
+"""
+
+import os
+import time
+import cPickle as pickle
+
+MANIFEST = 'checkpoint.pkl'
+
+class Checkpointer:
+    def __init__(self, directory, interval = 1.0, clock = time.time):
+        """
+        Saves checkpoints to 'directory' (which is created if need be), once
+        every 'interval' seconds by the clock.
+        """
+        self.directory = directory
+        self.interval = interval
+        self.clock = clock
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.saves = 0          # numbers the files, so that no name is reused
+        self.next_id = 0        # the id to give the next new stack
+        self.last_save = None
+        self.stacks = {}        # maps stack ids onto (revision, file) as saved last
+        self.tables = {}        # maps table names onto (version, file) as saved last
+        self.state_vars = None  # the state variables the versions are those of
+        self.written = 0        # the number of stacks and tables written, in all
+
+    def due(self):
+        """
+        Returns True if it's time for another checkpoint.
+        """
+        return self.last_save is None or self.clock() - self.last_save >= self.interval
+
+    def save(self, agenda, state_vars, encode):
+        """
+        Saves a checkpoint of the stacks in the agenda, each turned into
+        something picklable by encode(stack), and of the state variables.
+        Returns the number of stacks and tables written.
+        """
+        self.saves += 1
+        written = 0
+
+        stacks = []
+        for stack in agenda:
+            if getattr(stack, 'checkpoint_id', None) is None:
+                stack.checkpoint_id = self.next_id
+                self.next_id += 1
+            saved = self.stacks.get(stack.checkpoint_id)
+            if saved is None or saved[0] != stack.revision:
+                filename = 'stack-%d-%d.pkl' % (stack.checkpoint_id, self.saves)
+                self._write(filename, encode(stack))
+                saved = self.stacks[stack.checkpoint_id] = (stack.revision, filename)
+                written += 1
+            stacks.append(dict(id = stack.checkpoint_id, file = saved[1],
+                               priority = stack.priority, deadline = stack.deadline,
+                               weight = stack.weight, virtual_time = stack.virtual_time))
+
+        # table versions only mean something for the state variables they were
+        # read off of
+        if state_vars is not self.state_vars:
+            self.tables = {}
+            self.state_vars = state_vars
+        tables = {}
+        for (n, name) in enumerate(sorted(dict.keys(state_vars))):
+            version = state_vars.tableVersion(name) if hasattr(state_vars, 'tableVersion') else None
+            saved = self.tables.get(name)
+            if saved is None or version is None or saved[0] != version:
+                filename = 'table-%d-%d.pkl' % (n, self.saves)
+                self._write(filename, dict(dict.__getitem__(state_vars, name)))
+                saved = self.tables[name] = (version, filename)
+                written += 1
+            tables[name] = saved[1]
+
+        live = set([stack.checkpoint_id for stack in agenda])
+        for stack_id in list(self.stacks):
+            if stack_id not in live:
+                del self.stacks[stack_id]
+        for name in list(self.tables):
+            if name not in tables:
+                del self.tables[name]
+
+        # the files the manifest lists have to be in the directory before it
+        # is, and it has to be before the files it no longer lists are removed
+        self._sync_directory()
+        self._write(MANIFEST, dict(stacks = stacks, tables = tables, saves = self.saves,
+                                   next_id = self.next_id, virtual_time = agenda.virtual_time))
+        self._sync_directory()
+        files = set([entry['file'] for entry in stacks] + tables.values() + [MANIFEST])
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.pkl') and filename not in files:
+                os.remove(os.path.join(self.directory, filename))
+
+        self.last_save = self.clock()
+        self.written += written
+        return written
+
+    def load(self):
+        """
+        Returns the last checkpoint saved in the directory, as (stacks,
+        state_vars, virtual_time), or None if there is none. Each of the
+        stacks is a dict holding the stack as it was encoded ('data'), its id
+        ('id'), and its 'priority', 'deadline', 'weight' and 'virtual_time' in
+        the agenda; state_vars is a dict of the tables, and virtual_time the
+        agenda's.
+        The stacks and tables are taken to be put back into a new agenda (at
+        revision 0) and a new TrackedStateVars (at version 0), as RAE does, so
+        that they aren't written again before they've changed. The stacks have
+        to be given their ids back, as their 'checkpoint_id'.
+        """
+        if not os.path.exists(os.path.join(self.directory, MANIFEST)):
+            return None
+        manifest = self._read(MANIFEST)
+        self.saves = manifest['saves']
+        self.next_id = manifest['next_id']
+
+        stacks = []
+        self.stacks = {}
+        for entry in manifest['stacks']:
+            entry = dict(entry)
+            entry['data'] = self._read(entry['file'])
+            self.stacks[entry['id']] = (0, entry['file'])
+            stacks.append(entry)
+        state_vars = {}
+        self.tables = {}
+        for (name, filename) in manifest['tables'].items():
+            state_vars[name] = self._read(filename)
+            self.tables[name] = (0, filename)
+        self.state_vars = None
+        return (stacks, state_vars, manifest['virtual_time'])
+
+    def adopt(self, state_vars):
+        """
+        Takes the versions of the tables loaded last to be those of state_vars.
+        """
+        self.state_vars = state_vars
+
+    def _write(self, filename, obj):
+        path = os.path.join(self.directory, filename)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(path + '.tmp', path)
+
+    def _sync_directory(self):
+        # only POSIX systems let a directory be opened, and synced
+        if os.name != 'posix':
+            return
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _read(self, filename):
+        with open(os.path.join(self.directory, filename), 'rb') as f:
+            return pickle.load(f)
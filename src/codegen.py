@@ -0,0 +1,235 @@
+"""
+Date: Sat, 17 Oct 2026
+Last updated: Sat, 17 Oct 2026
+
+Project: RAE/SeRPE implementation
+Component: Method Code Generation
+
+Description:
+The Interpreter runs a method body by walking its AST, and gets out of the walk
+at every decision node by leaving a continuation -- the node to go on with, and
+its environment -- on a stack that next() picks up from, walking down the AST
+again. This module generates, for a method body, the source of a Python
+generator function that does what the walk does, and yields the decision nodes
+the interpreter would, as ('TASK' | 'ACTION' | 'FAIL' | 'WAIT', id, args); the
+result of a command is sent back into the generator. Suspending and resuming a
+method is then a switch of Python frames.
+
+Only the statements are generated as source: the expressions they evaluate are
+pure (see the expression compiler in interpreter.py), and are run as the
+closures they compile into, which the generated code is handed as constants.
+A method body that has anything else in it -- a task or command invoked inside
+an expression, say -- isn't generated, and is left to the Interpreter, which
+interpreter() hands out for it instead.
+
+A generator can't be pickled, so methods run as generators can't be saved in
+a checkpoint (see checkpoint.py).
+"""
+
+import interpreter
+from event_log import log, TRACE
+
+def interpreter_for(method, environment, state_vars, task_table = {}, action_table = {},
+                    mode = 'RAE'):
+    """
+    Returns a GeneratedInterpreter for the method, or an Interpreter if its body
+    can't be generated; the arguments are those of the Interpreter.
+    """
+    body = generated(method, task_table, action_table)
+    if body is None:
+        return interpreter.Interpreter(method, environment, state_vars, task_table,
+                                       action_table, mode)
+    return GeneratedInterpreter(body, method, environment, state_vars)
+
+def generated(method, task_table = {}, action_table = {}):
+    """
+    Returns the generator function that the method's body is compiled into,
+    given the task and action tables, or None if the body can't be generated.
+    As the closures of its expressions are (see
+    interpreter.compile_method_body()), the body is compiled once for the
+    names in the tables, and kept on the method, as its 'generated'.
+    """
+    entry = method.get('generated')
+    if entry is not None and entry[0] is task_table and entry[1] is action_table:
+        return entry[3]
+    names = (frozenset(task_table), frozenset(action_table))
+    if entry is not None and entry[2] == names:
+        body = entry[3]
+    else:
+        body = compile_method(method, task_table, action_table)
+    method['generated'] = (task_table, action_table, names, body)
+    return body
+
+def compile_method(method, task_table = {}, action_table = {}):
+    """
+    Compiles the body of the method into a generator function
+    body(interp, environment, state_vars), or returns None if the body can't
+    be generated. The generated source is kept as the function's 'source'.
+    """
+    generator = Generator(task_table, action_table)
+    try:
+        generator.statement(method['exprs'], 1)
+    except Unsupported:
+        return None
+    lines = ["def body(interp, environment, state_vars):"] + generator.lines + \
+            ["    if False:",
+             "        yield None # a body without decision nodes is a generator all the same"]
+    source = "\n".join(lines) + "\n"
+    namespace = dict(generator.constants)
+    exec compile(source, '<method %s>' % method.get('id'), 'exec') in namespace
+    body = namespace['body']
+    body.source = source
+    return body
+
+
+class Unsupported(Exception):
+    pass
+
+
+class Generator:
+    """
+    Generates the source of a method body, statement by statement, into
+    'lines'. The values the source refers to (the closures of the expressions,
+    and the ids and arguments of state variables) are kept in 'constants'.
+    """
+
+    def __init__(self, task_table, action_table):
+        self.task_table = task_table
+        self.action_table = action_table
+        self.lines = []
+        self.constants = {}
+        self.temporaries = 0
+
+    def emit(self, depth, line):
+        self.lines.append('    ' * depth + line)
+
+    def constant(self, value):
+        name = '_k%d' % len(self.constants)
+        self.constants[name] = value
+        return name
+
+    def temporary(self, prefix):
+        self.temporaries += 1
+        return '_%s%d' % (prefix, self.temporaries)
+
+    def expression(self, instr):
+        """
+        Returns the source of a call to the closure of a pure expression, which
+        evaluates to its native value (see interpreter.compile_native()).
+        """
+        closure = interpreter.compile_expression(instr, self.task_table, self.action_table)
+        if closure is None:
+            raise Unsupported()
+        return '%s(interp, environment, state_vars)' % self.constant(closure.native)
+
+    def statement(self, instr, depth):
+        if not isinstance(instr, dict):
+            raise Unsupported()
+        e_type = instr.get('e_type')
+
+        if e_type == 'E_NOOP':
+            self.emit(depth, 'pass')
+
+        elif e_type == 'E_SEQ':
+            self.statement(instr['arg1'], depth)
+            self.statement(instr['arg2'], depth)
+
+        elif e_type == 'E_FAIL':
+            self.emit(depth, "yield ('FAIL', 'FAIL', 'FAIL')")
+            self.emit(depth, "return")
+
+        elif e_type == 'E_WHILE':
+            # as Interpreter.e_while: the guard is evaluated after the block
+            # with its reads recorded, and if the block left everything as it
+            # was, the loop waits for the state variables the guard read (if
+            # it read any)
+            cond = self.expression(instr['cond'])
+            (c, before, writes, outer, reads) = [self.temporary(prefix) for prefix in
+                                                 ('cond', 'env', 'writes', 'outer', 'reads')]
+            self.emit(depth, "%s = %s" % (c, cond))
+            self.emit(depth, "while %s:" % c)
+            self.emit(depth + 1, "(%s, %s) = (dict(environment), interp.writes)" % (before, writes))
+            self.statement(instr['block'], depth + 1)
+            self.emit(depth + 1, "(%s, interp.reads) = (interp.reads, set())" % outer)
+            self.emit(depth + 1, "%s = %s" % (c, cond))
+            self.emit(depth + 1, "(%s, interp.reads) = (interp.reads, %s)" % (reads, outer))
+            self.emit(depth + 1, "if %s is not None:" % outer)
+            self.emit(depth + 2, "%s |= %s" % (outer, reads))
+            self.emit(depth + 1, "if %s and %s and interp.writes == %s and environment == %s:" %
+                      (c, reads, writes, before))
+            self.emit(depth + 2, "yield ('WAIT', tuple(sorted(%s)), ())" % reads)
+            self.emit(depth + 2, "%s = %s" % (c, cond))
+
+        elif e_type == 'E_IF':
+            for (n, (cond, block)) in enumerate(zip(instr['conds'], instr['blocks'])):
+                self.emit(depth, "%s %s:" % ('if' if n == 0 else 'elif', self.expression(cond)))
+                self.statement(block, depth + 1)
+
+        elif e_type == 'E_LOC_VAR_WR':
+            self.emit(depth, "environment[%s] = %s" % (self.constant(instr['arg1']),
+                                                       self.expression(instr['arg2'])))
+
+        elif e_type == 'E_STATE_VAR_WR':
+            if not 'arg3' in instr:
+                raise Unsupported()
+            # the entry is keyed as Interpreter.e_state_var_wr keys it
+            self.emit(depth, "state_vars[%s][%s] = %s" % (self.constant(instr['arg1']),
+                                                          self.constant(instr['arg2']),
+                                                          self.expression(instr['arg3'])))
+            self.emit(depth, "interp.writes += 1")
+
+        elif e_type == 'E_STATE_VAR_RD' and (instr['arg1'] in self.task_table or
+                                             instr['arg1'] in self.action_table):
+            id = instr['arg1']
+            if id in self.task_table and \
+                    len(instr['arg2']) != len(self.task_table[id]['parameters']):
+                raise Unsupported() # the Interpreter reports the mistake when it gets to it
+            # the arguments are handed on as Values, as Interpreter.e_state_var_rd hands them
+            args = ', '.join([self.expression(arg) for arg in instr['arg2']])
+            node_type = 'TASK' if id in self.task_table else 'ACTION'
+            self.emit(depth, "yield (%r, %s, %s((%s)))" % (node_type, self.constant(id),
+                                                          self.constant(interpreter.node_arguments),
+                                                          args + ',' if args else ''))
+
+        else:
+            # an expression statement, evaluated for its reads
+            self.emit(depth, self.expression(instr))
+
+
+class GeneratedInterpreter:
+    """
+    Runs a method as the generator function its body was compiled into, with
+    the Interpreter's API: iterating over it yields the decision nodes, and
+    the result of the command issued last is taken from action_result.
+    """
+
+    def __init__(self, body, method, environment, state_vars):
+        self.body = body
+        self.method = method
+        self.environment = environment
+        self.state_vars = state_vars
+        self.action_result = None
+        self.state = 'READY'    # can be READY, EXECUTING or FINISHED
+        self.generator = None
+        self.reads = None       # as the Interpreter's; the closures of the expressions record into them
+        self.writes = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            if self.generator is None:
+                if log.trace:
+                    log.emit(TRACE, 'method_executed', method=self.method.get('id'))
+                self.state = 'EXECUTING'
+                self.generator = self.body(self, self.environment, self.state_vars)
+                return self.generator.next()
+            (result, self.action_result) = (self.action_result, None)
+            return self.generator.send(result)
+        except StopIteration:
+            self.state = 'FINISHED'
+            raise
+
+    def continuation(self):
+        raise TypeError("method %s runs as a generator, which can't be saved" % self.method.get('id'))
@@ -0,0 +1,239 @@
+"""
+Date: Sat, 17 Oct 2026
+Last updated: Sat, 17 Oct 2026
+
+Project: RAE/SeRPE implementation
+Component: Command Execution
+
+Description:
+Commands are the functions through which RAE acts on the execution platform.
+A command used to have to do all of its work before returning its result, so
+that a command that took a while -- waiting on a robot to get somewhere, say --
+held up every other stack in RAE's agenda until it was done.
+
+A command may now instead start its work and hand back something RAE can
+check on later:
+
+    - a generator, which RAE advances one step each time it checks on it; the
+      generator yields (anything) while the command is under way, and the last
+      value it yields before it is exhausted is the command's result, as in
+
+        def move(state, r, d):
+            platform.send_move(r, d)
+            while not platform.arrived(r):
+                yield None
+            state['state_vars']['loc'][(r,)] = d
+            yield True
+
+    - a future, i.e. any object with done() and result() methods (such as
+      those of the futures package), the result of which is the command's.
+
+The stack that issued such a command is parked, and the other stacks go on
+being progressed in the meantime, until the command is found to be finished.
+Commands that just return their result work as they always have.
+
+Commands can also be handed to a CommandExecutor, which runs each of them in a
+bounded pool of worker threads, so that a command that blocks -- a call to a
+motion planner, say -- needn't be rewritten as a generator to let the others
+overlap with it. A command the executor runs is pending from the start, and
+goes through the states
+
+    RUNNING -> DONE       it returned a true value
+            -> FAILED     it returned a false value or raised an exception
+            -> TIMEOUT    it ran for longer than its timeout
+
+A command that times out counts as having failed; its thread can't be stopped,
+and is left to finish in the background, its result ignored. The executor's
+timeouts are per command name, and a command only starts running out of time
+once a worker has picked it up.
+
+Since commands in the pool run alongside RAE and each other, they don't work on
+the state itself: a command is handed a copy of the state, with copies of the
+state variable tables taken on RAE's thread as it's started, and the entries it
+changes in them are only written to the state once RAE finds the command
+finished, again on RAE's thread. RAE's indexes of the state, the replicas of a
+sharded RAE and the stacks waiting on the state therefore never see a write
+from another thread. The tables are copied shallowly, so a command mustn't
+change a value of the state in place; and the changes of a command that times
+out are dropped along with its result.
+"""
+
+import time
+import types
+import threading
+from multiprocessing.pool import ThreadPool
+
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+
+class PendingCommand:
+    """
+    A command that has been started but hasn't finished yet. Its status is
+    RUNNING until it has finished, and then DONE, FAILED or TIMEOUT.
+    """
+
+    def __init__(self, name, handle, timeout = None):
+        self.name = name
+        self.handle = handle
+        self.timeout = timeout
+        self.started_at = time.time()
+        self.status = RUNNING
+        self.finished = False
+        self.result = None
+        self.error = None
+
+    def poll(self):
+        """
+        Checks on the command (advancing it, if it's a generator), and returns
+        True once it has finished, at which point its result is in
+        self.result. Exceptions raised by the command are passed on, except
+        for those of commands run by a CommandExecutor, which are kept in
+        self.error instead.
+        """
+        if self.finished:
+            return True
+        if isinstance(self.handle, types.GeneratorType):
+            try:
+                self.result = next(self.handle)
+            except StopIteration:
+                self.finished = True
+        elif self.handle.done():
+            self.result = self.handle.result()
+            self.error = getattr(self.handle, 'error', None)
+            self.finished = True
+            # a command run by a CommandExecutor has its changes to the state
+            # written on this thread
+            effects = getattr(self.handle, 'effects', None)
+            if effects is not None:
+                effects.apply()
+
+        if self.finished:
+            self.status = DONE if self.result else FAILED
+        elif self.timeout is not None:
+            started_at = getattr(self.handle, 'started_at', self.started_at)
+            if started_at is not None and time.time() - started_at > self.timeout:
+                self.status = TIMEOUT
+                self.result = None
+                self.finished = True
+        return self.finished
+
+
+class CommandExecutor:
+    """
+    Runs commands in a pool of 'workers' threads. 'timeouts' maps command
+    names onto the number of seconds the command may run for, and commands
+    that aren't in it get 'default_timeout' (None for no limit).
+    """
+
+    def __init__(self, workers = 4, timeouts = None, default_timeout = None):
+        self.pool = ThreadPool(workers)
+        self.timeouts = dict(timeouts or {})
+        self.default_timeout = default_timeout
+
+    def start(self, name, command, args, state = None):
+        """
+        Submits the command to the pool, and returns a PendingCommand for it.
+        If 'state' is given, the command is called with a copy of it ahead of
+        'args', and its changes to the copy are written to 'state' when the
+        PendingCommand is polled after it has finished.
+        """
+        effects = None
+        if state is not None:
+            effects = _Effects(state)
+            args = (effects.state,) + tuple(args)
+        job = _Job(command, args, effects)
+        self.pool.apply_async(job.run)
+        return PendingCommand(name, job, self.timeouts.get(name, self.default_timeout))
+
+    def shutdown(self):
+        """
+        Stops the workers, abandoning the commands that are still running.
+        """
+        self.pool.terminate()
+
+
+class _Job:
+    # a command submitted to the pool; it looks like a future to PendingCommand
+
+    def __init__(self, command, args, effects = None):
+        self.command = command
+        self.args = args
+        self.effects = effects
+        self.started_at = None
+        self.value = None
+        self.error = None
+        self.finished = threading.Event()
+
+    def run(self):
+        self.started_at = time.time()
+        try:
+            self.value = self.command(*self.args)
+        except Exception as e:
+            self.error = e
+        self.finished.set()
+
+    def done(self):
+        return self.finished.is_set()
+
+    def result(self):
+        return self.value if self.error is None else None
+
+
+class _Effects:
+    # the copy of the state a command in the pool works on, and the entries of
+    # its state variables as they were when it was copied, against which the
+    # command's changes are told
+
+    def __init__(self, state):
+        self.target = state['state_vars']
+        self.before = dict([(name, dict(table)) for (name, table) in self.target.items()])
+        state_vars = dict([(name, dict(table)) for (name, table) in self.before.items()])
+        self.state = dict(state, state_vars = state_vars)
+
+    def apply(self):
+        state_vars = self.state['state_vars']
+        for name in self.before:
+            if name not in state_vars:
+                del self.target[name]
+        for (name, table) in state_vars.items():
+            before = self.before.get(name)
+            if before is None:
+                self.target[name] = dict(table)
+                continue
+            target = self.target[name]
+            for (key, value) in table.items():
+                if key not in before or before[key] != value:
+                    target[key] = value
+            for key in before:
+                if key not in table and key in target:
+                    del target[key]
+
+
+def interrupted(name):
+    """
+    Returns a PendingCommand standing for a command that was under way when
+    RAE was stopped, and which RAE can't tell the outcome of; it counts as
+    having failed.
+    """
+    pending = PendingCommand(name, None)
+    (pending.finished, pending.status) = (True, FAILED)
+    return pending
+
+def start(name, command, args):
+    """
+    Calls 'command' with the arguments in 'args', and returns its result if it
+    finished straight away, or a PendingCommand for it if it didn't.
+    """
+    res = command(*args)
+    if isinstance(res, types.GeneratorType) or is_future(res):
+        pending = PendingCommand(name, res)
+        if not pending.poll():
+            return pending
+        res = pending.result
+    return res
+
+def is_future(obj):
+    return callable(getattr(obj, 'done', None)) and \
+           callable(getattr(obj, 'result', None))
@@ -0,0 +1,81 @@
+"""
+Date: Sat, 17 Oct 2026
+Last updated: Sat, 17 Oct 2026
+
+Project: RAE/SeRPE implementation
+Component: Event Index
+
+Description:
+Besides tasks, RAE responds to events: a method whose header reads
+
+    method m-close(d):
+      event: door_opened(d, "front")
+
+is triggered by every door_opened event whose second argument is "front",
+whatever its first. Events arrive the way tasks do, as (name, (args)) tuples,
+and far more often than tasks, so RAE doesn't look through the methods for the
+ones an event triggers. The EventIndex files each event method under
+
+    (event name, arity)  ->  shape  ->  constants  ->  method names
+
+where the shape of the method's pattern is the tuple of the positions of its
+constant arguments, and the constants are the values given at those positions.
+An event is then matched by looking up, for each of the (few) shapes in use for
+its name and arity, the arguments it has at the shape's positions -- a number of
+dict lookups that doesn't grow with the number of methods.
+"""
+
+class EventIndex:
+    def __init__(self, method_lib, event_method_map = None):
+        """
+        Indexes the event methods in method_lib. The methods an event triggers
+        are matched in the order event_method_map lists them in (as built by
+        meth_parser), if it's given.
+        """
+        self.shapes = {}    # maps (name, arity) onto the shapes in use for it
+        self.table = {}     # maps (name, arity, shape, constants) onto methods
+        self.rank = {}      # maps method names onto their place in the order
+        self.names = set()  # the names of the events in the index
+        if event_method_map is None:
+            event_method_map = {}
+            for method_name in sorted(method_lib):
+                task = method_lib[method_name]['task']
+                if task.get('event'):
+                    event_method_map.setdefault(task['id'], []).append(method_name)
+        for event_name in event_method_map:
+            for method_name in event_method_map[event_name]:
+                self.add(method_name, method_lib[method_name]['task'])
+
+    def add(self, method_name, event):
+        """
+        Files a method under the event dict (see meth_parser) that triggers it.
+        """
+        pattern = event['pattern']
+        key = (event['id'], len(pattern))
+        shape = tuple([n for (n, constant) in enumerate(pattern) if constant is not None])
+        constants = tuple([pattern[n] for n in shape])
+        self.names.add(event['id'])
+        shapes = self.shapes.setdefault(key, [])
+        if not shape in shapes:
+            shapes.append(shape)
+        self.table.setdefault(key + (shape, constants), []).append(method_name)
+        self.rank.setdefault(method_name, len(self.rank))
+
+    def match(self, name, args):
+        """
+        Returns the names of the methods the event (name, args) triggers.
+        """
+        key = (name, len(args))
+        matches = []
+        for shape in self.shapes.get(key, ()):
+            constants = tuple([args[n] for n in shape])
+            matches.extend(self.table.get(key + (shape, constants), ()))
+        if len(self.shapes.get(key, ())) > 1:
+            matches.sort(key = self.rank.get)
+        return matches
+
+    def __contains__(self, name):
+        """
+        Tells whether there are methods that events by the name can trigger.
+        """
+        return name in self.names
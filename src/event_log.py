@@ -0,0 +1,130 @@
+"""
+Date: Sat, 17 Oct 2026
+Last updated: Sat, 17 Oct 2026
+
+Project: RAE/SeRPE implementation
+Component: Event Log
+
+Description:
+RAE and the interpreter report what they're doing as events: an event has a
+level, a name (like 'command_failed') and whatever fields go with it (like the
+command and its arguments). Events are handed to the log's sinks, which turn
+them into text or into JSON lines, as a dict
+
+    {"time": 1760659200.0, "level": "INFO", "event": "command_failed",
+     "command": "move", "args": ["r1", "d2"]}
+
+Events below the log's level are dropped before anything is built for them.
+Every level has a flag on the log that is True exactly when events of that
+level are kept, and the code that reports events checks it first:
+
+    if log.debug:
+        log.emit(DEBUG, 'decision_node', node = next_node)
+
+so that when the level is off, the cost is that of reading an attribute -- no
+repr of the fields, and no formatting of a message.
+
+The module provides a shared log, 'log', which writes to standard output at
+the level named by the RAE_LOG_LEVEL environment variable (INFO by default).
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+
+TRACE = 5
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {TRACE: 'TRACE', DEBUG: 'DEBUG', INFO: 'INFO',
+               WARNING: 'WARNING', ERROR: 'ERROR'}
+
+class EventLog:
+    """
+    A log that passes the events at or above its level on to its sinks.
+    """
+
+    def __init__(self, level = INFO, sinks = None):
+        self.sinks = list(sinks) if sinks is not None else []
+        self.set_level(level)
+
+    def set_level(self, level):
+        if isinstance(level, str):
+            level = dict([(name, lvl) for (lvl, name) in LEVEL_NAMES.items()])[level.upper()]
+        self.level = level
+        self.trace = level <= TRACE
+        self.debug = level <= DEBUG
+        self.info = level <= INFO
+        self.warning = level <= WARNING
+        self.error = level <= ERROR
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+
+    def emit(self, level, event, **fields):
+        """
+        Hands the event to every sink, if it's at or above the log's level.
+        """
+        if level < self.level:
+            return
+        record = dict(time = time.time(), level = LEVEL_NAMES.get(level, level),
+                      event = event)
+        record.update(fields)
+        for sink in self.sinks:
+            sink.write(record)
+
+
+class TextSink:
+    """
+    Writes events as lines of text of the form
+
+        [LEVEL] event: field = value, field = value
+
+    to a stream (standard output by default).
+    """
+
+    def __init__(self, stream = None):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        fields = ", ".join([key + " = " + str(record[key]) for key in
+                            sorted(record) if not key in ('time', 'level', 'event')])
+        line = "[" + str(record['level']) + "] " + record['event'] + \
+               (": " + fields if fields else "") + "\n"
+        with self.lock:
+            (self.stream or sys.stdout).write(line)
+
+
+class JSONLinesSink:
+    """
+    Writes events as JSON objects, one per line, to a stream or to the file at
+    a path (which is appended to). Values JSON has no notation for are written
+    as their repr.
+    """
+
+    def __init__(self, target):
+        if isinstance(target, basestring):
+            self.stream = open(target, 'a')
+        else:
+            self.stream = target
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, default = repr) + "\n"
+        with self.lock:
+            self.stream.write(line)
+            self.stream.flush()
+
+    def close(self):
+        self.stream.close()
+
+
+log = EventLog(os.environ.get('RAE_LOG_LEVEL', 'INFO'), [TextSink()])
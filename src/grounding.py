@@ -0,0 +1,265 @@
+"""
+Date: Sat, 17 Oct 2026
+Last updated: Sat, 17 Oct 2026
+
+Project: RAE/SeRPE implementation
+Component: Grounding Engine
+
+Description:
+Grounding a method means finding the bindings of its parameters under which its
+preconditions hold. The parameters a task doesn't bind have to be found some
+other way, and trying every object for every one of them costs n^k precondition
+calls for k free parameters over n objects.
+
+Most preconditions, however, are conjunctions of state-variable reads and
+rigid-relation lookups, which the precondition compiler (parsing/pre_compiler.py)
+reads off of the precondition code as relational constraints. This module
+evaluates those constraints as a join over the state-variable and rigid-
+relation tables: a parameter like p in
+
+    state['state_vars']['pile'][(c,)] == p
+
+is looked up once c is bound, and a parameter like d in
+
+    (p, d) in state['rigid_rels']['at']
+
+is taken from the 'at' tuples that agree with p, through a hash index on the
+bound positions. Only parameters that no constraint mentions are enumerated
+from their domains. Since every constraint is a conjunct of the precondition,
+no binding the precondition would accept is ever skipped; the bindings that
+survive the join still have to be checked against the precondition itself.
+
+The module exposes ground(), along with terms(), which reads the terms off of a
+constraint, and ANY, the domain of a parameter that may take any value.
+"""
+
+import sys
+
+def ground(constraints, parameters, domains, state, indexes=None, binding=None):
+    """
+    Yields every binding of 'parameters' (as a dict mapping parameter ids onto
+    values) that draws each parameter from its domain and satisfies every
+    constraint in 'constraints' in the given state.
+
+    'domains' maps each parameter onto the collection of values it may take;
+    a parameter already bound by the task has a domain of one. A parameter
+    whose domain is ANY is only ever taken from the tables, and so has to
+    appear in some constraint.
+
+    'indexes' may be supplied to share the hash indexes built over the state's
+    tables between calls made against the same, unchanged state.
+
+    'binding' may bind some of the parameters to begin with; only the bindings
+    that extend it are yielded.
+    """
+    if indexes is None:
+        indexes = {}
+
+    params = []
+    for param in parameters:
+        if not param in params:
+            params.append(param)
+
+    domain_sets = {}
+    for param in params:
+        domain_sets[param] = domains[param] if domains[param] is ANY else set(domains[param])
+        if not domain_sets[param]:
+            return
+
+    # parameters with a domain of one are bound from the start
+    binding = dict(binding or {})
+    for (param, value) in binding.items():
+        if param in domain_sets and not value in domain_sets[param]:
+            return
+    for param in params:
+        if not param in binding and len(domain_sets[param]) == 1:
+            binding[param] = iter(domain_sets[param]).next()
+
+    for result in _join(list(constraints), params, domain_sets, state,
+                        binding, indexes):
+        yield result
+
+class _Anything:
+    def __contains__(self, value):
+        return True
+
+    def __len__(self):
+        return sys.maxint
+
+ANY = _Anything()
+
+"""
+HELPER FUNCTIONS
+"""
+
+def _join(constraints, params, domain_sets, state, binding, indexes):
+    # drop the constraints the binding already decides, and fail on any it violates
+    pending = []
+    for constraint in constraints:
+        holds = _check(constraint, binding, state, indexes)
+        if holds is False:
+            return
+        elif holds is None:
+            pending.append(constraint)
+
+    free = [param for param in params if not param in binding]
+    if not free:
+        yield dict(binding)
+        return
+
+    # join on the cheapest constraint, unless enumerating a domain is cheaper
+    best, best_cost = None, None
+    for constraint in pending:
+        cost = _cost(constraint, binding, state)
+        if best_cost is None or cost < best_cost:
+            best, best_cost = constraint, cost
+    enum_param = min(free, key = lambda param: len(domain_sets[param]))
+
+    if best is not None and best_cost <= len(domain_sets[enum_param]):
+        for extension in _matches(best, binding, state, indexes):
+            if all(value in domain_sets[var] for (var, value) in extension.items()):
+                binding.update(extension)
+                for result in _join(pending, params, domain_sets, state,
+                                    binding, indexes):
+                    yield result
+                for var in extension:
+                    del binding[var]
+    else:
+        for value in domain_sets[enum_param]:
+            binding[enum_param] = value
+            for result in _join(pending, params, domain_sets, state,
+                                binding, indexes):
+                yield result
+        del binding[enum_param]
+
+def terms(constraint):
+    """
+    Returns the terms of the tuple that the constraint looks up in its table
+    (for an SV_EQ constraint, the key followed by the value).
+    """
+    if constraint[0] == 'SV_EQ':
+        return constraint[2] + (constraint[3],)
+    return constraint[2]
+
+def _resolve(term, binding):
+    if term[0] == 'CONST':
+        return True, term[1]
+    elif term[1] in binding:
+        return True, binding[term[1]]
+    return False, None
+
+def _table(constraint, state):
+    section = 'rigid_rels' if constraint[0] == 'REL_IN' else 'state_vars'
+    return state.get(section, {}).get(constraint[1])
+
+def _check(constraint, binding, state, indexes):
+    """
+    Returns True or False if the binding decides the constraint, and None if
+    some of its parameters are still free.
+    """
+    values = []
+    for term in terms(constraint):
+        (bound, value) = _resolve(term, binding)
+        if not bound:
+            return None
+        values.append(value)
+
+    table = _table(constraint, state)
+    if table is None:
+        return False
+    if constraint[0] == 'SV_EQ':
+        key = tuple(values[:-1])
+        return key in table and table[key] == values[-1]
+    elif constraint[0] == 'SV_KEY':
+        return tuple(values) in table
+    else:
+        return tuple(values) in _index(constraint, table,
+                                       tuple(range(len(values))), indexes)
+
+def _cost(constraint, binding, state):
+    table = _table(constraint, state)
+    if table is None:
+        return 0
+    if constraint[0] == 'SV_EQ' and \
+            all(_resolve(term, binding)[0] for term in constraint[2]):
+        return 1 # a single lookup in a state variable's table
+    bound = [term for term in terms(constraint) if _resolve(term, binding)[0]]
+    if bound:
+        return 1 + len(table) // (10 * len(bound))
+    return 1 + len(table)
+
+def _matches(constraint, binding, state, indexes):
+    """
+    Yields the bindings of the constraint's free parameters (as dicts) that
+    make it hold, given the current binding of the others.
+    """
+    table = _table(constraint, state)
+    if table is None:
+        return
+    row_terms = terms(constraint)
+
+    if constraint[0] == 'SV_EQ' and \
+            all(_resolve(term, binding)[0] for term in constraint[2]):
+        key = tuple([_resolve(term, binding)[1] for term in constraint[2]])
+        if key in table:
+            candidates = [key + (table[key],)]
+        else:
+            candidates = []
+    else:
+        mask, probe = [], []
+        for (position, term) in enumerate(row_terms):
+            (bound, value) = _resolve(term, binding)
+            if bound:
+                mask.append(position)
+                probe.append(value)
+        candidates = _index(constraint, table, tuple(mask), indexes) \
+                        .get(tuple(probe), ())
+
+    for row in candidates:
+        extension = {}
+        for (term, value) in zip(row_terms, row):
+            if term[0] == 'VAR' and not term[1] in binding:
+                if extension.get(term[1], value) != value:
+                    break # the same parameter in two positions
+                extension[term[1]] = value
+        else:
+            yield extension
+
+# hash indexes over the rigid relations, which never change, are kept across
+# calls, up to MAX_RIGID_INDEXES of them; those over state-variable tables
+# live only as long as 'indexes'
+MAX_RIGID_INDEXES = 1000
+_rigid_indexes = {}  # maps (id(table), mask) onto (table, len(table), index)
+
+def _index(constraint, table, mask, indexes):
+    """
+    Returns a dict mapping the values at the positions in 'mask' onto the rows
+    of the constraint's table that have them.
+    """
+    if constraint[0] == 'REL_IN':
+        # the entry holds on to the table, so that its id isn't taken by another
+        # while the entry is kept
+        cache, cache_key = _rigid_indexes, (id(table), mask)
+        entry = cache.get(cache_key)
+        if entry and entry[0] is table and entry[1] == len(table):
+            return entry[2]
+        if len(cache) >= MAX_RIGID_INDEXES:
+            cache.clear()
+    else:
+        cache, cache_key = indexes, (constraint[0], constraint[1], mask)
+        entry = cache.get(cache_key)
+        if entry:
+            return entry[2]
+
+    arity = len(terms(constraint))
+    if constraint[0] == 'SV_EQ':
+        rows = [key + (value,) for (key, value) in table.items()]
+    else:
+        rows = list(table)
+
+    index = {}
+    for row in rows:
+        if isinstance(row, tuple) and len(row) == arity:
+            index.setdefault(tuple([row[i] for i in mask]), []).append(row)
+    cache[cache_key] = (table, len(table), index)
+    return index
@@ -72,6 +72,8 @@ import json                 # a better way of getting a pretty print of a dict
 import cPickle as pickle    # for serializing objects to file -- in our case,
                             # we'll want to be persisting our method tables
 from collections import deque
+import operator
+from event_log import log, TRACE  # the interpreter reports its steps at TRACE level
 
 
 """
@@ -114,14 +116,68 @@ e_types = dict(
     e_loc_var_wr =      'LOC_VAR_WR'        # arg1 (id string), arg2 (expr)
 )
 
+"""
+VALUES
+
+Every expression evaluates to a Value: a native Python value, tagged with its
+type ('val_num', 'val_str', 'val_bool' or 'val_none'). A Value can be read as
+the value dict {'v_type': ..., 'val': ...}, and compares equal to it, so that
+value['val'] works wherever values are handed out (and value dicts go on
+working wherever Values are taken); the interpreter itself reads value.val,
+which doesn't cost a call. Values aren't changed once
+they're made, so the constant ones (the literals in a method, the booleans,
+and none) are made once and shared.
+"""
+
+class Value(object):
+    __slots__ = ('v_type', 'val')
+
+    def __init__(self, v_type, val):
+        self.v_type = v_type
+        self.val = val
+
+    def __getitem__(self, key):
+        if key == 'val':
+            return self.val
+        elif key == 'v_type':
+            return self.v_type
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key == 'val' or key == 'v_type'
+
+    def get(self, key, default = None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return ['v_type', 'val']
+
+    def __eq__(self, other):
+        if isinstance(other, Value):
+            return self.v_type == other.v_type and self.val == other.val
+        elif isinstance(other, dict):
+            return other == {'v_type': self.v_type, 'val': self.val}
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None # as a value dict, a Value can't be a key
+
+    def __reduce__(self):
+        return (Value, (self.v_type, self.val))
+
+    def __repr__(self):
+        return repr({'v_type': self.v_type, 'val': self.val})
+
 """
 SINGLETON VALUES
 """
 
-val_none = dict(
-    v_type = 'val_none',
-    val = None
-)
+val_none = Value('val_none', None)
+val_true = Value('val_bool', True)
+val_false = Value('val_bool', False)
 
 """
 AUXILIARY CLASSES
@@ -187,6 +243,11 @@ class Interpreter:
         self.ret = (val_none, environment, state_vars)
         self.state = 'READY' # can be READY, ACTING, FINISHED, or ERROR
         self.stack = deque([])
+        self.reads = None    # the state variables read, while they're being recorded
+        self.writes = 0      # the number of state variable writes so far
+        # the closures the pure expressions of the method compile into
+        self.closures = compile_method_body(method, task_table, action_table) \
+                        if method else {}
 
         # print("\n\nenvironment = " + environment.__repr__() + "\n\n")
 
@@ -202,19 +263,7 @@ class Interpreter:
             self.mode = 'EXECUTING'
 
             # interpret the result
-            v_type = 'val_none'
-            if isinstance(self.action_result, str):
-                v_type = 'val_str'
-            elif isinstance(self.action_result, (int, float, long)):
-                v_type = 'val_num'
-            elif isinstance(self.action_result, bool):
-                v_type = 'val_bool'
-
-            action_result = dict(
-                v_type = v_type,
-                val = self.action_result
-            )
-            self.ret = (action_result, self.environment, self.state_vars)
+            self.ret = (typed(self.action_result), self.environment, self.state_vars)
 
         # continue executing the method
         if self.new_decision_node:
@@ -226,7 +275,7 @@ class Interpreter:
             self.eval(next_instr, environment, self.state_vars)
             # print("\n\nherein 'elif self.stack'!\n\n")
             return self.next()
-        elif self.state == 'READY' or self.state == 'EXECUTING':
+        elif self.state == 'READY': # a method is only executed once
             self.execute_method(self.method, self.environment, self.state_vars)
             # print("\n\nherein 'elif self.state'!\n\n")
             return self.next()
@@ -234,6 +283,28 @@ class Interpreter:
             self.state = 'FINISHED'
             raise StopIteration
 
+    def continuation(self):
+        """
+        Returns the interpreter's execution state as a dict of plain data, which
+        can be pickled and handed to resume() to carry on where the interpreter
+        left off. The method is identified by its id, and the state variables,
+        task table and action table are left out, to be supplied on resuming.
+        The environments in the continuation are shared between its parts as
+        they are in the interpreter, so it should be pickled as a whole.
+        """
+        return dict(
+            method = self.method.get('id') if self.method else None,
+            environment = self.environment,
+            mode = self.mode,
+            state = self.state,
+            new_decision_node = self.new_decision_node,
+            decision_node = self.decision_node,
+            action_result = self.action_result,
+            ret = self.ret[:2],
+            stack = list(self.stack),
+            started_at = getattr(self, 'started_at', None)
+        )
+
     # def __str__(self):
     #     return json.dumps(self.decision_nodes, sort_keys=False, indent=3)
 
@@ -249,7 +320,8 @@ class Interpreter:
     """
 
     def execute_method(self, method, environment, state_vars):
-        print("\n\nHERE!\n\n")
+        if log.trace:
+            log.emit(TRACE, 'method_executed', method=method.get('id') if method else None)
         self.state = 'EXECUTING'
         if method:
             first_instr = method['exprs']
@@ -311,36 +383,19 @@ class Interpreter:
                                  format(curr_instr['e_type']))
 
     def eval(self, curr_instr, environment, state_vars):
-        print("In eval with curr_instr = " + repr(curr_instr))
-        op_sem = {
-            'E_NOOP':         self.e_noop,
-            'E_FAIL':         self.e_fail,
-            'E_SEQ':          self.e_seq,
-            'E_WHILE':        self.e_while,
-            'E_IF':           self.e_if,
-            'E_AND':          self.e_and,
-            'E_OR':           self.e_or,
-            'E_EQUALS':       self.e_equals,
-            'E_LT':           self.e_lt,
-            'E_GT':           self.e_gt,
-            'E_LTE':          self.e_lte,
-            'E_GTE':          self.e_gte,
-            'E_NOT':          self.e_not,
-            'E_TRUE':         self.e_true,
-            'E_FALSE':        self.e_false,
-            'E_INT':          self.e_int,
-            'E_FLOAT':        self.e_float,
-            'E_ADD':          self.e_add,
-            'E_SUB':          self.e_sub,
-            'E_MUL':          self.e_mul,
-            'E_DIV':          self.e_div,
-            'E_STRING':       self.e_string,
-            'E_STATE_VAR_RD': self.e_state_var_rd,
-            'E_STATE_VAR_WR': self.e_state_var_wr,
-            'E_LOC_VAR_RD':   self.e_loc_var_rd,
-            'E_LOC_VAR_WR':   self.e_loc_var_wr,
-            'E_TASK_INVOCATION':  self.e_task_invocation
-        }.get(curr_instr['e_type'], self._raise_no_such_instruction)
+        if log.trace:
+            log.emit(TRACE, 'eval', instr=curr_instr)
+        else:
+            # pure expressions are run as the closures they compile into (see
+            # compile_method_body()); the trace needs every node evaluated on
+            # its own
+            expression = self.closures.get(id(curr_instr))
+            if expression is not None:
+                self.ret = (expression(self, environment, state_vars),
+                            environment, state_vars)
+                return
+        op_sem = self.op_sem.get(curr_instr['e_type'],
+                                 Interpreter._raise_no_such_instruction)
 
         # before proceeding with execusion, check if there are any new
         # decision nodes to yield
@@ -351,9 +406,22 @@ class Interpreter:
 
         # print("recursing on ast")
         # continue recursing on the AST
-        op_sem(curr_instr, environment=environment, state_vars=state_vars)
+        op_sem(self, curr_instr, environment=environment, state_vars=state_vars)
         # print("done recursing on ast")
 
+    def value(self, instr, environment, state_vars):
+        """
+        Evaluates the expression 'instr' and returns its native value (the val
+        of its Value). A compiled expression is run without tagging its value,
+        or going through self.ret.
+        """
+        if not log.trace:
+            expression = self.closures.get(id(instr))
+            if expression is not None:
+                return expression.native(self, environment, state_vars)
+        self.eval(instr, environment, state_vars)
+        return self.ret[0].val
+
 
     """
     PRIVATE METHODS
@@ -414,11 +482,11 @@ class Interpreter:
     def e_while(self, instr, environment, state_vars):
         cond = instr['cond']
         block = instr['block']
-        self.eval(cond, environment=environment, state_vars=state_vars)
-        (cond_res, _, _) =  self.ret
+        cond_res = self.value(cond, environment, state_vars)
         ret = val_none
-        while cond_res['val']:
+        while cond_res:
             # evaluate the code block once
+            (environment_before, writes_before) = (dict(environment), self.writes)
             self.eval(block, environment=environment,
                              state_vars=state_vars)
             (ret, environment, state_vars) = self.ret
@@ -429,10 +497,24 @@ class Interpreter:
                 return # return so that __next__ (the original invoking method)
                      # can yield the generated decision node
 
-            # now evaluate the guard and continue iterating as appropriate
-            self.eval(cond, environment=environment,
-                            state_vars=state_vars)
-            (cond_res, _, _) = self.ret
+            # now evaluate the guard and continue iterating as appropriate,
+            # noting the state variables it reads
+            (outer_reads, self.reads) = (self.reads, set())
+            cond_res = self.value(cond, environment, state_vars)
+            (reads, self.reads) = (self.reads, outer_reads)
+            if self.reads is not None:
+                self.reads |= reads
+
+            # if the block changed nothing, the guard can only come out
+            # differently once the state variables it reads have been written
+            # to by someone else; until then, the loop waits. A guard that
+            # reads none has nothing to wait on, and is stepped through
+            if cond_res and reads and self.writes == writes_before and \
+                    environment == environment_before:
+                self.stack.append((instr, environment))
+                self.decision_node = ('WAIT', tuple(sorted(reads)), ())
+                self.new_decision_node = True
+                return
 
         self.ret = (ret, environment, state_vars)
 
@@ -452,11 +534,9 @@ class Interpreter:
             block = block_list[i]
             # print("in if with cond = " + cond.__repr__())
 
-            self.eval(cond, environment=environment,
-                            state_vars=state_vars)
-            (res, _, _) = self.ret
+            res = self.value(cond, environment, state_vars)
 
-            if res['val']:
+            if res:
                 # print("cond succeeded; in block = " + block.__repr__())
                 self.eval(block, environment=environment,
                                  state_vars=state_vars)
@@ -478,9 +558,9 @@ class Interpreter:
                           state_vars=state_vars)
         (r_res, _, _) = self.ret
 
-        if l_res['v_type'] == 'val_bool' and r_res['v_type'] == 'val_bool':
-            l_operand, r_operand = l_res['val'], r_res['val']
-            self.ret = (dict(
+        if l_res.v_type == 'val_bool' and r_res.v_type == 'val_bool':
+            l_operand, r_operand = l_res.val, r_res.val
+            self.ret = (Value(
                             v_type = 'val_bool',
                             val = l_operand and r_operand
                         ), environment, state_vars)
@@ -499,9 +579,9 @@ class Interpreter:
                           state_vars=state_vars)
         (r_res, _, _) = self.ret
 
-        if l_res['v_type'] == 'val_bool' and r_res['v_type'] == 'val_bool':
-            l_operand, r_operand = l_res['val'], r_res['val']
-            self.ret = (dict(
+        if l_res.v_type == 'val_bool' and r_res.v_type == 'val_bool':
+            l_operand, r_operand = l_res.val, r_res.val
+            self.ret = (Value(
                             v_type = 'val_bool',
                             val = l_operand or r_operand
                         ), environment, state_vars)
@@ -525,9 +605,12 @@ class Interpreter:
         # print("l_res = " + l_res.__repr__() + "\n")
         # print("r_res = " + r_res.__repr__() + "\n\n")
 
-        if l_res['v_type'] == r_res['v_type']:
-            l_operand, r_operand = l_res['val'], r_res['val']
-            self.ret = (dict(
+        # a method's parameters read back as their values wrapped twice
+        (l_res, r_res) = (unwrap(l_res), unwrap(r_res))
+
+        if l_res.v_type == r_res.v_type:
+            l_operand, r_operand = l_res.val, r_res.val
+            self.ret = (Value(
                             v_type = 'val_bool',
                             val = l_operand == r_operand
                         ), environment, state_vars)
@@ -546,9 +629,9 @@ class Interpreter:
                           state_vars=state_vars)
         (r_res, _, _) = self.ret
 
-        if l_res['v_type'] == 'val_num' and r_res['v_type'] == 'val_num':
-            l_operand, r_operand = l_res['val'], r_res['val']
-            self.ret = (dict(
+        if l_res.v_type == 'val_num' and r_res.v_type == 'val_num':
+            l_operand, r_operand = l_res.val, r_res.val
+            self.ret = (Value(
                             v_type = 'val_bool',
                             val = l_operand < r_operand
                         ), environment, state_vars)
@@ -567,9 +650,9 @@ class Interpreter:
                           state_vars=state_vars)
         (r_res, _, _) = self.ret
 
-        if l_res['v_type'] == 'val_num' and r_res['v_type'] == 'val_num':
-            l_operand, r_operand = l_res['val'], r_res['val']
-            self.ret = (dict(
+        if l_res.v_type == 'val_num' and r_res.v_type == 'val_num':
+            l_operand, r_operand = l_res.val, r_res.val
+            self.ret = (Value(
                             v_type = 'val_bool',
                             val = l_operand > r_operand
                         ), environment, state_vars)
@@ -588,9 +671,9 @@ class Interpreter:
                           state_vars=state_vars)
         (r_res, _, _) = self.ret
 
-        if l_res['v_type'] == 'val_num' and r_res['v_type'] == 'val_num':
-            l_operand, r_operand = l_res['val'], r_res['val']
-            self.ret = (dict(
+        if l_res.v_type == 'val_num' and r_res.v_type == 'val_num':
+            l_operand, r_operand = l_res.val, r_res.val
+            self.ret = (Value(
                             v_type = 'val_bool',
                             val = l_operand <= r_operand
                         ), environment, state_vars)
@@ -609,9 +692,9 @@ class Interpreter:
                           state_vars=state_vars)
         (r_res, _, _) = self.ret
 
-        if l_res['v_type'] == 'val_num' and r_res['v_type'] == 'val_num':
-            l_operand, r_operand = l_res['val'], r_res['val']
-            self.ret = (dict(
+        if l_res.v_type == 'val_num' and r_res.v_type == 'val_num':
+            l_operand, r_operand = l_res.val, r_res.val
+            self.ret = (Value(
                             v_type = 'val_bool',
                             val = l_operand >= r_operand
                         ), environment, state_vars)
@@ -627,10 +710,10 @@ class Interpreter:
                         state_vars=state_vars)
         (res, _, _) = self.ret
 
-        if res['v_type'] == 'val_bool':
-            self.ret = (dict(
+        if res.v_type == 'val_bool':
+            self.ret = (Value(
                             v_type = 'val_bool',
-                            val = not res['val']
+                            val = not res.val
                         ), environment, state_vars)
         else:
             raise TypeError("Error near unary not: negated operand expression \
@@ -638,27 +721,21 @@ class Interpreter:
 
         # primitive values
     def e_true(self, instr, environment, state_vars):
-        self.ret = (dict(
-                        v_type = 'val_bool',
-                        val = True
-                    ), environment, state_vars)
+        self.ret = (val_true, environment, state_vars)
 
     def e_false(self, instr, environment, state_vars):
-        self.ret = (dict(
-                        v_type = 'val_bool',
-                        val = False
-                    ), environment, state_vars)
+        self.ret = (val_false, environment, state_vars)
 
     def e_int(self, instr, environment, state_vars):
         # print("IN e_int!")
-        self.ret = (dict(
+        self.ret = (Value(
                         v_type = 'val_num',
                         val = instr['val']
                     ), environment, state_vars)
         # print("SET self.ret = " + repr(self.ret))
 
     def e_float(self, instr, environment, state_vars):
-        self.ret = (dict(
+        self.ret = (Value(
                         v_type = 'val_num',
                         val = instr['val']
                     ), environment, state_vars)
@@ -672,9 +749,9 @@ class Interpreter:
         self.eval(r_expr, environment=environment, state_vars=state_vars)
         (r_res, _, _) = self.ret
 
-        if l_res['v_type'] == 'val_num' and r_res['v_type'] == 'val_num':
-            l_operand, r_operand = l_res['val'], r_res['val']
-            self.ret = (dict(
+        if l_res.v_type == 'val_num' and r_res.v_type == 'val_num':
+            l_operand, r_operand = l_res.val, r_res.val
+            self.ret = (Value(
                             v_type = 'val_num',
                             val = l_operand + r_operand
                         ), environment, state_vars)
@@ -693,9 +770,9 @@ class Interpreter:
                           state_vars=state_vars)
         (r_res, _, _) = self.ret
 
-        if l_res['v_type'] == 'val_num' and r_res['v_type'] == 'val_num':
-            l_operand, r_operand = l_res['val'], r_res['val']
-            self.ret = (dict(
+        if l_res.v_type == 'val_num' and r_res.v_type == 'val_num':
+            l_operand, r_operand = l_res.val, r_res.val
+            self.ret = (Value(
                             v_type = 'val_num',
                             val = l_operand - r_operand
                         ), environment, state_vars)
@@ -714,9 +791,9 @@ class Interpreter:
                           state_vars=state_vars)
         (r_res, _, _) = self.ret
 
-        if l_res['v_type'] == 'val_num' and r_res['v_type'] == 'val_num':
-            l_operand, r_operand = l_res['val'], r_res['val']
-            self.ret = (dict(
+        if l_res.v_type == 'val_num' and r_res.v_type == 'val_num':
+            l_operand, r_operand = l_res.val, r_res.val
+            self.ret = (Value(
                             v_type = 'val_num',
                             val = l_operand * r_operand
                         ), environment, state_vars)
@@ -735,9 +812,9 @@ class Interpreter:
                           state_vars=state_vars)
         (r_res, _, _) = self.ret
 
-        if l_res['v_type'] == 'val_num' and r_res['v_type'] == 'val_num':
-            l_operand, r_operand = l_res['val'], r_res['val']
-            self.ret = (dict(
+        if l_res.v_type == 'val_num' and r_res.v_type == 'val_num':
+            l_operand, r_operand = l_res.val, r_res.val
+            self.ret = (Value(
                             v_type = 'val_num',
                             val = l_operand / r_operand
                         ), environment, state_vars)
@@ -746,7 +823,7 @@ class Interpreter:
                              must be of type numerical")
 
     def e_string(self, instr, environment, state_vars):
-        self.ret = (dict(
+        self.ret = (Value(
                         v_type = 'val_str',
                         val = instr['val']
                     ), environment, state_vars)
@@ -772,7 +849,7 @@ class Interpreter:
         # print("in state_var_rd with instr = " + instr.__repr__())
         id = instr['arg1']
         arguments = instr['arg2']
-        evaluated_arguments = tuple([self._eval_helper(arg, environment, state_vars)['val'] \
+        evaluated_arguments = tuple([self.value(arg, environment, state_vars) \
                                      for arg in arguments])
 
         # print("\n\ntask_table = " + self.task_table.__repr__() + "\n\n")
@@ -785,13 +862,13 @@ class Interpreter:
                                      arguments ({1} rather than {2})".format(id,
                                         arguments.size, task['parameters'].size))
 
-            task_node = ('TASK', id, evaluated_arguments)
+            task_node = ('TASK', id, node_arguments(evaluated_arguments))
 
             self.decision_node = task_node
             self.new_decision_node = True
             self.ret = (val_none, environment, state_vars)
         elif id in self.action_table:
-            action_node = ('ACTION', id, evaluated_arguments)
+            action_node = ('ACTION', id, node_arguments(evaluated_arguments))
             # print("\nissuing an action node = " + action_node.__repr__() + "\n")
 
             self.decision_node = action_node
@@ -802,20 +879,16 @@ class Interpreter:
             # print("\n\n\twe were passed state_vars = \n" + state_vars.__repr__() + "\n\n")
             # print("id = " + id + "\n\n")
             # print("evaluated_arguments = " + evaluated_arguments.__repr__() + "\n\n")
-            val = state_vars[id][evaluated_arguments]
-
-            v_type = 'val_none'
-            if isinstance(val, str):
-                v_type = 'val_str'
-            elif isinstance(val, (int, float, long)):
-                v_type = 'val_num'
-            elif isinstance(val, bool):
-                v_type = 'val_bool'
-
-            self.ret = (dict(
-                            v_type = v_type,
-                            val = val
-                        ), environment, state_vars)
+            if self.reads is not None:
+                self.reads.add(id)
+            # the method's parameters are bound to values wrapped as Values
+            # (or value dicts), which have to be unwrapped to look up the state
+            # variable's entry
+            key = tuple([arg['val'] if isinstance(arg, (Value, dict)) else arg \
+                         for arg in evaluated_arguments])
+            val = state_vars[id][key]
+
+            self.ret = (typed(val), environment, state_vars)
 
     def e_state_var_wr(self, instr, environment, state_vars):  # arg1 (id string), arg2 (list of parameter ids), arg3 (expr)
         id = instr['arg1']
@@ -825,7 +898,8 @@ class Interpreter:
                                  state_vars=state_vars)
         (res, _, state_vars) = self.ret
 
-        state_vars[id][arguments] = res['val']
+        state_vars[id][arguments] = res.val
+        self.writes += 1
         self.ret = (res, environment, state_vars)
 
     def e_loc_var_rd(self, instr, environment, state_vars):    # arg1 (id string)
@@ -833,18 +907,7 @@ class Interpreter:
         id = instr['arg1']
         val = environment[id]
 
-        v_type = 'val_none'
-        if isinstance(val, str):
-            v_type = 'val_str'
-        elif isinstance(val, (int, float, long)):
-            v_type = 'val_num'
-        elif isinstance(val, bool):
-            v_type = 'val_bool'
-
-        self.ret = (dict(
-                        v_type = v_type,
-                        val = val
-                    ), environment, state_vars)
+        self.ret = (typed(val), environment, state_vars)
 
     def e_loc_var_wr(self, instr, environment, state_vars):    # arg1 (id string), arg2 (expr)
         id = instr['arg1']
@@ -869,7 +932,7 @@ class Interpreter:
         self.mode = 'EXECUTING'
         (res, _, _) = self.ret
 
-        environment[id] = res['val']
+        environment[id] = res.val
         self.ret = (res, environment, state_vars)
 
 
@@ -885,6 +948,344 @@ class Interpreter:
     def e_action_invocation(self, instr, environment, state_vars):
         pass
 
+    # the operational semantics of each instruction type, which eval() looks up
+    op_sem = {
+        'E_NOOP':           e_noop,
+        'E_FAIL':           e_fail,
+        'E_SEQ':            e_seq,
+        'E_WHILE':          e_while,
+        'E_IF':             e_if,
+        'E_AND':            e_and,
+        'E_OR':             e_or,
+        'E_EQUALS':         e_equals,
+        'E_LT':             e_lt,
+        'E_GT':             e_gt,
+        'E_LTE':            e_lte,
+        'E_GTE':            e_gte,
+        'E_NOT':            e_not,
+        'E_TRUE':           e_true,
+        'E_FALSE':          e_false,
+        'E_INT':            e_int,
+        'E_FLOAT':          e_float,
+        'E_ADD':            e_add,
+        'E_SUB':            e_sub,
+        'E_MUL':            e_mul,
+        'E_DIV':            e_div,
+        'E_STRING':         e_string,
+        'E_STATE_VAR_RD':   e_state_var_rd,
+        'E_STATE_VAR_WR':   e_state_var_wr,
+        'E_LOC_VAR_RD':     e_loc_var_rd,
+        'E_LOC_VAR_WR':     e_loc_var_wr,
+        'E_TASK_INVOCATION':e_task_invocation
+    }
+
+"""
+EXPRESSION COMPILER
+
+Evaluating an expression node by node, through eval() and the self.ret tuple
+every handler leaves its value in, costs more than the expression itself. An
+expression that can't issue a decision node or write to anything -- one made
+up of literals, operators, and reads of local and state variables -- is
+compiled instead into nested closures that compute its value directly, and
+eval() runs the closures. The pure expressions of a method's body are compiled
+once, as RAE loads the method or as it's first run, and the closures are kept
+on the method. Whether a read is of a state variable, or an invocation of a
+task or an action, depends on the names in the task and action tables, so the
+body is only compiled again for tables with other names in them.
+
+Inside the closures, values are passed around untagged, as native Python
+values: the type of most subexpressions is known when they are compiled (that
+of a comparison is val_bool whatever its operands), and only the values of
+variable reads are checked for their types when they are evaluated. A Value is
+made for the expression as a whole, and not even that where its value is only
+tested, as the guards of whiles and ifs are (see Interpreter.value()).
+"""
+
+def compile_method_body(method, task_table = {}, action_table = {}):
+    """
+    Returns the closures the pure expressions of the method's body compile into
+    (see compile_expression()), given the task and action tables, as a dict
+    mapping the id of each expression's node onto its closure. The body is
+    compiled once for the names in the tables, and the closures are kept on
+    the method, as its 'closures', along with the tables and their names.
+    """
+    entry = method.get('closures')
+    if entry is not None and entry[0] is task_table and entry[1] is action_table:
+        return entry[3]
+    names = (frozenset(task_table), frozenset(action_table))
+    if entry is not None and entry[2] == names:
+        closures = entry[3]
+    else:
+        closures = {}
+        _compile_pure(method.get('exprs'), task_table, action_table, closures)
+    method['closures'] = (task_table, action_table, names, closures)
+    return closures
+
+def _compile_pure(instr, task_table, action_table, closures):
+    # compiles the outermost pure expressions in 'instr' into 'closures'; those
+    # inside them are only evaluated through them
+    if isinstance(instr, list):
+        for item in instr:
+            _compile_pure(item, task_table, action_table, closures)
+        return
+    if not isinstance(instr, dict):
+        return
+    closure = compile_expression(instr, task_table, action_table)
+    if closure is not None:
+        closures[id(instr)] = closure
+        return
+    for value in instr.values():
+        _compile_pure(value, task_table, action_table, closures)
+
+def compile_expression(instr, task_table = {}, action_table = {}):
+    """
+    Compiles the expression 'instr' into a function f(interp, environment,
+    state_vars) that returns its Value, as interp.eval() would leave it in
+    interp.ret. Returns None if the expression isn't pure.
+    The function computes the expression's native value (see
+    compile_native()), and only tags it as a Value at the end; its native
+    value can be had without the Value from f.native.
+    """
+    compiled_native = compile_native(instr, task_table, action_table)
+    if compiled_native is None:
+        return None
+    (native, v_type) = compiled_native
+
+    if instr['e_type'] in ('E_TRUE', 'E_FALSE', 'E_INT', 'E_FLOAT', 'E_STRING'):
+        # the Value of a literal is made once, and shared
+        val = native(None, None, None)
+        literal = (val_true if val else val_false) if v_type == 'val_bool' else Value(v_type, val)
+        expression = lambda interp, environment, state_vars: literal
+    elif v_type == 'val_bool':
+        expression = lambda interp, environment, state_vars: \
+            val_true if native(interp, environment, state_vars) else val_false
+    elif v_type is not None:
+        expression = lambda interp, environment, state_vars: \
+            Value(v_type, native(interp, environment, state_vars))
+    else:
+        expression = lambda interp, environment, state_vars: \
+            typed(native(interp, environment, state_vars))
+    expression.native = native
+    return expression
+
+def compile_native(instr, task_table = {}, action_table = {}):
+    """
+    Compiles the expression 'instr' into a function f(interp, environment,
+    state_vars) that returns its value untagged, as the native Python value
+    its Value would hold, along with the type of that value if it is known
+    when compiling (it isn't, for reads of variables): as (f, v_type or None).
+    Operands are only checked for their types when they are evaluated if
+    their types aren't known beforehand. Returns None if the expression isn't
+    pure.
+    """
+    if not isinstance(instr, dict):
+        return None
+    e_type = instr.get('e_type')
+
+    if e_type in ('E_TRUE', 'E_FALSE'):
+        val = e_type == 'E_TRUE'
+        return (lambda interp, environment, state_vars: val, 'val_bool')
+    elif e_type in ('E_INT', 'E_FLOAT', 'E_STRING'):
+        val = instr['val']
+        return (lambda interp, environment, state_vars: val,
+                'val_str' if e_type == 'E_STRING' else 'val_num')
+    elif e_type == 'E_LOC_VAR_RD':
+        id = instr['arg1']
+        return (lambda interp, environment, state_vars: environment[id], None)
+
+    elif e_type == 'E_NOT':
+        arg = compile_native(instr['arg1'], task_table, action_table)
+        if arg is None:
+            return None
+        arg = _checked(arg, 'val_bool', "Error near unary not: negated operand expression \
+                             must be of type boolean")
+        return (lambda interp, environment, state_vars:
+                not arg(interp, environment, state_vars), 'val_bool')
+
+    elif e_type == 'E_EQUALS':
+        left = compile_native(instr['arg1'], task_table, action_table)
+        right = compile_native(instr['arg2'], task_table, action_table)
+        if left is None or right is None:
+            return None
+        if left[1] is not None and left[1] == right[1]:
+            (left, right) = (left[0], right[0])
+            return (lambda interp, environment, state_vars:
+                    left(interp, environment, state_vars) == right(interp, environment, state_vars),
+                    'val_bool')
+        (left, right) = (left[0], right[0])
+        def e_equals(interp, environment, state_vars):
+            # a method's parameters read back as their values wrapped
+            l_operand = unwrap_native(left(interp, environment, state_vars))
+            r_operand = unwrap_native(right(interp, environment, state_vars))
+            if native_type(l_operand) == native_type(r_operand):
+                return l_operand == r_operand
+            raise TypeError("Error near '==': both operand expressions \
+                             must be of the same type")
+        return (e_equals, 'val_bool')
+
+    elif e_type in _binary_operators:
+        (operand_type, result_type, operation, error) = _binary_operators[e_type]
+        left = compile_native(instr['arg1'], task_table, action_table)
+        right = compile_native(instr['arg2'], task_table, action_table)
+        if left is None or right is None:
+            return None
+        (left, right) = (_checked(left, operand_type, error), _checked(right, operand_type, error))
+        return (lambda interp, environment, state_vars:
+                operation(left(interp, environment, state_vars), right(interp, environment, state_vars)),
+                result_type)
+
+    elif e_type == 'E_STATE_VAR_RD':
+        id = instr['arg1']
+        if id in task_table or id in action_table:
+            return None
+        args = [compile_native(arg, task_table, action_table)
+                for arg in instr['arg2']]
+        if None in args:
+            return None
+        args = [arg for (arg, _) in args]
+        def e_state_var_rd(interp, environment, state_vars):
+            evaluated_arguments = [arg(interp, environment, state_vars)
+                                   for arg in args]
+            if interp.reads is not None:
+                interp.reads.add(id)
+            key = tuple([arg['val'] if isinstance(arg, (Value, dict)) else arg
+                         for arg in evaluated_arguments])
+            return state_vars[id][key]
+        return (e_state_var_rd, None)
+
+    return None
+
+def _checked(compiled_native, v_type, error):
+    """
+    Returns the function of a compiled operand, made to raise a TypeError with
+    the message 'error' if the value it comes out with isn't of type v_type;
+    or the function as it is, if it can only come out with one that is.
+    """
+    (native, native_v_type) = compiled_native
+    if native_v_type == v_type:
+        return native
+    def check(interp, environment, state_vars):
+        val = native(interp, environment, state_vars)
+        if _native_types.get(type(val)) != v_type and native_type(val) != v_type:
+            raise TypeError(error)
+        return val
+    return check
+
+_binary_operators = {     # e_type: (operand type, result type, operation, error)
+    'E_AND': ('val_bool', 'val_bool', operator.and_,
+        "Error near logical 'and' ('&&'): both operand expressions \
+                             must be of type boolean"),
+    'E_OR': ('val_bool', 'val_bool', operator.or_,
+        "Error near logical 'or' ('||'): both operand expressions \
+                             must be of type boolean"),
+    'E_LT': ('val_num', 'val_bool', operator.lt,
+        "Error near '<': both operand expressions \
+                             must be of type numeric"),
+    'E_GT': ('val_num', 'val_bool', operator.gt,
+        "Error near '>': both operand expressions \
+                             must be of type numeric"),
+    'E_LTE': ('val_num', 'val_bool', operator.le,
+        "Error near '<=': both operand expressions \
+                             must be of type numeric"),
+    'E_GTE': ('val_num', 'val_bool', operator.ge,
+        "Error near '>=': both operand expressions \
+                             must be of type numeric"),
+    'E_ADD': ('val_num', 'val_num', operator.add,
+        "Error near '+': both operand expressions \
+                             must be of type numerical"),
+    'E_SUB': ('val_num', 'val_num', operator.sub,
+        "Error near '-': both operand expressions \
+                             must be of type numerical"),
+    'E_MUL': ('val_num', 'val_num', operator.mul,
+        "Error near '*': both operand expressions \
+                             must be of type numerical"),
+    'E_DIV': ('val_num', 'val_num', operator.div,
+        "Error near '/': both operand expressions \
+                             must be of type numerical"),
+}
+
+_native_types = {bool: 'val_bool', str: 'val_str', int: 'val_num', long: 'val_num', float: 'val_num'}
+
+def native_type(val):
+    """
+    Returns the type of the Value a native value is tagged with. A bool is an
+    int to isinstance(), so it's told apart first.
+    """
+    v_type = _native_types.get(type(val))
+    if v_type is not None:
+        return v_type
+    elif val is True or val is False:
+        return 'val_bool'
+    elif isinstance(val, str):
+        return 'val_str'
+    elif isinstance(val, (int, float, long)):
+        return 'val_num'
+    return 'val_none'
+
+def typed(val):
+    """
+    Returns the Value of a native value read from a variable or handed back
+    by a command.
+    """
+    if val is True:
+        return val_true
+    elif val is False:
+        return val_false
+    return Value(native_type(val), val)
+
+def unwrap_native(val):
+    """
+    Returns the native value wrapped in 'val', if it's a Value (or a value
+    dict), as a method's parameters are bound to.
+    """
+    while True:
+        if isinstance(val, Value):
+            val = val.val
+        elif isinstance(val, dict) and 'v_type' in val:
+            val = val['val']
+        else:
+            return val
+
+def node_arguments(vals):
+    """
+    Returns the arguments of a task or command as a decision node hands them
+    on: as Values of their native values, whether they were literals or the
+    (wrapped) values of variables.
+    """
+    return tuple([typed(unwrap_native(val)) for val in vals])
+
+def unwrap(value):
+    """
+    Returns the Value wrapped in 'value', if its val is one (or a value dict,
+    which is made into a Value).
+    """
+    while True:
+        inner = value.val
+        if isinstance(inner, Value):
+            value = inner
+        elif isinstance(inner, dict) and 'v_type' in inner:
+            value = Value(inner['v_type'], inner['val'])
+        else:
+            return value
+
+def resume(continuation, method, state_vars, task_table = {}, action_table = {}):
+    """
+    Rebuilds an interpreter from a continuation (see Interpreter.continuation()),
+    given the method it names and the state variables, task table and action
+    table to go on with.
+    """
+    interp = Interpreter(method, continuation['environment'], state_vars,
+                         task_table, action_table, continuation['mode'])
+    interp.state = continuation['state']
+    interp.new_decision_node = continuation['new_decision_node']
+    interp.decision_node = continuation['decision_node']
+    interp.action_result = continuation['action_result']
+    interp.ret = tuple(continuation['ret']) + (state_vars,)
+    interp.stack = deque(continuation['stack'])
+    if continuation['started_at'] is not None:
+        interp.started_at = continuation['started_at']
+    return interp
+
 def dump(obj, nested_level=0, header=""):
     spacing = '   '
     string = header
@@ -925,3 +1326,4 @@ function as a module).
 # dom_lexer.print_token_stream("../domains/simple_domain/simple_domain.dom")
 # meth_parser.print_asts("../domains/test_domain1/test_domain1.meth", \
 #                        paged = False, debug=False)
+
@@ -0,0 +1,334 @@
+"""
+Date: Sat, 17 Oct 2026
+Last updated: Sat, 17 Oct 2026
+
+Project: RAE/SeRPE implementation
+Component: Match Network
+
+Description:
+The grounding engine (grounding.py) joins the relational constraints of a
+method's preconditions against the state every time the method's task is
+grounded, even though between two groundings a command has usually written
+only an entry or two of a single table. The MatchNetwork does the join once,
+and then keeps its result up to date as the state variables are written, in
+the manner of the TREAT match algorithm:
+
+    - for every method, it keeps the bindings of the method's parameters that
+      satisfy all of its constraints (its conflict set), filed under the
+      arguments of the method's task, so that the bindings for a task are a
+      dict lookup away, and
+    - it watches the state variables (see state_tracking.TrackedStateVars), and
+      on every write works out which rows of the table changed. A row that's
+      gone takes the bindings that were joined with it along with it, and a row
+      that's new is joined with the tables to find the bindings it makes, with
+      its own constraint bound to it.
+
+The hash indexes the joins look rows up in (the alpha memories) are kept up to
+date along with the bindings, instead of being built again for every join.
+
+The writes may come from another thread (commands run in a thread pool, see
+commands.py), so the network only notes them as they come, and matches them
+on the next lookup, on the thread that does the lookups.
+
+Only methods all of whose parameters appear in some constraint are kept in the
+network; the others have parameters that can only be found by enumerating
+their domains, and are grounded as before. The bindings in the network still
+have to be checked against the precondition itself, as those of the grounding
+engine do. The objects and rigid relations are taken to be fixed, as they are
+everywhere else.
+"""
+
+import threading
+from collections import OrderedDict
+
+import grounding
+import state_tracking
+
+class MatchNetwork:
+    def __init__(self, method_lib):
+        """
+        Compiles the constraints of the methods in method_lib. The network
+        holds no bindings until it's attach()ed to a state.
+        """
+        self.method_lib = method_lib
+        self.productions = {}   # maps the names of the methods in the network onto their Productions
+        self.alpha = {}         # maps (constraint kind, table) onto the (production, constraint number)s over it
+        for method_name in method_lib:
+            constraints = method_lib[method_name].get("pre_constraints", [])
+            parameters = []
+            for parameter in method_lib[method_name]["parameters"]:
+                if not parameter in parameters:
+                    parameters.append(parameter)
+            variables = set([term[1] for constraint in constraints
+                             for term in grounding.terms(constraint) if term[0] == 'VAR'])
+            if not constraints or not variables.issuperset(parameters):
+                continue
+            production = Production(method_name, method_lib[method_name], parameters, constraints)
+            self.productions[method_name] = production
+            for (n, constraint) in enumerate(constraints):
+                if constraint[0] != 'REL_IN':
+                    self.alpha.setdefault((constraint[0], constraint[1]), []).append((production, n))
+        self.state = None
+        self.state_vars = None
+        self.indexes = {}
+        self.lock = threading.Lock()
+        self.written = OrderedDict()    # maps the (table, key)s written since the last lookup onto their old entries
+        self.replaced = set()           # the tables replaced as a whole since the last lookup
+        self.updates = 0
+        self.lookups = 0
+
+    def attach(self, state):
+        """
+        Matches the methods against the state, and keeps the matches up to
+        date from then on. state['state_vars'] is replaced by a TrackedStateVars
+        if it isn't one.
+        """
+        if self.state_vars is not None:
+            self.state_vars.unwatch(self._changed)
+        if not isinstance(state["state_vars"], state_tracking.TrackedStateVars):
+            state["state_vars"] = state_tracking.TrackedStateVars(state["state_vars"])
+        self.state = state
+        self.state_vars = state["state_vars"]
+        self.indexes = {}
+        with self.lock:
+            self.written = OrderedDict()
+            self.replaced = set()
+        for production in self.productions.values():
+            production.domains = production.domainsIn(state)
+            self._build(production)
+        self.state_vars.watch(self._changed)
+
+    def tracks(self, state):
+        """
+        Tells whether the network holds the matches of the methods in state.
+        """
+        return self.state_vars is not None and state.get("state_vars") is self.state_vars
+
+    def __contains__(self, method_name):
+        """
+        Tells whether the method is kept in the network.
+        """
+        return method_name in self.productions
+
+    def lookup(self, method_name, args):
+        """
+        Returns the bindings (dicts mapping parameter ids onto values) of the
+        method for its task with the arguments args that satisfy the method's
+        constraints, in a fixed order. The tables they were matched against
+        count as read (see TrackedStateVars.startReads).
+        """
+        self.lookups += 1
+        self._update()
+        production = self.productions[method_name]
+        self.state_vars.noteReads(production.tables)
+        keys = production.by_task.get(production.taskKey(args), ())
+        return [dict(production.instances[key]) for key in sorted(keys)]
+
+    def size(self):
+        """
+        Returns the number of bindings held in the network.
+        """
+        self._update()
+        return sum([len(production.instances) for production in self.productions.values()])
+
+    def _view(self):
+        # the state as the joins see it; reading the tables through a plain dict
+        # keeps the joins from counting as reads of whoever is recording them
+        return dict(self.state, state_vars = dict(dict.items(self.state_vars)))
+
+    def _build(self, production):
+        production.clear()
+        for binding in grounding.ground(production.constraints, production.parameters, production.domains,
+                                        self._view(), self.indexes):
+            production.add(binding)
+
+    def _changed(self, name, key, old):
+        # called on whichever thread wrote to the state variables; the first old
+        # entry of a key is the one its row was matched with
+        with self.lock:
+            self.updates += 1
+            if key is state_tracking.WHOLE_TABLE:
+                self.replaced.add(name)
+            elif not (name, key) in self.written:
+                self.written[(name, key)] = old
+
+    def _update(self):
+        """
+        Matches the writes noted since the last lookup against the network.
+        """
+        with self.lock:
+            (written, self.written) = (self.written, OrderedDict())
+            (replaced, self.replaced) = (self.replaced, set())
+        if not written and not replaced:
+            return
+
+        # the rows that changed in the tables written entry by entry are moved
+        # in the indexes first, so that all the joins below see the tables as
+        # they are now
+        changes = []
+        for ((name, key), old) in written.items():
+            if name in replaced:
+                continue
+            table = dict.get(self.state_vars, name)
+            new = (key in table, table.get(key)) if table is not None else (False, None)
+            for kind in ('SV_EQ', 'SV_KEY'):
+                (old_row, new_row) = (_row(kind, key, old), _row(kind, key, new))
+                if old_row != new_row:
+                    self._reindex(kind, name, old_row, new_row)
+                    changes.append((kind, name, old_row, new_row))
+
+        # the methods joined with the tables replaced as a whole are matched again
+        for name in replaced:
+            for index_key in self.indexes.keys():
+                if index_key[1] == name and index_key[0] != 'REL_IN':
+                    del self.indexes[index_key]
+        rebuilt = set()
+        for name in replaced:
+            for kind in ('SV_EQ', 'SV_KEY'):
+                for (production, _) in self.alpha.get((kind, name), ()):
+                    if not production.name in rebuilt:
+                        rebuilt.add(production.name)
+                        self._build(production)
+
+        # the bindings joined with the rows that are gone go first, and then the
+        # new rows are joined with the tables as they are now
+        for (kind, name, old_row, _) in changes:
+            if old_row is not None:
+                for (production, n) in self.alpha.get((kind, name), ()):
+                    for binding_key in list(production.support[n].get(old_row, ())):
+                        production.remove(binding_key)
+        view = None
+        for (kind, name, _, new_row) in changes:
+            if new_row is not None:
+                for (production, n) in self.alpha.get((kind, name), ()):
+                    seed = _unify(production.constraints[n], new_row)
+                    if seed is None:
+                        continue
+                    if view is None:
+                        view = self._view()
+                    for binding in grounding.ground(production.constraints, production.parameters,
+                                                    production.domains, view, self.indexes, seed):
+                        production.add(binding)
+
+    def _reindex(self, kind, name, old_row, new_row):
+        for ((index_kind, index_name, mask), (_, _, index)) in self.indexes.items():
+            if index_kind != kind or index_name != name:
+                continue
+            if old_row is not None and len(old_row) > max(mask + (-1,)):
+                probe = tuple([old_row[i] for i in mask])
+                rows = index.get(probe, [])
+                if old_row in rows:
+                    rows.remove(old_row)
+                    if not rows:
+                        del index[probe]
+            if new_row is not None and len(new_row) > max(mask + (-1,)):
+                index.setdefault(tuple([new_row[i] for i in mask]), []).append(new_row)
+
+
+class Production:
+    """
+    A method in the network, along with its conflict set: the bindings of its
+    parameters that satisfy its constraints, by key (the tuple of the values
+    of the parameters), the keys filed under the arguments of the method's
+    task, and, for each of the constraints over state variables, the keys
+    filed under the row of the table that the binding was joined with.
+    """
+
+    def __init__(self, name, method, parameters, constraints):
+        self.name = name
+        self.parameters = parameters
+        self.constraints = constraints
+        self.parameter_types = method.get("parameter_types", {})
+        self.tables = set([constraint[1] for constraint in constraints if constraint[0] != 'REL_IN'])
+
+        # a task argument is matched against the first parameter it is given to,
+        # as when grounding
+        task_parameters = method["task"]["parameters"]
+        self.task_positions = [(parameter, task_parameters.index(parameter))
+                               for parameter in parameters if parameter in task_parameters]
+        self.domains = None
+        self.clear()
+
+    def domainsIn(self, state):
+        """
+        Returns the domains of the parameters in state: the objects of their
+        type, or for untyped parameters, any value if the task binds them and
+        any object if not.
+        """
+        domains = {}
+        for parameter in self.parameters:
+            if parameter in self.parameter_types:
+                domains[parameter] = set(state["objects"].get(self.parameter_types[parameter], []))
+            elif parameter in dict(self.task_positions):
+                domains[parameter] = grounding.ANY
+            else:
+                domains[parameter] = set([obj for objects in state["objects"].values() for obj in objects])
+        return domains
+
+    def taskKey(self, args):
+        return tuple([args[position] for (_, position) in self.task_positions])
+
+    def clear(self):
+        self.instances = {}
+        self.by_task = {}
+        self.support = [{} for _ in self.constraints]
+
+    def add(self, binding):
+        key = tuple([binding[parameter] for parameter in self.parameters])
+        if key in self.instances:
+            return
+        self.instances[key] = binding
+        self.by_task.setdefault(tuple([binding[parameter] for (parameter, _) in self.task_positions]),
+                                set()).add(key)
+        for (n, constraint) in enumerate(self.constraints):
+            if constraint[0] != 'REL_IN':
+                self.support[n].setdefault(_project(constraint, binding), set()).add(key)
+
+    def remove(self, key):
+        binding = self.instances.pop(key)
+        task_key = tuple([binding[parameter] for (parameter, _) in self.task_positions])
+        self.by_task[task_key].discard(key)
+        if not self.by_task[task_key]:
+            del self.by_task[task_key]
+        for (n, constraint) in enumerate(self.constraints):
+            if constraint[0] != 'REL_IN':
+                row = _project(constraint, binding)
+                self.support[n][row].discard(key)
+                if not self.support[n][row]:
+                    del self.support[n][row]
+
+"""
+HELPER FUNCTIONS
+"""
+
+def _row(kind, key, entry):
+    """
+    Returns the row that an entry (present, value) of a state variable's table
+    under key makes for constraints of the given kind, or None if it makes none.
+    """
+    if entry is None or not entry[0] or not isinstance(key, tuple):
+        return None
+    if kind == 'SV_EQ':
+        return key + (entry[1],)
+    return key
+
+def _project(constraint, binding):
+    return tuple([term[1] if term[0] == 'CONST' else binding[term[1]]
+                  for term in grounding.terms(constraint)])
+
+def _unify(constraint, row):
+    """
+    Returns the binding of the constraint's parameters under which it looks up
+    the row, or None if there is none.
+    """
+    terms = grounding.terms(constraint)
+    if len(terms) != len(row):
+        return None
+    binding = {}
+    for (term, value) in zip(terms, row):
+        if term[0] == 'CONST':
+            if term[1] != value:
+                return None
+        elif binding.setdefault(term[1], value) != value:
+            return None
+    return binding
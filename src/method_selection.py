@@ -0,0 +1,167 @@
+"""
+Date: Sat, 17 Oct 2026
+Last updated: Sat, 17 Oct 2026
+
+Project: RAE/SeRPE implementation
+Component: Method Selection
+
+Description:
+When RAE refines a task, it tries the task's methods in some order, and every
+method that fails along the way costs it a retry. The policies in this module
+decide that order:
+
+    SelectionPolicy     the order in which the methods were defined
+    RandomPolicy        a random order
+    StatsPolicy         the order that is cheapest to go through, going by how
+                        the methods have fared before
+
+RAE tells the policy how each method it tried turned out (record()), and the
+StatsPolicy keeps, for each task and method, the number of times the method
+was tried, the number of times it succeeded and failed, and the wall-clock time
+it took altogether. Trying methods one after another until one succeeds costs
+the least, on average, if they are tried in increasing order of
+
+    (mean time taken per attempt) / (probability of success)
+
+which is how StatsPolicy ranks them. The statistics are kept across runs in a
+JSON file, mapping each task onto a dict that maps each method onto the list
+[attempts, successes, failures, total time].
+"""
+
+import os
+import json
+import random
+
+class SelectionPolicy:
+    """
+    Tries methods in the order in which they were defined.
+    """
+
+    # changes whenever the order the policy gives might; RAE won't use
+    # candidates it cached under an earlier generation
+    generation = 0
+
+    # whether the order is the same every time it's asked for (in the same
+    # generation), so that RAE can cache candidates in that order
+    cacheable = True
+
+    def order(self, task_name, method_names):
+        """
+        Returns the names of the methods that address the task, in the order in
+        which they should be tried.
+        """
+        return list(method_names)
+
+    def record(self, task_name, method_name, success, cost):
+        """
+        Records that trying the method for the task succeeded (or failed),
+        after taking 'cost' seconds.
+        """
+        pass
+
+    def save(self):
+        """
+        Saves whatever the policy has learned.
+        """
+        pass
+
+
+class RandomPolicy(SelectionPolicy):
+    """
+    Tries methods in a random order, a new one every time.
+    """
+
+    cacheable = False
+
+    def order(self, task_name, method_names):
+        method_names = list(method_names)
+        random.shuffle(method_names)
+        return method_names
+
+
+class StatsPolicy(SelectionPolicy):
+    """
+    Tries methods in increasing order of expected cost, as estimated from the
+    statistics kept in the file at 'path' (if any). Until a method has been
+    tried, it is taken to succeed half of the time and to take as long as the
+    average method. The ranking is brought up to date with the statistics
+    every 'refresh_every' records, and the statistics are saved to the file
+    every 'save_every' records, as well as by save().
+    """
+
+    def __init__(self, path = None, refresh_every = 20, save_every = 100):
+        self.path = path
+        self.refresh_every = refresh_every
+        self.save_every = save_every
+        self.stats = {}
+        if path and os.path.exists(path):
+            with open(path, 'r') as stats_file:
+                self.stats = json.load(stats_file)
+        self.unsaved = 0
+        self.unranked = 0
+        self.generation = 0
+        self.rankings = {}
+
+    def order(self, task_name, method_names):
+        ranking = self.rankings.get(task_name)
+        if ranking is None:
+            ranking = self.rankings[task_name] = self._rank(task_name)
+        # sorted() is stable, so methods that rank the same stay in order
+        return sorted(method_names, key = lambda name: ranking.get(name, ranking.get(None)))
+
+    def record(self, task_name, method_name, success, cost):
+        entry = self.stats.setdefault(task_name, {}).setdefault(method_name, [0, 0, 0, 0.0])
+        entry[0] += 1
+        entry[1 if success else 2] += 1
+        entry[3] += cost
+
+        self.unranked += 1
+        if self.unranked >= self.refresh_every:
+            self.rankings = {}
+            self.unranked = 0
+            self.generation += 1
+        self.unsaved += 1
+        if self.path and self.unsaved >= self.save_every:
+            self.save()
+
+    def expected_cost(self, task_name, method_name):
+        """
+        Returns the expected cost of trying the method first: the mean time it
+        takes, over its chance of success.
+        """
+        (mean_cost, default_cost) = (None, self._mean_cost(task_name))
+        entry = self.stats.get(task_name, {}).get(method_name)
+        if entry and entry[0]:
+            (attempts, successes, _, total_cost) = entry
+            mean_cost = total_cost / attempts
+        else:
+            (attempts, successes) = (0, 0)
+        # Laplace's rule of succession, so that no method is given up on for good
+        success_rate = (successes + 1.0) / (attempts + 2.0)
+        return (mean_cost if mean_cost is not None else default_cost) / success_rate
+
+    def save(self):
+        """
+        Writes the statistics to the file, replacing it in one step so that it
+        is never left half-written.
+        """
+        if not self.path:
+            return
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as stats_file:
+            json.dump(self.stats, stats_file, separators = (',', ':'))
+        os.rename(temp_path, self.path)
+        self.unsaved = 0
+
+    def _rank(self, task_name):
+        ranking = dict([(method_name, self.expected_cost(task_name, method_name))
+                        for method_name in self.stats.get(task_name, {})])
+        ranking[None] = self.expected_cost(task_name, None)
+        return ranking
+
+    def _mean_cost(self, task_name):
+        entries = self.stats.get(task_name, {}).values()
+        attempts = sum([entry[0] for entry in entries])
+        if not attempts:
+            return 1.0
+        return sum([entry[3] for entry in entries]) / attempts
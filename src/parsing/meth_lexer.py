@@ -57,6 +57,7 @@ reserved = {
     'method':   'METHOD',
     # statement delimiters
     'task':     'TASK',
+    'event':    'EVENT',
     'pre':      'PRE',
     'body':     'BODY',
     # control structure keywords
@@ -33,7 +33,6 @@ following URL: http://www.dabeaz.com/ply/ply.html#ply_nn1
 _________________
 
 TODO:
-0) generate the task-method-map
 1) build a symbol table of tasks using the dom-lexer, so we can issue task-invocation
     instructions
 2) build a symbol table of actions using the dom-lexer, so we can issue action-
@@ -50,6 +49,8 @@ import ply.yacc as yacc
 from meth_lexer import tokens
 from meth_lexer import get_lexer
 from meth_lexer import print_token_stream
+import pre_compiler             # reads relational constraints off of the
+                                # native-python precondition code
 import json                     # a better way of getting a pretty print of a dict
                                 # from interpreter.py import meth_parser
 from pydoc import pager         # we'll be using this to produce less-like,
@@ -84,12 +85,12 @@ representing them visually:
 
     task_method_map = {
         ...
-        'some_task_id'       :  {
+        'some_task_id'       :  [
                                     ...
                                     'meth_n',
                                     'meth_n+1',
                                     ...
-                                },
+                                ],
         ...
     }
 
@@ -98,10 +99,22 @@ the following attributes (as keys):
     'id':               the name of the method as a string
     'task':             the task this method implements, as a task dict (see below)
     'parameters':       the parameters the method takes, as a list of strings
+    'parameter_types':  the object types of those parameters that were declared
+                        with one (as in 'method m(r:robot, d)'), as a dict
+                        mapping parameter ids onto the names of object sets in
+                        the domain's 'objects' table
     'preconditions':    the preconditions the method stipulates, as a list of
                         precondition dicts (see below)
+    'pre_constraints':  the relational constraints that pre_compiler could read
+                        off of the precondition code, which RAE uses to ground
+                        the method's parameters (see pre_compiler.py)
     'exprs':            the expr/statement sequence the method encapsulates, as a
                         list of expr dicts
+    'closures':         added by the interpreter once the method has been run
+                        or loaded by RAE: the closures the pure expressions of
+                        'exprs' compile into (see interpreter.py)
+    'generated':        likewise, the generator function 'exprs' compiles into,
+                        once the method has been run as one (see codegen.py)
 (The following attribute was deprecated because it seemed unnecessary:
     'local_variables'   a list of local variable id's as strings)
 
@@ -110,10 +123,30 @@ the following attributes (as keys):
     'id':               the name of the task as a string
     'parameters':       the parameters the task takes
 
+A method may be triggered by an event instead of addressing a task, as in
+'event: door_opened(d, "front")'. The event is represented by a task dict with
+two more attributes:
+    'event':            True
+    'pattern':          the event's argument pattern, as a tuple holding the
+                        constant given for each argument, or None for those
+                        that are parameters (whose entry in 'parameters' is
+                        None in turn for the constant ones)
+Events are kept out of the task-table and the task-method-map; the event-
+method-map maps each event id onto the methods it triggers instead, in the
+same way.
+
 Preconditions are represented by the parser and interpreter as dicts as well.
 They have the following attributes:
-
-...
+    'pre_code':         the native-python code of the method's 'pre:' block, as
+                        a string
+    'preconditions':    the code's preconditions(state) function, as exec'd
+                        into the dict itself (which thus also holds the code's
+                        other globals) by pre_compiler.compile_preconditions;
+                        it reads the method's parameters as globals, and so
+                        can't be called as is
+    'compiled':         the same code compiled into a function
+                        preconditions(state, bindings), which is handed the
+                        binding of the parameters as a dict (see pre_compiler.py)
 
 Instructions, finally, are also represented by the parser and interpreter as
 dicts. They have the following form:
@@ -126,6 +159,8 @@ method_table = dict()       # table mapping method ids to methods (as dicts)
 task_method_map = dict()    # table mapping each task to a list of methods that
                         # implement it
 task_table = dict()         # table mapping task ids to tasks (as dicts)
+event_method_map = dict()   # table mapping each event to a list of methods
+                            # that it triggers
 
 # initialize the singleton primitives
 e_true = dict(
@@ -138,6 +173,16 @@ e_false = dict(
     val = False
 )
 
+"""
+ERRORS
+"""
+
+class UnknownObjectType(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
 """
 PRECEDENCE
 """
@@ -194,19 +239,31 @@ def p_methods(p):
         # method_table = p[0]
 
 def p_method(p):
-    'method : METHOD ID LPAREN params RPAREN COLON task pre body'
+    'method : METHOD ID LPAREN typed_params RPAREN COLON task pre body'
     # create a dictionary representing the 'method' nonterminal's value
     p[0] = dict(
         id = p[2],
-        parameters = p[4],
+        parameters = [param for (param, param_type) in p[4]],
+        parameter_types = dict([(param, param_type) for (param, param_type) \
+                                  in p[4] if param_type]),
         task = p[7],
         preconditions = p[8],
+        pre_constraints = pre_compiler.analyze(p[8]['pre_code'],
+                                               [param for (param, _) in p[4]]),
         # local_variables = p[8]['local_variables'],
         exprs = p[9]['exprs']
     )
+    # run the precondition code in the precondition dict's namespace, and
+    # compile it into a function of the state and the parameters' binding
+    p[8]['compiled'] = pre_compiler.compile_preconditions(
+        p[8]['pre_code'], p[0]['parameters'], p[8], name = p[2] + ' preconditions')
     # now add this method to the relevant task's method list in the
-    # task-method-map:
-    # task_method_map[p[7]['id']].append(p[1])
+    # task-method-map, or to the event's in the event-method-map (methods are
+    # listed in the order they are defined):
+    method_map = event_method_map if p[7].get('event') else task_method_map
+    task_methods = method_map.setdefault(p[7]['id'], [])
+    if not p[2] in task_methods:
+        task_methods.append(p[2])
 
 # productions for parameter lists
 def p_params(p):
@@ -220,6 +277,28 @@ def p_params(p):
     else:
         p[0] = []
 
+# productions for method parameter lists, whose parameters may be typed --
+# these produce lists of (parameter id, type id) pairs, with None for the type
+# of an untyped parameter
+def p_typed_params(p):
+    '''typed_params : typed_param COMMA typed_params
+                    | typed_param
+                    |                              '''
+    if len(p) == 4:
+        p[0] = [p[1]] + p[3]
+    elif len(p) == 2:
+        p[0] = [p[1]]
+    else:
+        p[0] = []
+
+def p_typed_param(p):
+    '''typed_param : ID COLON ID
+                   | ID          '''
+    if len(p) == 4:
+        p[0] = (p[1], p[3])
+    else:
+        p[0] = (p[1], None)
+
 
 '''
 PRODUCTION FOR TASKS
@@ -238,22 +317,50 @@ def p_task(p):
     # if not p[0]['id'] in task_method_map:
     #    task_method_map[p[3]] = list()
 
+def p_event(p):
+    'task : EVENT COLON ID LPAREN event_params RPAREN'
+    p[0] = dict(
+        id = p[3],
+        parameters = [param for (param, constant) in p[5]],
+        pattern = tuple([constant for (param, constant) in p[5]]),
+        event = True
+    )
+
+# productions for event argument patterns, each argument of which is either a
+# parameter or a constant -- these produce lists of (parameter id, constant)
+# pairs, with None for whichever of the two isn't given
+def p_event_params(p):
+    '''event_params : event_param COMMA event_params
+                    | event_param
+                    |                              '''
+    if len(p) == 4:
+        p[0] = [p[1]] + p[3]
+    elif len(p) == 2:
+        p[0] = [p[1]]
+    else:
+        p[0] = []
+
+def p_event_param(p):
+    '''event_param : ID
+                   | STRING
+                   | INT
+                   | FLOAT '''
+    if p.slice[1].type == 'ID':
+        p[0] = (p[1], None)
+    else:
+        p[0] = (None, p[1])
+
 '''
 PRODUCTIONS FOR PRECONDITIONS
 '''
 
 def p_pre(p):
     'pre : PRE COLON PYTHON_CODE'
+    # the code is run, once, by pre_compiler.compile_preconditions once the
+    # method's parameters are known (see p_method)
     p[0] = dict(
         pre_code = p[3]
     )
-    try:
-        exec p[3] in p[0]
-    except:
-        error_fun = "def preconditions(state_variables): raise Exception(\"The provided precondition code " + \
-                    "failed to compile, likely due to a syntax error. Please find the " + \
-                    "problematic code listed below:\\n\" + pre_code)"
-        exec error_fun in p[0]
 
 # NB: the bexpr2prec utility is defined at the bottom of the file
 # def p_precon_list(p):
@@ -619,6 +726,20 @@ to get an idea at a glance of whether anything is horribly broken.
 def get_method_table():
     return method_table
 
+def check_parameter_types(method_table, objects):
+    """
+    Checks that every parameter type declared in the supplied method table
+    names one of the object sets in the supplied domain 'objects' table (as
+    produced by the dom-parser), raising an UnknownObjectType error otherwise.
+    """
+    for method_id, method in method_table.items():
+        for param, param_type in method.get('parameter_types', {}).items():
+            if not param_type in objects:
+                raise UnknownObjectType("Parameter '{0}' of method '{1}' has " \
+                                        "type '{2}', which is not an object " \
+                                        "set in the domain".format(param,
+                                            method_id, param_type))
+
 def set_method_table(new_method_table):
     method_table = new_method_table
 
@@ -626,7 +747,10 @@ def get_task_table():
     return task_table
 
 def get_task_method_map():
-    return {} # task_method_map
+    return task_method_map
+
+def get_event_method_map():
+    return event_method_map
 
 def parse_print(filename, paged=True, debug=True):
     """
@@ -728,8 +852,15 @@ def parse(filename):
     meth_parser_instance.parse(input, lexer=meth_lexer_instance, \
                                       tracking=True, debug=DEBUG)
 
+    # methods discarded by syntax-error recovery never make it into the method
+    # table, so they must not be left in the task-method-map either
+    for method_map in (task_method_map, event_method_map):
+        for task_id in method_map:
+            method_map[task_id] = [m for m in method_map[task_id] \
+                                     if m in method_table]
+
     # print("\n\nreturning task_table = " + task_table.__repr__())
-    return (method_table, task_table, {}) #task_method_map)
+    return (method_table, task_table, task_method_map)
 
 """
 Create a global parser instance.
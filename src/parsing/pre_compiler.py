@@ -0,0 +1,314 @@
+"""
+Date: Sat, 17 Oct 2026
+Last updated: Sat, 17 Oct 2026
+
+Project: RAE/SeRPE implementation
+Component: Precondition Compiler
+
+Description:
+Method preconditions are written in native Python, between the =BEGIN and =END
+markers of a method's 'pre:' block, as a function
+
+    def preconditions(state):
+        return state['state_vars']['pile'][(c,)] == p and \
+               (p, d) in state['rigid_rels']['at']
+
+in which the method's parameters (here c, p and d) appear as free variables.
+The Python code itself is opaque to the planner, which can only call it -- so
+grounding a method used to mean calling it once for every possible binding of
+every parameter. This module reads the code back in (using Python's own ast
+module) and pulls out of it the conjuncts that have a relational reading, so
+that grounding can look bindings up in the state-variable and rigid-relation
+tables instead of guessing them.
+
+Only the top-level conjuncts of the function's one and only return statement
+are considered, since those are the only ones every satisfying binding is
+guaranteed to satisfy. Three shapes of conjunct are recognized:
+
+    state['state_vars'][sv][(t1, ..., tn)] == t       ('SV_EQ', sv, (t1, ..., tn), t)
+    (t1, ..., tn) in state['rigid_rels'][rel]         ('REL_IN', rel, (t1, ..., tn))
+    (t1, ..., tn) in state['state_vars'][sv]          ('SV_KEY', sv, (t1, ..., tn))
+
+(either side of the '==' may be the state-variable read) where each term t is
+either a method parameter, written ('VAR', id), or a literal, written
+('CONST', value). Anything else is left for the Python function to check.
+
+The module also compiles the precondition code (see compile_preconditions()) into a function
+that is handed the binding of the method's parameters as an argument, rather
+than finding the parameters among its globals. The globals of the code are
+then never written to while grounding, so that any number of groundings of the
+same method may be under way at once. Other functions of the code may read the
+parameters as globals as well, though, and can't be handed them; the
+preconditions of such code are called with the parameters among their globals,
+one binding at a time.
+"""
+
+import ast
+import copy
+import re
+import threading
+
+def analyze(pre_code, parameters):
+    """
+    Returns the list of relational constraints (see above) that can be read
+    off the precondition code in 'pre_code', given the list of the method's
+    parameter ids. Code that doesn't parse, or that doesn't have the expected
+    shape, simply yields no constraints.
+    """
+    try:
+        module = ast.parse(pre_code.strip())
+    except SyntaxError:
+        return []
+
+    function = None
+    for stmt in module.body:
+        if isinstance(stmt, ast.FunctionDef) and stmt.name == 'preconditions':
+            function = stmt
+    if function is None or not function.args.args:
+        return []
+    state_id = function.args.args[0].id
+
+    # the last statement must be the function's only return
+    last = function.body[-1]
+    if not isinstance(last, ast.Return) or last.value is None or \
+            len(_returns(function.body)) != 1:
+        return []
+
+    # names bound inside the function shadow the method's parameters
+    shadowed = _bound_names(function) | set([state_id])
+    variables = set(parameters) - shadowed
+
+    constraints = []
+    for conjunct in _conjuncts(last.value):
+        constraint = _constraint(conjunct, state_id, variables)
+        if constraint:
+            constraints.append(constraint)
+    return constraints
+
+def compile_preconditions(pre_code, parameters, namespace,
+                          name = 'preconditions'):
+    """
+    Compiles the precondition code in 'pre_code' into a function
+
+        preconditions(state, bindings)
+
+    where 'bindings' maps each of the method's parameters (the ids in
+    'parameters') onto its value. The code is run once, with 'namespace' as
+    its globals, which defines its own 'preconditions' function there as well
+    as a copy of it rewritten to take the parameters as arguments after the
+    state, so that every call is handed its own binding without running the
+    code again. If some other function of the code reads a parameter as a
+    global, the code's own function is called instead, with the binding among
+    the globals. Code that fails to compile or to run yields a function that
+    raises an exception when called, and so does its 'preconditions' in
+    'namespace', as the parser's fallback used to.
+    """
+    try:
+        module = ast.parse(pre_code.strip())
+        function = None
+        for stmt in module.body:
+            if isinstance(stmt, ast.FunctionDef) and stmt.name == 'preconditions':
+                function = stmt
+        if function is None or not function.args.args:
+            raise SyntaxError("no preconditions(state) function is defined")
+
+        # the parameters the function names as its own arguments, or declares
+        # global, aren't passed to it
+        taken = set([arg.id for arg in function.args.args if isinstance(arg, ast.Name)]) | \
+                set([function.args.vararg, function.args.kwarg]) | \
+                set([global_name for node in ast.walk(function) if isinstance(node, ast.Global)
+                     for global_name in node.names])
+        params = []
+        for param in parameters:
+            if _IDENTIFIER.match(param) and not param in params and not param in taken:
+                params.append(param)
+        shared = _reads_globals([stmt for stmt in module.body if stmt is not function], set(params))
+        if not shared:
+            bound = copy.deepcopy(function)
+            bound.name = _BOUND
+            bound.args.args[1:1] = [ast.Name(id = param, ctx = ast.Param()) for param in params]
+            module.body.insert(module.body.index(function) + 1, bound)
+        code = compile(ast.fix_missing_locations(module), '<' + name + '>', 'exec')
+        exec code in namespace
+    except Exception as e:
+        message = "The provided precondition code failed to compile (" + \
+                  str(e) + "). Please find the problematic code listed " + \
+                  "below:\n" + pre_code
+        namespace.pop(_BOUND, None)
+        def preconditions(state, bindings = None):
+            raise Exception(message)
+        namespace['preconditions'] = preconditions
+        return preconditions
+
+    if shared:
+        return _with_globals(namespace, params)
+
+    bound = namespace.pop(_BOUND)
+    def preconditions(state, bindings):
+        return bound(state, *[bindings[param] for param in params])
+    return preconditions
+
+def _with_globals(namespace, params):
+    # calls the code's own preconditions function with the binding among the
+    # globals it shares with the code's other functions, one call at a time,
+    # and puts the globals back as they were afterwards
+    lock = threading.Lock()
+    def preconditions(state, bindings):
+        with lock:
+            saved = dict([(param, namespace[param]) for param in params if param in namespace])
+            for param in params:
+                namespace[param] = bindings[param]
+            try:
+                return namespace['preconditions'](state)
+            finally:
+                for param in params:
+                    del namespace[param]
+                namespace.update(saved)
+    return preconditions
+
+# the name the rewritten preconditions function is defined under while the
+# code runs, so as not to replace the one the parser defined
+_BOUND = '_preconditions_of_bindings'
+
+"""
+HELPER FUNCTIONS
+"""
+
+def _returns(stmts):
+    found = []
+    for stmt in stmts:
+        for node in _walk_function_body(stmt):
+            if isinstance(node, (ast.Return, ast.Yield)):
+                found.append(node)
+    return found
+
+def _walk_function_body(node):
+    # like ast.walk, but without descending into nested functions and lambdas
+    todo = [node]
+    while todo:
+        node = todo.pop()
+        yield node
+        for child in ast.iter_child_nodes(node):
+            if not isinstance(child, (ast.FunctionDef, ast.Lambda, ast.ClassDef)):
+                todo.append(child)
+
+def _reads_globals(stmts, names):
+    # whether a function or lambda among 'stmts' reads one of 'names' without
+    # binding it itself (or in a function it's nested in)
+    todo = [(stmt, frozenset(), False) for stmt in stmts]
+    while todo:
+        (node, bound, nested) = todo.pop()
+        if isinstance(node, (ast.FunctionDef, ast.Lambda)):
+            bound = bound | _arguments(node.args)
+            if isinstance(node, ast.FunctionDef):
+                bound = bound | _bound_names(node)
+            nested = True
+        elif nested and isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and \
+                node.id in names and not node.id in bound:
+            return True
+        for child in ast.iter_child_nodes(node):
+            todo.append((child, bound, nested))
+    return False
+
+def _arguments(args):
+    names = set([args.vararg, args.kwarg])
+    for arg in args.args:
+        for node in ast.walk(arg):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Param):
+                names.add(node.id)
+    return names
+
+def _bound_names(function):
+    names = set()
+    for stmt in function.body:
+        for node in _walk_function_body(stmt):
+            if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+                names.add(node.id)
+            elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+                names.add(node.name)
+    return names
+
+def _conjuncts(expr):
+    if isinstance(expr, ast.BoolOp) and isinstance(expr.op, ast.And):
+        result = []
+        for value in expr.values:
+            result.extend(_conjuncts(value))
+        return result
+    return [expr]
+
+def _constraint(expr, state_id, variables):
+    if not (isinstance(expr, ast.Compare) and len(expr.ops) == 1):
+        return None
+    left, op, right = expr.left, expr.ops[0], expr.comparators[0]
+
+    if isinstance(op, ast.Eq):
+        for (read, other) in ((left, right), (right, left)):
+            access = _table_access(read, state_id)
+            if access and access[0] == 'state_vars' and access[2] is not None:
+                key = _terms(access[2], variables)
+                value = _term(other, variables)
+                if key is not None and value is not None:
+                    return ('SV_EQ', access[1], key, value)
+    elif isinstance(op, ast.In):
+        access = _table_access(right, state_id)
+        terms = _terms(left, variables)
+        if access and access[2] is None and terms is not None:
+            if access[0] == 'rigid_rels':
+                return ('REL_IN', access[1], terms)
+            elif access[0] == 'state_vars':
+                return ('SV_KEY', access[1], terms)
+    return None
+
+def _table_access(expr, state_id):
+    """
+    Recognizes state[section][name] (returning (section, name, None)) and
+    state[section][name][key] (returning (section, name, key_node)).
+    """
+    key = None
+    if isinstance(expr, ast.Subscript) and isinstance(expr.value, ast.Subscript) \
+            and isinstance(expr.value.value, ast.Subscript):
+        key = _index(expr)
+        if key is None:
+            return None
+        expr = expr.value
+    if isinstance(expr, ast.Subscript) and isinstance(expr.value, ast.Subscript) \
+            and isinstance(expr.value.value, ast.Name) \
+            and expr.value.value.id == state_id:
+        section, name = _literal(_index(expr.value)), _literal(_index(expr))
+        if section in ('state_vars', 'rigid_rels') and isinstance(name, str):
+            return (section, name, key)
+    return None
+
+def _index(subscript):
+    if isinstance(subscript.slice, ast.Index):
+        return subscript.slice.value
+    return None
+
+def _terms(node, variables):
+    if not isinstance(node, ast.Tuple):
+        return None
+    terms = tuple([_term(elt, variables) for elt in node.elts])
+    if None in terms:
+        return None
+    return terms
+
+def _term(node, variables):
+    if isinstance(node, ast.Name) and node.id in variables:
+        return ('VAR', node.id)
+    value = _literal(node)
+    if value is not _NOT_LITERAL:
+        return ('CONST', value)
+    return None
+
+_NOT_LITERAL = object()
+
+_IDENTIFIER = re.compile(r'^[a-zA-Z_][a-zA-Z_0-9]*$')
+
+def _literal(node):
+    if isinstance(node, ast.Str):
+        return node.s
+    elif isinstance(node, ast.Num):
+        return node.n
+    elif isinstance(node, ast.Name) and node.id in ('True', 'False', 'None'):
+        return {'True': True, 'False': False, 'None': None}[node.id]
+    return _NOT_LITERAL
@@ -31,6 +31,7 @@ class PlanningProblem:
         self.base_dir = os.path.abspath(os.path.join(path_to_zip, os.pardir)) + "/"
         self.temp_dir = os.path.abspath(os.pardir) + "/domains/temp"
         (self.method_table, self.task_table, self.task_method_map) = ({},{},{})
+        self.event_method_map = {}
         self.domain = {}
         self.action_models = {}
         self.commands = {}
@@ -50,7 +51,12 @@ class PlanningProblem:
                     # print("\n\nin PlanningProblem, got task-table = " + _task_table.__repr__() + "\n\n")
                     self.method_table.update(_method_table)
                     self.task_table.update(_task_table)
-                    self.task_method_map.update(_task_method_map)
+                    for task_id, method_ids in _task_method_map.items():
+                        task_methods = self.task_method_map.setdefault(task_id, [])
+                        task_methods.extend([m for m in method_ids if m not in task_methods])
+                    for event_id, method_ids in meth_parser.get_event_method_map().items():
+                        event_methods = self.event_method_map.setdefault(event_id, [])
+                        event_methods.extend([m for m in method_ids if m not in event_methods])
                     # print("\n\nin PlanningProblem, got task-table = " + self.task_table.__repr__() + "\n\n")
                     print("Completed processing .meth file: " + member)
                     print("\n*******************************\n")
@@ -73,6 +79,11 @@ class PlanningProblem:
                     print("\nCompleted processing .cmd file: " + member)
                     print("\n*******************************\n")
 
+            # now that both the methods and the domain are in, make sure the
+            # methods' parameter types refer to actual object sets
+            meth_parser.check_parameter_types(self.method_table,
+                                              self.domain.get('objects', {}))
+
     def cleanup(self):
         sys.path.remove(self.temp_dir)
         shutil.rmtree(self.temp_dir)
@@ -86,6 +97,7 @@ class PlanningProblem:
         self.dump(self.task_table, 1, "TASKS:\n") + "\n" + \
         self.dump(self.method_table, 1, "METHODS:\n") + "\n" + \
         self.dump(self.task_method_map, 1, "TASK-METHOD MAPPING:\n") + "\n" + \
+        self.dump(self.event_method_map, 1, "EVENT-METHOD MAPPING:\n") + "\n" + \
         self.dump(self.action_models, 1, "ACTION MODELS:\n") + "\n" + \
         self.dump(self.commands, 1, "COMMANDS:\n") + "\n"
         return res
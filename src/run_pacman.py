@@ -3,4 +3,5 @@ import RAE
 
 ppi = planning_problem.PlanningProblem('./../domains/pacman.zip')
 RAE.METHOD_RANDOM_ORDER = True
-RAE.Rae(ppi.method_table, ppi.commands, ppi.domain, ppi.task_table, ('play-game', ('',)), debug_flag=True)
+RAE.Rae(ppi.method_table, ppi.commands, ppi.domain, ppi.task_table, ('play-game', ('',)), debug_flag=True,
+        task_method_map=ppi.task_method_map)
@@ -0,0 +1,243 @@
+"""
+Date: Sat, 17 Oct 2026
+Last updated: Sat, 17 Oct 2026
+
+Project: RAE/SeRPE implementation
+Component: State Server
+
+Description:
+A single RAE process is bound to a single core, however many task streams it
+is given. To spread the work over several processes (see RAE.shardedRae),
+every process gets its own agenda, but they all act on one domain state, which
+is kept by a state server.
+
+The StateStore holds the state variables, together with a version number that
+every commit bumps and the version at which each (table, key) entry was last
+written. Each worker keeps a StateReplica, its own copy of the state variables
+that RAE works on as usual, and
+
+    - pull()s in the changes the other workers have committed since it last
+      did, which the store keeps a log of, and
+    - push()es the entries it has written since then, as one commit.
+
+Commits are optimistic: a commit goes through unless an entry it writes has
+been written by some other commit that the worker hadn't pulled yet, in which
+case it's rejected as a whole. The store takes commits one at a time, in the
+order they arrive, so that the first of two conflicting commits always wins
+and the other is always rejected, whatever the timing. A worker whose commit
+was rejected rolls its copy back to the store's version; RAE then retries the
+method that made the writes, just as if the command had failed.
+
+The store is served by a multiprocessing manager, over a local socket. Only
+the state variables are shared; the objects and rigid relations are fixed
+while RAE runs, and every worker has them from the start.
+"""
+
+import copy
+import threading
+from multiprocessing.managers import BaseManager
+
+import state_tracking
+
+class StateStore:
+    """
+    The state variables shared between the workers, which commit their writes
+    to them as lists of (table, key, present, value) entries; present is
+    False for an entry that was deleted. The log of the changes is kept for the
+    last max_log commits, and workers that are further behind are sent the
+    whole state instead.
+    """
+
+    def __init__(self, state_vars, max_log = 10000):
+        self.state_vars = dict([(name, dict(table)) for (name, table) in dict(state_vars).items()])
+        self.version = 0
+        self.entry_versions = {}
+        self.log = []           # entries (version, writes), in order of version
+        self.max_log = max_log
+        self.commits = 0
+        self.conflicts = 0
+        self.lock = threading.Lock()
+
+    def pull(self, since):
+        """
+        Returns (version, changes, state_vars): the store's version, and the
+        writes committed after version 'since', in order. If they're no longer
+        in the log, changes is None, and state_vars is a copy of the whole
+        state (and None otherwise).
+        """
+        with self.lock:
+            # the log holds one entry per version, up to the store's
+            first = self.log[0][0] if self.log else self.version + 1
+            if since < first - 1:
+                return (self.version, None, copy.deepcopy(self.state_vars))
+            changes = []
+            for (_, writes) in self.log[since - first + 1:]:
+                changes.extend(writes)
+            return (self.version, changes, None)
+
+    def commit(self, base, writes, writer = None):
+        """
+        Applies the writes of a worker that is up to date as of version 'base',
+        unless some entry they write has since been written by another worker
+        (the commits of 'writer' itself don't count). Returns (committed,
+        version): whether they were applied, and the version of the store
+        after the commit.
+        """
+        with self.lock:
+            for (name, key, _, _) in writes:
+                (version, last_writer) = self.entry_versions.get((name, key), (0, None))
+                if version > base and (writer is None or last_writer != writer):
+                    self.conflicts += 1
+                    return (False, self.version)
+            if not writes:
+                return (True, self.version)
+            self.version += 1
+            for (name, key, present, value) in writes:
+                table = self.state_vars.setdefault(name, {})
+                if present:
+                    table[key] = value
+                else:
+                    table.pop(key, None)
+                self.entry_versions[(name, key)] = (self.version, writer)
+            self.log.append((self.version, writes))
+            if len(self.log) > self.max_log:
+                del self.log[:len(self.log) - self.max_log]
+            self.commits += 1
+            return (True, self.version)
+
+    def snapshot(self):
+        """
+        Returns (version, state variables).
+        """
+        with self.lock:
+            return (self.version, copy.deepcopy(self.state_vars))
+
+    def stats(self):
+        with self.lock:
+            return dict(version = self.version, commits = self.commits, conflicts = self.conflicts)
+
+
+class StateManager(BaseManager):
+    pass
+
+StateManager.register('StateStore', StateStore)
+
+def serve(state_vars, address = None, authkey = None):
+    """
+    Starts a state server process holding a StateStore of the state variables,
+    listening on 'address' (a Unix socket path, or a free local port if
+    None). Returns (manager, store): the manager, to shut the server down
+    with, and a proxy of the store, which can be handed to the workers.
+    """
+    manager = StateManager(address, authkey)
+    manager.start()
+    return (manager, manager.StateStore(state_vars))
+
+
+class StateReplica:
+    """
+    A worker's copy of the state variables of a StateStore (or of a proxy of
+    one). The copy is kept in a state_tracking.TrackedStateVars, so that the
+    tables written since the last sync are known without looking through the
+    others.
+    """
+
+    def __init__(self, store, name = None):
+        self.store = store
+        self.name = name        # tells the worker's commits apart from the others'
+        self.version = 0
+        self.base = {}
+        self.synced = {}
+
+    def attach(self, state):
+        """
+        Replaces state['state_vars'] with a tracked copy of the store's state
+        variables.
+        """
+        (self.version, state_vars) = self.store.snapshot()
+        self._reset(state, state_vars)
+
+    def pull(self, state):
+        """
+        Brings state['state_vars'] up to date with the commits of the others.
+        Anything written to it since the last push is taken to have been pushed,
+        so it should be pushed first.
+        """
+        (version, changes, state_vars) = self.store.pull(self.version)
+        if changes is None:
+            self._reset(state, state_vars)
+        else:
+            tracked = state['state_vars']
+            for (name, key, present, value) in changes:
+                base = self.base.setdefault(name, {})
+                if name not in tracked:
+                    tracked[name] = {}
+                table = dict.__getitem__(tracked, name)
+                if present:
+                    base[key] = value
+                    # the worker's own writes come back, and needn't invalidate anything
+                    if key not in table or table[key] != value:
+                        table[key] = value
+                else:
+                    base.pop(key, None)
+                    if key in table:
+                        del table[key]
+                self.synced[name] = tracked.tableVersion(name)
+        self.version = version
+
+    def push(self, state):
+        """
+        Commits the entries written in state['state_vars'] since the last sync.
+        Returns True if they were committed, and otherwise rolls the state
+        variables back to those of the store and returns False.
+        """
+        tracked = state['state_vars']
+        writes = []
+        for name in sorted(dict.keys(tracked)):
+            if tracked.tableVersion(name) == self.synced.get(name, 0):
+                continue
+            (table, base) = (dict.__getitem__(tracked, name), self.base.get(name, {}))
+            for key in table:
+                if key not in base or base[key] != table[key]:
+                    writes.append((name, key, True, table[key]))
+            for key in base:
+                if key not in table:
+                    writes.append((name, key, False, None))
+        if not writes:
+            return True
+        (committed, version) = self.store.commit(self.version, writes, self.name)
+        if not committed:
+            (self.version, state_vars) = self.store.snapshot()
+            self._reset(state, state_vars)
+            return False
+        for (name, key, present, value) in writes:
+            base = self.base.setdefault(name, {})
+            if present:
+                base[key] = copy.deepcopy(value)
+            else:
+                base.pop(key, None)
+            self.synced[name] = tracked.tableVersion(name)
+        # the commits of others that came in between still have to be pulled
+        if version == self.version + 1:
+            self.version = version
+        return True
+
+    def _reset(self, state, state_vars):
+        tracked = state.get('state_vars')
+        if isinstance(tracked, state_tracking.TrackedStateVars):
+            # write the tables in place, so that cached candidates are dropped
+            # only for those that changed
+            for name in list(dict.keys(tracked)):
+                if name not in state_vars:
+                    del tracked[name]
+            for (name, table) in state_vars.items():
+                if name not in tracked:
+                    tracked[name] = {}
+                current = dict.__getitem__(tracked, name)
+                if dict(current) != table:
+                    current.clear()
+                    current.update(table)
+        else:
+            tracked = state['state_vars'] = state_tracking.TrackedStateVars(state_vars)
+        self.base = copy.deepcopy(state_vars)
+        self.synced = dict([(name, tracked.tableVersion(name)) for name in state_vars])
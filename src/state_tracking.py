@@ -0,0 +1,374 @@
+"""
+Date: Sat, 17 Oct 2026
+Last updated: Sat, 17 Oct 2026
+
+Project: RAE/SeRPE implementation
+Component: State Tracking
+
+Description:
+RAE grounds the same task with the same arguments over and over again -- once
+when the task is first refined, and again on every retry -- and most of the
+time none of the state its methods' preconditions depend on has changed in
+between. This module makes that cheap to notice.
+
+TrackedStateVars stands in for the 'state_vars' dict of a domain's state. It
+behaves like the plain dict of tables it wraps, but it keeps a version number
+that every write to any of its tables bumps, along with the version at which
+each individual table was last written. While recording is on (see
+startReads() and stopReads()) it also notes the names of the tables that are
+read, so that whoever is reading can tell later on whether anything they
+looked at has changed since. Whoever needs to know what was written, entry by
+entry, can watch() it instead, and whoever is waiting for some tables to be
+written can subscribe() to them, to be told once it happens.
+
+CandidateCache uses this to remember the method candidates of a task: an entry
+stays valid as long as none of the state variables read while computing it has
+been written to. The objects and rigid relations of the state are taken to be
+fixed while RAE runs, as they are everywhere else.
+"""
+
+class TrackedStateVars(dict):
+    """
+    A dict mapping state variable names onto their tables (dicts mapping
+    argument tuples onto values), which keeps track of writes to and reads of
+    those tables. The tables are held as TrackedTables.
+    """
+
+    def __init__(self, state_vars = {}):
+        dict.__init__(self)
+        self.version = 0
+        self._versions = {}
+        self._recording = []
+        self._watchers = []
+        self._subscribers = {}  # maps table names onto {subscriber: (names, callback)}
+        for (name, table) in dict(state_vars).items():
+            dict.__setitem__(self, name, TrackedTable(self, name, table))
+
+    def tableVersion(self, name):
+        """
+        Returns the version at which the table 'name' was last written (0 if it
+        never has been since tracking began).
+        """
+        return self._versions.get(name, 0)
+
+    def startReads(self):
+        """
+        Starts recording the names of the tables that are read. Recordings may
+        be nested; the reads of an inner recording count towards the outer ones.
+        """
+        self._recording.append(set())
+
+    def stopReads(self):
+        """
+        Stops the innermost recording and returns the set of table names read
+        during it. The set contains ALL_TABLES if the tables were read in bulk.
+        """
+        reads = self._recording.pop()
+        if self._recording:
+            self._recording[-1] |= reads
+        return reads
+
+    def noteReads(self, names):
+        """
+        Records the tables in 'names' as read, for whoever reads them by other
+        means than through this dict.
+        """
+        if self._recording:
+            self._recording[-1].update(names)
+
+    def watch(self, watcher):
+        """
+        Has watcher(name, key, old) called after every write to a table: key is
+        the key of the entry written and old is what the entry was before, as
+        (present, value), or key is WHOLE_TABLE (and old None) if the table as a
+        whole was written, replaced or removed.
+        """
+        self._watchers.append(watcher)
+
+    def unwatch(self, watcher):
+        if watcher in self._watchers:
+            self._watchers.remove(watcher)
+
+    def subscribe(self, subscriber, names, callback):
+        """
+        Has callback() called once, after the next write to any of the tables in
+        'names'; 'subscriber' is any hashable object that stands for the
+        subscription (a subscriber has at most one at a time). Unlike watch(),
+        this costs a write to a table nothing but a lookup, however many
+        subscribers are waiting on other tables.
+        """
+        self.unsubscribe(subscriber)
+        for name in names:
+            self._subscribers.setdefault(name, {})[subscriber] = (names, callback)
+
+    def unsubscribe(self, subscriber):
+        for subscribers in self._subscribers.values():
+            subscribers.pop(subscriber, None)
+
+    def _read(self, name):
+        if self._recording:
+            self._recording[-1].add(name)
+
+    def _touch(self, name, key = None, old = None):
+        self.version += 1
+        self._versions[name] = self.version
+        for watcher in self._watchers:
+            watcher(name, key, old)
+        subscribers = self._subscribers.pop(name, None)
+        if subscribers:
+            for (subscriber, (names, callback)) in subscribers.items():
+                for other in names:
+                    if other != name and other in self._subscribers:
+                        self._subscribers[other].pop(subscriber, None)
+                callback()
+
+    def _detach(self, name):
+        # a table that's been replaced or removed no longer reports its writes
+        old = dict.get(self, name)
+        if isinstance(old, TrackedTable):
+            old._owner = None
+
+    """
+    Reads
+    """
+
+    def __getitem__(self, name):
+        self._read(name)
+        return dict.__getitem__(self, name)
+
+    def get(self, name, default = None):
+        self._read(name)
+        return dict.get(self, name, default)
+
+    def __contains__(self, name):
+        self._read(name)
+        return dict.__contains__(self, name)
+
+    def has_key(self, name):
+        return self.__contains__(name)
+
+    def __iter__(self):
+        self._read(ALL_TABLES)
+        return dict.__iter__(self)
+
+    def keys(self):
+        self._read(ALL_TABLES)
+        return dict.keys(self)
+
+    def values(self):
+        self._read(ALL_TABLES)
+        return dict.values(self)
+
+    def items(self):
+        self._read(ALL_TABLES)
+        return dict.items(self)
+
+    def iterkeys(self):
+        return self.__iter__()
+
+    def itervalues(self):
+        self._read(ALL_TABLES)
+        return dict.itervalues(self)
+
+    def iteritems(self):
+        self._read(ALL_TABLES)
+        return dict.iteritems(self)
+
+    """
+    Writes
+    """
+
+    def __setitem__(self, name, table):
+        self._detach(name)
+        dict.__setitem__(self, name, TrackedTable(self, name, table))
+        self._touch(name)
+
+    def __delitem__(self, name):
+        self._detach(name)
+        dict.__delitem__(self, name)
+        self._touch(name)
+
+    def update(self, *args, **kwargs):
+        for (name, table) in dict(*args, **kwargs).items():
+            self[name] = table
+
+    def setdefault(self, name, table = None):
+        if not dict.__contains__(self, name):
+            self[name] = {} if table is None else table
+        return self[name]
+
+    def pop(self, name, *default):
+        if dict.__contains__(self, name):
+            table = self[name]
+            del self[name]
+            return table
+        return dict.pop(self, name, *default)
+
+    def popitem(self):
+        (name, table) = dict.popitem(self)
+        table._owner = None
+        self._touch(name)
+        return (name, table)
+
+    def clear(self):
+        for name in dict.keys(self):
+            del self[name]
+
+    """
+    Copying and pickling drop the tracking, which is only meaningful for the
+    object being tracked
+    """
+
+    def __reduce__(self):
+        return (TrackedStateVars,
+                (dict([(name, dict(table)) for (name, table) in dict.items(self)]),))
+
+    def __repr__(self):
+        return dict.__repr__(self)
+
+
+class TrackedTable(dict):
+    """
+    The table of a single state variable, which reports writes to the
+    TrackedStateVars it belongs to.
+    """
+
+    def __init__(self, owner, name, table = {}):
+        dict.__init__(self, table)
+        self._owner = owner
+        self._name = name
+
+    def _entry(self, key):
+        # what the entry is before a write, if anybody is watching for it
+        if self._owner is not None and self._owner._watchers:
+            return (dict.__contains__(self, key), dict.get(self, key))
+        return None
+
+    def _touch(self, key = None, old = None):
+        if self._owner is not None:
+            self._owner._touch(self._name, key, old)
+
+    def __setitem__(self, key, value):
+        old = self._entry(key)
+        dict.__setitem__(self, key, value)
+        self._touch(key, old)
+
+    def __delitem__(self, key):
+        old = self._entry(key)
+        dict.__delitem__(self, key)
+        self._touch(key, old)
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._touch()
+
+    def setdefault(self, key, value = None):
+        if not dict.__contains__(self, key):
+            self[key] = value
+        return dict.__getitem__(self, key)
+
+    def pop(self, key, *default):
+        if dict.__contains__(self, key):
+            value = dict.pop(self, key)
+            self._touch(key, (True, value))
+            return value
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        item = dict.popitem(self)
+        self._touch(item[0], (True, item[1]))
+        return item
+
+    def clear(self):
+        dict.clear(self)
+        self._touch()
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+    def __repr__(self):
+        return dict.__repr__(self)
+
+
+# stands for every table, when the tables have been read in bulk
+ALL_TABLES = '*'
+
+# stands for every entry of a table, when the table has been written in bulk
+WHOLE_TABLE = None
+
+
+class CandidateCache:
+    """
+    Remembers a value (RAE uses it for the list of candidates of a task) per
+    key, along with the versions of the state variables that were read in
+    computing it, and hands it back for as long as none of them has changed.
+    """
+
+    def __init__(self, max_entries = 1024):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key, state_vars):
+        """
+        Returns the value stored under 'key' if it is still valid in
+        'state_vars', and None otherwise.
+        """
+        value = self.current(key, state_vars)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def current(self, key, state_vars):
+        """
+        Like lookup, but without counting towards the hit and miss counts.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        (owner, version, read_versions, value) = entry
+        if owner is not state_vars:
+            return None
+        if version == state_vars.version:
+            return value
+
+        # something has been written since; see if it's anything that was read
+        if read_versions is not None:
+            for (name, read_version) in read_versions.items():
+                if state_vars.tableVersion(name) != read_version:
+                    break
+            else:
+                self.entries[key] = (owner, state_vars.version, read_versions, value)
+                return value
+        del self.entries[key]
+        return None
+
+    def store(self, key, state_vars, value, reads):
+        """
+        Stores 'value' under 'key', as computed in the current version of
+        'state_vars' from the tables named in 'reads'.
+        """
+        if len(self.entries) >= self.max_entries and not key in self.entries:
+            self.entries.clear()
+        if ALL_TABLES in reads:
+            read_versions = None # only valid until the next write of any kind
+        else:
+            read_versions = dict([(name, state_vars.tableVersion(name)) for name in reads])
+        self.entries[key] = (state_vars, state_vars.version, read_versions, value)
+
+    def tablesRead(self, key):
+        """
+        Returns the names of the tables read in computing the value stored
+        under 'key' (ALL_TABLES among them if they were read in bulk).
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return set()
+        read_versions = entry[2]
+        return set([ALL_TABLES]) if read_versions is None else set(read_versions)
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,381 @@
+"""
+Date: Sat, 17 Oct 2026
+Last updated: Sat, 17 Oct 2026
+
+Project: RAE/SeRPE implementation
+Component: Task Sources
+
+Description:
+RAE used to be handed a single task, and to stop as soon as it had finished
+refining it. The sources in this module instead feed it a stream of tasks for
+as long as they stay open, so that one RAE process can act on tasks as they
+come in:
+
+    QueueSource         tasks put on an in-process queue by other threads
+    UnixSocketSource    tasks sent over a local Unix socket, one per line
+    FileTailSource      tasks appended to a file, one per line
+    ProcessQueueSource  tasks handed over by another process, as the workers
+                        of RAE.shardedRae are
+
+Tasks are passed in as task_events, i.e. as (task_name, (arg1, arg2, ...)).
+On the socket and in the file each one is a line of JSON, either of the form
+
+    {"task": "go", "args": ["r1", "d1"]}
+
+or of the form ["go", ["r1", "d1"]]. A task may be given a priority, a deadline
+(in seconds since the epoch) and a fair-share weight for RAE's agenda (see
+agenda.py), as in
+
+    {"task": "go", "args": ["r1", "d1"], "priority": 1, "deadline": 1760659205.0}
+
+in which case its task_event carries them in a dict as a third element.
+
+The queues the sources hold tasks in are bounded: once one is full, whoever is
+putting tasks on it (the producer thread, or the socket's sender) is held up
+until RAE has taken some off. A file is only read as far as RAE asks for.
+"""
+
+import io
+import os
+import json
+import time
+import socket
+import threading
+import Queue
+from event_log import log, WARNING
+
+class TaskSource:
+    """
+    The interface RAE expects of a task source. A source has to provide poll();
+    the others default to a source that is never closed, and so keeps RAE
+    running until it's stopped.
+    """
+
+    def poll(self, max_items):
+        """
+        Returns a list of at most 'max_items' newly arrived task_events, without
+        waiting for any. Every source has to override this.
+        """
+        raise NotImplementedError
+
+    def wait(self, timeout):
+        """
+        Waits for up to 'timeout' seconds for a task to arrive.
+        """
+        time.sleep(timeout)
+
+    def close(self):
+        """
+        Stops the source from accepting any more tasks; by default, there is
+        nothing to stop.
+        """
+        pass
+
+    def exhausted(self):
+        """
+        Returns True once the source has been closed and every task it took in
+        has been handed to RAE; by default, never.
+        """
+        return False
+
+
+class QueueSource(TaskSource):
+    """
+    A source fed by calls to put(), from any thread.
+    """
+
+    def __init__(self, maxsize = 1000):
+        self.queue = Queue.Queue(maxsize)
+        self.held = []
+        self.closed = False
+
+    def put(self, task_event, block = True, timeout = None):
+        """
+        Adds a task_event to the queue, waiting (if 'block' is True) for up to
+        'timeout' seconds for room on it. Raises Queue.Full if there is no room.
+        """
+        if self.closed:
+            raise SourceClosed("Can't add tasks to a closed source")
+        self.queue.put(to_task_event(task_event), block, timeout)
+
+    def poll(self, max_items):
+        task_events = self.held[:max_items]
+        del self.held[:max_items]
+        while len(task_events) < max_items:
+            try:
+                task_events.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        return task_events
+
+    def wait(self, timeout):
+        # wait on the queue itself, so as to wake up as soon as a task arrives;
+        # the task is held on to until the next poll()
+        if self.held:
+            return
+        try:
+            self.held.append(self.queue.get(True, timeout))
+        except Queue.Empty:
+            pass
+
+    def close(self):
+        self.closed = True
+
+    def exhausted(self):
+        return self.closed and not self.held and self.queue.empty()
+
+
+class UnixSocketSource(QueueSource):
+    """
+    A source that listens on a Unix socket at 'path'. Any number of clients
+    may connect and send task lines; a client is stopped being read from while
+    the queue is full.
+    """
+
+    def __init__(self, path, maxsize = 1000):
+        QueueSource.__init__(self, maxsize)
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(16)
+        self.server.settimeout(0.1)
+        self.thread = threading.Thread(target = self._accept)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _accept(self):
+        while not self.closed:
+            try:
+                (connection, _) = self.server.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            reader = threading.Thread(target = self._read, args = (connection,))
+            reader.daemon = True
+            reader.start()
+
+    def _read(self, connection):
+        try:
+            for line in connection.makefile('r'):
+                if self.closed:
+                    break
+                task_event = parse_line(line)
+                if task_event:
+                    self.queue.put(task_event)
+        finally:
+            connection.close()
+
+    def close(self):
+        QueueSource.close(self)
+        self.server.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class FileTailSource(TaskSource):
+    """
+    A source that reads task lines from the file at 'path' as they are
+    appended to it, like 'tail -F'. The file needn't exist yet. It's kept open
+    between polls; if it's truncated, it's read again from the start, and if
+    it's rotated (another file takes its place at 'path'), the rest of it is
+    read before moving on to the new one. A last line that has yet to end in
+    a newline is held back until it does, or until nothing more will be
+    written to it: the file has been rotated, or the source closed.
+    """
+
+    def __init__(self, path, interval = 0.1):
+        self.path = path
+        self.interval = interval
+        self.tail = None
+        self.offset = 0
+        self.partial = ''
+        self.closed = False
+
+    def poll(self, max_items):
+        task_events = []
+        if not self._follow():
+            return task_events
+        while len(task_events) < max_items:
+            line = self.tail.readline()
+            if not line:
+                if self._rotated():
+                    self._flush(task_events)
+                    self._reopen()
+                    continue
+                if self.closed:
+                    self._flush(task_events)
+                break
+            self.offset = self.tail.tell()
+            if not line.endswith('\n'): # the rest is still being written
+                self.partial += line
+                break
+            (line, self.partial) = (self.partial + line, '')
+            task_event = parse_line(line)
+            if task_event:
+                task_events.append(task_event)
+        return task_events
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+
+    def close(self):
+        self.closed = True
+
+    def exhausted(self):
+        if not self.closed:
+            return False
+        if self.tail is None:
+            return not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        return os.fstat(self.tail.fileno()).st_size <= self.offset and not self._rotated() and \
+            not self.partial
+
+    def _follow(self):
+        # opens the file once it's there, and starts over on it if it has been
+        # truncated below what has been read of it
+        if self.tail is None:
+            if not os.path.exists(self.path):
+                return False
+            self._reopen()
+        elif os.fstat(self.tail.fileno()).st_size < self.offset:
+            self.tail.seek(0)
+            (self.offset, self.partial) = (0, '')
+        return True
+
+    def _flush(self, task_events):
+        # takes the line held back to be whole
+        (line, self.partial) = (self.partial, '')
+        task_event = parse_line(line)
+        if task_event:
+            task_events.append(task_event)
+
+    def _rotated(self):
+        try:
+            current = os.stat(self.path)
+        except OSError: # moved away, and not replaced yet
+            return False
+        opened = os.fstat(self.tail.fileno())
+        return (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino)
+
+    def _reopen(self):
+        # the file is read with io.open, which (unlike a plain file) goes on
+        # reading what is appended to it after it has come to its end
+        if self.tail is not None:
+            self.tail.close()
+        self.tail = io.open(self.path, 'rb')
+        (self.offset, self.partial) = (0, '')
+
+
+"""
+ERRORS
+"""
+
+class ProcessQueueSource(TaskSource):
+    """
+    A source fed by another process through a multiprocessing.Queue, which
+    closes it by putting None on it.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.held = []
+        self.closed = False
+
+    def poll(self, max_items):
+        task_events = self.held[:max_items]
+        del self.held[:max_items]
+        while len(task_events) < max_items and not self.closed:
+            try:
+                task_event = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if task_event is None:
+                self.closed = True
+            else:
+                task_events.append(task_event)
+        return task_events
+
+    def wait(self, timeout):
+        if self.held or self.closed:
+            return
+        try:
+            task_event = self.queue.get(True, timeout)
+        except Queue.Empty:
+            return
+        if task_event is None:
+            self.closed = True
+        else:
+            self.held.append(task_event)
+
+    def close(self):
+        self.closed = True
+
+    def exhausted(self):
+        return self.closed and not self.held
+
+
+class SourceClosed(Exception):
+    pass
+
+class MalformedTask(Exception):
+    pass
+
+
+"""
+HELPER FUNCTIONS
+"""
+
+def parse_line(line):
+    """
+    Returns the task_event a line of JSON describes, or None (after saying why)
+    if it doesn't describe one.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        return to_task_event(json.loads(line))
+    except (ValueError, MalformedTask) as e:
+        if log.warning:
+            log.emit(WARNING, 'malformed_task', line=line, error=str(e))
+        return None
+
+def to_task_event(obj):
+    """
+    Converts a task given as a dict (with 'task' and 'args' keys, and any of
+    the scheduling options) or as a (task, args) pair or (task, args, options)
+    triple into a task_event, with the strings JSON decodes as unicode turned
+    back into plain strings.
+    """
+    if isinstance(obj, dict):
+        if not 'task' in obj:
+            raise MalformedTask("no 'task' given")
+        (name, args) = (obj['task'], obj.get('args', ()))
+        options = dict([(key, obj[key]) for key in SCHEDULING_OPTIONS if key in obj])
+    elif isinstance(obj, (list, tuple)) and len(obj) in (2, 3):
+        (name, args) = obj[:2]
+        options = obj[2] if len(obj) == 3 else {}
+    else:
+        raise MalformedTask("expected a dict or a (task, args) pair")
+    if not isinstance(name, basestring) or not isinstance(args, (list, tuple)):
+        raise MalformedTask("expected a task name and a list of arguments")
+    if not isinstance(options, dict) or \
+            not set(options) <= set(SCHEDULING_OPTIONS) or \
+            not all(isinstance(value, (int, long, float)) for value in options.values()):
+        raise MalformedTask("scheduling options must be numbers, and among " +
+                            ", ".join(SCHEDULING_OPTIONS))
+    task_event = (_plain(name), tuple([_plain(arg) for arg in args]))
+    if options:
+        task_event += (dict([(str(key), value) for (key, value) in options.items()]),)
+    return task_event
+
+SCHEDULING_OPTIONS = ('priority', 'deadline', 'weight')
+
+def _plain(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, list):
+        return tuple([_plain(item) for item in value])
+    return value
@@ -55,6 +55,7 @@ import meth_parser
 import unittest
 import json
 import copy
+import pickle
 
 """
 TEST SETUP
@@ -595,6 +596,48 @@ class EvalBooleanExpressions(unittest.TestCase):
         empty_interpreter_instance.eval(self.not_instr_complex_true, {}, {})
         self.assertEqual(empty_interpreter_instance.ret, (self.val_true, {}, {}))
 
+class EvalParameters(unittest.TestCase):
+    # a method's parameters are bound to value dicts, as RAE grounds them
+    env = dict(
+        r = dict(v_type = 'val_str', val = 'r1'),
+        d = dict(v_type = 'val_str', val = 'd1')
+    )
+
+    state_vars = dict(
+        loc = {('r1',): 'd1'}
+    )
+
+    equals_param_instr = dict(
+        e_type = "E_EQUALS",
+        arg1 = dict(e_type = "E_LOC_VAR_RD", arg1 = 'd'),
+        arg2 = dict(e_type = "E_STRING", val = 'd1')
+    )
+
+    not_equals_param_instr = dict(
+        e_type = "E_EQUALS",
+        arg1 = dict(e_type = "E_LOC_VAR_RD", arg1 = 'r'),
+        arg2 = dict(e_type = "E_STRING", val = 'd1')
+    )
+
+    state_var_rd_instr = dict(
+        e_type = "E_STATE_VAR_RD",
+        arg1 = 'loc',
+        arg2 = [dict(e_type = "E_LOC_VAR_RD", arg1 = 'r')]
+    )
+
+    def test_equals_compares_the_values_of_parameters(self):
+        empty_interpreter_instance.eval(self.equals_param_instr, self.env, {})
+        self.assertEqual(empty_interpreter_instance.ret[0]['val'], True)
+
+        empty_interpreter_instance.eval(self.not_equals_param_instr, self.env, {})
+        self.assertEqual(empty_interpreter_instance.ret[0]['val'], False)
+
+    def test_state_var_rd_keyed_on_parameters(self):
+        empty_interpreter_instance.eval(self.state_var_rd_instr, self.env,
+                                        self.state_vars)
+        self.assertEqual(empty_interpreter_instance.ret[0]['v_type'], 'val_str')
+        self.assertEqual(empty_interpreter_instance.ret[0]['val'], 'd1')
+
 # class EvalSimpleMethod(unittest.TestCase):
 #     def test_eval_expr_meth(self):
 #         (method_table, _, _) = meth_parser.parse("tests.meth")
@@ -899,5 +942,150 @@ state variable).
 # class EvalDecisionNodeProduction(unittest.TestCase):
 
 
+"""
+INTERPRETER INTERNALS: COMPILED EXPRESSIONS
+
+Pure expressions are compiled into closures the first time they're evaluated
+(see the expression compiler in interpreter.py). The closures must reduce
+expressions to the same values as the handlers of the operational semantics
+do, and expressions that can issue decision nodes must not be compiled at all.
+"""
+
+class CompiledExpressions(unittest.TestCase):
+    read_instr = dict(
+        e_type = "E_ADD",
+        arg1 = dict(
+            e_type = "E_STATE_VAR_RD",
+            arg1 = 'charge',
+            arg2 = [dict(
+                e_type = "E_LOC_VAR_RD",
+                arg1 = 'r'
+            )]
+        ),
+        arg2 = dict(
+            e_type = "E_INT",
+            val = 1
+        )
+    )
+
+    read_env = dict(
+        r = 'r1'
+    )
+
+    read_state_vars = dict(
+        charge = {('r1',): 4}
+    )
+
+    mixed_instr = dict(
+        e_type = "E_ADD",
+        arg1 = dict(
+            e_type = "E_STRING",
+            val = "one"
+        ),
+        arg2 = dict(
+            e_type = "E_INT",
+            val = 1
+        )
+    )
+
+    def test_closures_reduce_to_the_same_values(self):
+        expression = interpreter.compile_expression(self.read_instr)
+        self.assertEqual(expression(empty_interpreter_instance, self.read_env,
+                                    self.read_state_vars),
+                         dict(v_type = 'val_num', val = 5))
+        # the handler, with its operands evaluated through eval()
+        interpreter.Interpreter.op_sem['E_ADD'](empty_interpreter_instance,
+                                                self.read_instr, self.read_env,
+                                                self.read_state_vars)
+        self.assertEqual(empty_interpreter_instance.ret[0],
+                         dict(v_type = 'val_num', val = 5))
+
+    def test_method_bodies_are_compiled_once(self):
+        method = dict(id = 'm-charge', exprs = [self.read_instr])
+        closures = interpreter.compile_method_body(method)
+        self.assertEqual(closures.keys(), [id(self.read_instr)])
+        # other tables with the same names in them, as SeRPE's and RAE's are
+        self.assertTrue(interpreter.compile_method_body(method, {}, {}) is closures)
+        self.assertTrue(interpreter.Interpreter(method).closures is closures)
+        self.assertFalse(id(self.read_instr) in
+                         interpreter.compile_method_body(method, {'charge': {}}))
+
+    def test_task_and_action_invocations_are_not_compiled(self):
+        self.assertEqual(interpreter.compile_expression(self.read_instr,
+                                                        task_table = {'charge': {}}),
+                         None)
+        self.assertEqual(interpreter.compile_expression(self.read_instr,
+                                                        action_table = {'charge': None}),
+                         None)
+
+    def test_compiled_reads_are_recorded(self):
+        interp = interpreter.Interpreter(dict(id = 'm-charge', exprs = [self.read_instr]))
+        interp.reads = set()
+        interp.eval(self.read_instr, self.read_env, self.read_state_vars)
+        self.assertEqual(interp.reads, set(['charge']))
+
+    def test_compiled_type_errors(self):
+        interp = interpreter.Interpreter(dict(id = 'm-mixed', exprs = [self.mixed_instr]))
+        self.assertTrue(id(self.mixed_instr) in interp.closures)
+        self.assertRaises(TypeError, interp.eval, self.mixed_instr, {}, {})
+
+
+class Values(unittest.TestCase):
+    flag_instr = dict(
+        e_type = "E_AND",
+        arg1 = dict(
+            e_type = "E_LOC_VAR_RD",
+            arg1 = 'flag'
+        ),
+        arg2 = dict(
+            e_type = "E_TRUE"
+        )
+    )
+
+    sum_instr = dict(
+        e_type = "E_ADD",
+        arg1 = dict(
+            e_type = "E_LOC_VAR_RD",
+            arg1 = 'n'
+        ),
+        arg2 = dict(
+            e_type = "E_INT",
+            val = 1
+        )
+    )
+
+    def test_values_read_as_value_dicts(self):
+        value = interpreter.Value('val_num', 3)
+        self.assertEqual(value, dict(v_type = 'val_num', val = 3))
+        self.assertEqual((value['v_type'], value['val']), ('val_num', 3))
+        self.assertNotEqual(value, dict(v_type = 'val_str', val = 3))
+        self.assertEqual(pickle.loads(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)), value)
+
+    def test_booleans_are_typed_as_booleans(self):
+        self.assertEqual(interpreter.typed(True), dict(v_type = 'val_bool', val = True))
+        self.assertEqual(interpreter.typed(1), dict(v_type = 'val_num', val = 1))
+        # a boolean read from a variable goes with boolean operators
+        empty_interpreter_instance.eval(self.flag_instr, dict(flag = True), {})
+        self.assertEqual(empty_interpreter_instance.ret[0],
+                         dict(v_type = 'val_bool', val = True))
+        interpreter.Interpreter.op_sem['E_AND'](empty_interpreter_instance,
+                                                self.flag_instr, dict(flag = False), {})
+        self.assertEqual(empty_interpreter_instance.ret[0],
+                         dict(v_type = 'val_bool', val = False))
+
+    def test_native_values(self):
+        expression = interpreter.compile_expression(self.sum_instr)
+        self.assertEqual(expression.native(empty_interpreter_instance, dict(n = 2), {}), 3)
+        self.assertEqual(expression(empty_interpreter_instance, dict(n = 2), {}),
+                         dict(v_type = 'val_num', val = 3))
+        # the operand whose type isn't known until it's read is still checked
+        self.assertRaises(TypeError, expression.native, empty_interpreter_instance,
+                          dict(n = True), {})
+
+    def test_literal_values_are_shared(self):
+        literal = interpreter.compile_expression(dict(e_type = "E_STRING", val = "d1"))
+        self.assertTrue(literal(None, {}, {}) is literal(None, {}, {}))
+
+
 if __name__ == '__main__':
     unittest.main()